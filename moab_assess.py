@@ -0,0 +1,252 @@
+"""
+Offline assessments of a Moab policy.
+
+Runs the episodeConfigurations of an assessment config such as
+assess_config.json against the local model with moab_rollout, and writes the
+per-iteration table that tests/test_model_import.py builds from the platform
+logs (see format_kql_logs there), plus the same episode summary metrics.
+
+The policy is either a Python callable given as "module:function", or an
+exported ONNX model when onnxruntime is installed:
+
+    python3 moab_assess.py assess_config.json --policy my_brain:policy
+    python3 moab_assess.py assess_config.json --policy brain.onnx \\
+        --state-fields ball_x ball_y ball_vel_x ball_vel_y
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import argparse
+import csv
+import importlib
+import json
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from moab_model import STATE_FIELDS, STATE_INT_FIELDS, Config
+from moab_rollout import (
+    ACTION_FIELDS,
+    DEFAULT_EPISODE_ITERATION_LIMIT,
+    Policy,
+    Trajectory,
+    load_episode_configs,
+    rollout,
+)
+
+# the leading columns of format_kql_logs, followed by the flattened
+# SimState, SimAction and SimConfig columns
+TABLE_COLUMNS = ("EpisodeId", "IterationIndex", "Reward", "Terminal")
+
+# the observable state and actions of the tutorial brains
+DEFAULT_POLICY_STATE_FIELDS = ("ball_x", "ball_y", "ball_vel_x", "ball_vel_y")
+DEFAULT_POLICY_ACTION_FIELDS = ("input_pitch", "input_roll")
+
+
+class OnnxPolicy:
+    """
+    A policy backed by an exported ONNX model, run with onnxruntime.
+
+    The model's first input takes a (1, len(state_fields)) float32 batch of the
+    named state fields, and its first output returns the named actions in
+    action_fields order. The session is created on first use, so instances
+    can be sent to worker processes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        state_fields: Sequence[str] = DEFAULT_POLICY_STATE_FIELDS,
+        action_fields: Sequence[str] = DEFAULT_POLICY_ACTION_FIELDS,
+    ):
+        # fail here rather than in a worker if onnxruntime is missing
+        importlib.import_module("onnxruntime")
+
+        self.path = path
+        self.state_fields = tuple(state_fields)
+        self.action_fields = tuple(action_fields)
+        self._session = None  # type: Any
+        self._input_name = ""
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state["_session"] = None
+        return state
+
+    def _load(self):
+        import onnxruntime
+
+        # one thread per session, the rollout pool provides the parallelism
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            self.path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_name = self._session.get_inputs()[0].name
+
+    def __call__(self, state: Dict[str, float]) -> Config:
+        if self._session is None:
+            self._load()
+
+        inputs = np.array(
+            [[state[name] for name in self.state_fields]], dtype=np.float32
+        )
+        outputs = self._session.run(None, {self._input_name: inputs})[0]
+        actions = np.asarray(outputs, dtype=np.float64).reshape(-1)
+        if len(actions) != len(self.action_fields):
+            raise ValueError(
+                "{} returned {} actions, expected {} for {}".format(
+                    self.path, len(actions), len(self.action_fields), self.action_fields
+                )
+            )
+        return dict(zip(self.action_fields, actions.tolist()))
+
+
+def load_policy(
+    spec: str,
+    state_fields: Sequence[str] = DEFAULT_POLICY_STATE_FIELDS,
+    action_fields: Sequence[str] = DEFAULT_POLICY_ACTION_FIELDS,
+) -> Policy:
+    """ loads an .onnx file as an OnnxPolicy, or imports a "module:function" """
+    if spec.endswith(".onnx"):
+        return OnnxPolicy(spec, state_fields, action_fields)
+
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(
+            "Expected an .onnx file or a module:function policy, got {}".format(spec)
+        )
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def assessment_table(trajectories: Sequence[Trajectory]) -> List[Dict[str, Any]]:
+    """
+    Flattens trajectories into one row per iteration, with the columns of
+    format_kql_logs: TABLE_COLUMNS, then the state, action and config fields.
+
+    As on the platform the first iteration (IterationIndex 1) is the state
+    after episode start and each later row is the state after the previous
+    row's action, so the terminal row has no action. EpisodeId is the index of
+    the episode's config, and Reward is NaN as no reward is defined locally.
+    """
+    rows = []  # type: List[Dict[str, Any]]
+    no_action = [math.nan] * len(ACTION_FIELDS)
+    for trajectory in trajectories:
+        states = trajectory.states.tolist()
+        actions = trajectory.actions.tolist()
+        for i, state in enumerate(states):
+            row = {
+                "EpisodeId": trajectory.index,
+                "IterationIndex": i + 1,
+                "Reward": math.nan,
+                "Terminal": i == len(actions),
+            }  # type: Dict[str, Any]
+            row.update(zip(STATE_FIELDS, state))
+            for name in STATE_INT_FIELDS:
+                row[name] = int(row[name])
+            row.update(
+                zip(ACTION_FIELDS, actions[i] if i < len(actions) else no_action)
+            )
+            row.update(trajectory.config)
+            rows.append(row)
+    return rows
+
+
+def table_columns(trajectories: Sequence[Trajectory]) -> List[str]:
+    """ the column order of assessment_table() """
+    columns = list(TABLE_COLUMNS) + list(STATE_FIELDS) + list(ACTION_FIELDS)
+    for trajectory in trajectories:
+        columns.extend(key for key in trajectory.config if key not in columns)
+    return columns
+
+
+def write_table(trajectories: Sequence[Trajectory], path: str):
+    """
+    Writes assessment_table() as a CSV laid out like the pandas to_csv() of
+    flattened_telescope.csv, with a leading unnamed row index column.
+    """
+    columns = table_columns(trajectories)
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([""] + columns)
+        for index, row in enumerate(assessment_table(trajectories)):
+            writer.writerow([index] + [row.get(name, "") for name in columns])
+
+
+def summarize(
+    trajectories: Sequence[Trajectory],
+    iteration_limit: int = DEFAULT_EPISODE_ITERATION_LIMIT,
+) -> Dict[str, float]:
+    """
+    The brain_summary.json metrics of test_assessment_brain: the percentage
+    of episodes that ran to the iteration limit, the mean final ball distance
+    to center and speed, and their mean squares over every iteration.
+    """
+    ball_x, ball_y, vel_x, vel_y = (
+        STATE_FIELDS.index(name)
+        for name in ("ball_x", "ball_y", "ball_vel_x", "ball_vel_y")
+    )
+    states = np.concatenate([t.states for t in trajectories])
+    finals = np.array([t.states[-1] for t in trajectories])
+
+    def distance(rows: np.ndarray) -> np.ndarray:
+        return np.hypot(rows[:, ball_x], rows[:, ball_y])
+
+    def speed(rows: np.ndarray) -> np.ndarray:
+        return np.hypot(rows[:, vel_x], rows[:, vel_y])
+
+    full = sum(t.iterations == iteration_limit for t in trajectories)
+    return {
+        "percentage_full_episodes": 100.0 * full / len(trajectories),
+        "avg_final_distance_to_center": float(np.mean(distance(finals))),
+        "avg_final_velocity_magnitude": float(np.mean(speed(finals))),
+        "mse_dist_total": float(np.mean(np.square(distance(states)))),
+        "mse_vel_total": float(np.mean(np.square(speed(states)))),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("config", help="assessment config with episodeConfigurations")
+    parser.add_argument(
+        "--policy",
+        default="moab_rollout:zero_policy",
+        help="module:function or an .onnx file",
+    )
+    parser.add_argument(
+        "--state-fields", nargs="+", default=list(DEFAULT_POLICY_STATE_FIELDS)
+    )
+    parser.add_argument(
+        "--action-fields", nargs="+", default=list(DEFAULT_POLICY_ACTION_FIELDS)
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--iterations", type=int, default=DEFAULT_EPISODE_ITERATION_LIMIT
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="flattened_telescope.csv")
+    parser.add_argument("--summary", default="brain_summary.json")
+    args = parser.parse_args(argv)
+
+    policy = load_policy(args.policy, args.state_fields, args.action_fields)
+    trajectories = rollout(
+        load_episode_configs(args.config),
+        policy,
+        workers=args.workers,
+        iteration_limit=args.iterations,
+        seed=args.seed,
+    )
+    write_table(trajectories, args.output)
+
+    summary = summarize(trajectories, args.iterations)
+    with open(args.summary, "w") as outfile:
+        json.dump(summary, outfile)
+    for key, val in summary.items():
+        print(key, val)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,801 @@
+"""
+Vectorized simulator for many Moab plate+ball devices at once.
+
+MoabBatchModel keeps the state of N independent environments in
+struct-of-arrays form and advances all of them with a single call to
+step(). The physics mirrors MoabModel: with noise and jitter disabled each
+environment tracks an equivalent MoabModel to within floating point rounding.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from moab_model import (
+    CAMERA_Z_POSITION,
+    DEFAULT_BALL_MASS,
+    DEFAULT_BALL_NOISE,
+    DEFAULT_BALL_RADIUS,
+    DEFAULT_BALL_SHELL,
+    DEFAULT_BALL_Z_POSITION,
+    DEFAULT_GRAVITY,
+    DEFAULT_JITTER,
+    DEFAULT_PLATE_ANGLE_LIMIT,
+    DEFAULT_PLATE_ANGULAR_ACCEL,
+    DEFAULT_PLATE_HEIGHT,
+    DEFAULT_PLATE_MAX_ANGULAR_VELOCITY,
+    DEFAULT_PLATE_NOISE,
+    DEFAULT_PLATE_RADIUS,
+    DEFAULT_PLATE_Z_LIMIT,
+    DEFAULT_TIME_DELTA,
+    PLATE_HEIGHT_MAX,
+    PLATE_MAX_Z_VELOCITY,
+    PLATE_ORIGIN_TO_SURFACE_OFFSET,
+    NOISE_SIGMA,
+    PLATE_Z_ACCEL,
+    STATE_FIELDS,
+)
+
+# optional boolean mask selecting a subset of the environments
+Mask = Optional[np.ndarray]
+
+# column order of the actions array accepted by MoabBatchModel.step()
+ACTION_FIELDS = ("pitch", "roll", "height_z")
+
+
+def _assign(dst: np.ndarray, src: np.ndarray, mask: Mask):
+    """ copy src into dst, limited to the masked environments """
+    if mask is None:
+        dst[...] = src
+    else:
+        dst[mask] = src[mask]
+
+
+def _fill(dst: np.ndarray, value: float, mask: Mask):
+    """ set dst to a constant, limited to the masked environments """
+    if mask is None:
+        dst[...] = value
+    else:
+        dst[mask] = value
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    """ normalize an (N, K) array of vectors along the last axis """
+    return vec / np.sqrt(np.sum(vec ** 2, axis=-1))[:, np.newaxis]
+
+
+class MoabBatchModel:
+    """
+    N Moab environments stepped together.
+
+    Scalar quantities that are attributes on MoabModel are (N,) float64
+    arrays here, and vectors such as `ball` or `ball_vel` are (N, 3) arrays
+    (`ball_qat` is (N, 4) in xyzw order). Config values can be changed per
+    environment by writing into the arrays, followed by a call to
+    update_plate(True, mask) and update_ball(True, mask) just like MoabModel.
+    """
+
+    def __init__(self, num_envs: int, seed: Optional[int] = None):
+        if num_envs < 1:
+            raise ValueError("num_envs must be at least 1, got {}".format(num_envs))
+
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+
+        n = num_envs
+
+        # general config
+        self.time_delta = np.zeros(n)
+        self.jitter = np.zeros(n)
+        self.step_time = np.zeros(n)
+        self.elapsed_time = np.zeros(n)
+        self.gravity = np.zeros(n)
+
+        # plate config
+        self.plate_noise = np.zeros(n)
+        self.plate_radius = np.zeros(n)
+        self.plate_theta_limit = np.zeros(n)
+        self.plate_theta_vel_limit = np.zeros(n)
+        self.plate_theta_acc = np.zeros(n)
+        self.plate_z_limit = np.zeros(n)
+
+        # ball config
+        self.ball_noise = np.zeros(n)
+        self.ball_mass = np.zeros(n)
+        self.ball_radius = np.zeros(n)
+        self.ball_shell = np.zeros(n)
+
+        # control input (unitless) [-1..1]
+        self.pitch = np.zeros(n)
+        self.roll = np.zeros(n)
+        self.height_z = np.zeros(n)
+
+        # plate state
+        self.plate_theta_x = np.zeros(n)
+        self.plate_theta_y = np.zeros(n)
+        self.plate = np.zeros((n, 3))
+
+        self.plate_theta_vel_x = np.zeros(n)
+        self.plate_theta_vel_y = np.zeros(n)
+        self.plate_vel_z = np.zeros(n)
+
+        # ball state
+        self.ball = np.zeros((n, 3))
+        self.ball_vel = np.zeros((n, 3))
+        self.ball_acc = np.zeros((n, 3))
+        self.ball_qat = np.zeros((n, 4))
+        self.ball_on_plate = np.zeros((n, 3))
+
+        # current target
+        self.target_x = np.zeros(n)
+        self.target_y = np.zeros(n)
+
+        # current obstacle
+        self.obstacle_distance = np.zeros(n)
+        self.obstacle_direction = np.zeros(n)
+        self.obstacle_radius = np.zeros(n)
+        self.obstacle_x = np.zeros(n)
+        self.obstacle_y = np.zeros(n)
+
+        # camera observed estimated metrics
+        self.estimated_x = np.zeros(n)
+        self.estimated_y = np.zeros(n)
+        self.estimated_vel_x = np.zeros(n)
+        self.estimated_vel_y = np.zeros(n)
+        self.estimated_radius = np.zeros(n)
+
+        # target relative polar coords/vel
+        self.estimated_speed = np.zeros(n)
+        self.estimated_direction = np.zeros(n)
+        self.estimated_distance = np.zeros(n)
+
+        self.prev_estimated_x = np.zeros(n)
+        self.prev_estimated_y = np.zeros(n)
+
+        # meta
+        self.iteration_count = np.zeros(n, dtype=np.int64)
+
+        self.reset()
+
+    def reset(self, mask: Mask = None):
+        """
+        Resets the masked environments (or all of them) to the default state.
+
+        If further changes are applied after reseting, the caller should call:
+            model.update_plate(True, mask)
+            model.update_ball(True, mask)
+        """
+        # general config
+        _fill(self.time_delta, DEFAULT_TIME_DELTA, mask)
+        _fill(self.jitter, DEFAULT_JITTER, mask)
+        _fill(self.step_time, DEFAULT_TIME_DELTA, mask)
+        _fill(self.elapsed_time, 0.0, mask)
+        _fill(self.gravity, DEFAULT_GRAVITY, mask)
+
+        # plate config
+        _fill(self.plate_noise, DEFAULT_PLATE_NOISE, mask)
+        _fill(self.plate_radius, DEFAULT_PLATE_RADIUS, mask)
+        _fill(self.plate_theta_limit, DEFAULT_PLATE_ANGLE_LIMIT, mask)
+        _fill(self.plate_theta_vel_limit, DEFAULT_PLATE_MAX_ANGULAR_VELOCITY, mask)
+        _fill(self.plate_theta_acc, DEFAULT_PLATE_ANGULAR_ACCEL, mask)
+        _fill(self.plate_z_limit, DEFAULT_PLATE_Z_LIMIT, mask)
+
+        # ball config
+        _fill(self.ball_noise, DEFAULT_BALL_NOISE, mask)
+        _fill(self.ball_mass, DEFAULT_BALL_MASS, mask)
+        _fill(self.ball_radius, DEFAULT_BALL_RADIUS, mask)
+        _fill(self.ball_shell, DEFAULT_BALL_SHELL, mask)
+
+        # control input
+        _fill(self.pitch, 0.0, mask)
+        _fill(self.roll, 0.0, mask)
+        _fill(self.height_z, 0.0, mask)
+
+        # plate state
+        _fill(self.plate_theta_x, 0.0, mask)
+        _fill(self.plate_theta_y, 0.0, mask)
+        _fill(self.plate[:, 0], 0.0, mask)
+        _fill(self.plate[:, 1], 0.0, mask)
+        _fill(self.plate[:, 2], DEFAULT_PLATE_HEIGHT, mask)
+
+        _fill(self.plate_theta_vel_x, 0.0, mask)
+        _fill(self.plate_theta_vel_y, 0.0, mask)
+        _fill(self.plate_vel_z, 0.0, mask)
+
+        # ball state
+        _fill(self.ball, 0.0, mask)
+        _fill(self.ball[:, 2], DEFAULT_BALL_Z_POSITION, mask)
+        _fill(self.ball_vel, 0.0, mask)
+        _fill(self.ball_acc, 0.0, mask)
+        _fill(self.ball_qat, 0.0, mask)
+        _fill(self.ball_qat[:, 3], 1.0, mask)
+        _fill(self.ball_on_plate, 0.0, mask)
+        _fill(
+            self.ball_on_plate[:, 2],
+            PLATE_ORIGIN_TO_SURFACE_OFFSET + DEFAULT_BALL_RADIUS,
+            mask,
+        )
+
+        # current target
+        _fill(self.target_x, 0.0, mask)
+        _fill(self.target_y, 0.0, mask)
+
+        # current obstacle
+        _fill(self.obstacle_distance, 0.0, mask)
+        _fill(self.obstacle_direction, 0.0, mask)
+        _fill(self.obstacle_radius, 0.0, mask)
+        _fill(self.obstacle_x, 0.0, mask)
+        _fill(self.obstacle_y, 0.0, mask)
+
+        # camera observed estimated metrics
+        _fill(self.estimated_x, 0.0, mask)
+        _fill(self.estimated_y, 0.0, mask)
+        _fill(self.estimated_vel_x, 0.0, mask)
+        _fill(self.estimated_vel_y, 0.0, mask)
+        _fill(self.estimated_radius, DEFAULT_BALL_RADIUS, mask)
+
+        _fill(self.estimated_speed, 0.0, mask)
+        _fill(self.estimated_direction, 0.0, mask)
+        _fill(self.estimated_distance, 0.0, mask)
+
+        _fill(self.prev_estimated_x, 0.0, mask)
+        _fill(self.prev_estimated_y, 0.0, mask)
+
+        # meta
+        if mask is None:
+            self.iteration_count[...] = 0
+        else:
+            self.iteration_count[mask] = 0
+
+        # make all the derived variables internally consistent
+        self.update_plate(True, mask)
+        self.update_ball(True, mask)
+
+    def halted(self) -> np.ndarray:
+        """
+        Returns an (N,) bool array, True where the ball is off the plate.
+        """
+        # ball.z relative to plate
+        zpos = self.ball[:, 2] - (
+            self.plate[:, 2] + self.ball_radius + PLATE_ORIGIN_TO_SURFACE_OFFSET
+        )
+
+        # ball distance from ball position on plate at origin
+        distance_to_center = np.sqrt(
+            self.ball[:, 0] ** 2 + self.ball[:, 1] ** 2 + zpos ** 2
+        )
+
+        return distance_to_center > self.plate_radius
+
+    def step(self, actions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Single step every environment.
+
+        actions: optional (N, K) array whose columns follow ACTION_FIELDS
+                 (pitch, roll[, height_z]). Values are clamped to [-1..1].
+                 When omitted the current controls are held.
+
+        returns: the halted() mask after the step.
+        """
+        if actions is not None:
+            actions = np.asarray(actions, dtype=np.float64)
+            if actions.ndim != 2 or actions.shape[0] != self.num_envs:
+                raise ValueError(
+                    "Expected actions of shape ({}, K), got {}".format(
+                        self.num_envs, actions.shape
+                    )
+                )
+            controls = (self.pitch, self.roll, self.height_z)
+            for column in range(min(actions.shape[1], len(controls))):
+                np.clip(actions[:, column], -1.0, 1.0, out=controls[column])
+
+        self.step_time[...] = self.time_delta + self.random_noise(self.jitter)
+        self.elapsed_time += self.step_time
+
+        self.update_plate(False)
+        self.update_ball(False)
+
+        # update meta
+        self.iteration_count += 1
+
+        return self.halted()
+
+    def random_noise(self, scalar: np.ndarray) -> np.ndarray:
+        """
+        Per-environment noise in the range [-scalar .. scalar] with a
+        gaussian distribution, the same shape as MoabModel.random_noise.
+        """
+        if not scalar.any():
+            return np.zeros(self.num_envs)
+        noise = self.rng.normal(0.0, NOISE_SIGMA, self.num_envs)
+        return scalar * np.clip(noise, -1, 1)
+
+    @staticmethod
+    def accel_param(
+        q: np.ndarray,
+        dest: np.ndarray,
+        vel: np.ndarray,
+        acc: np.ndarray,
+        max_vel: np.ndarray,
+        delta_t: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized MoabModel.accel_param.
+
+        returns: (final_position, final_velocity)
+        """
+        # direction of accel
+        dir = np.sign(dest - q)
+
+        # calculate the change in velocity and position
+        acc = acc * dir * delta_t
+        vel_end = np.clip(vel + acc * delta_t, -max_vel, max_vel)
+        vel_avg = (vel + vel_end) * 0.5
+        delta = vel_avg * delta_t
+
+        # moving towards the dest? otherwise stop at dest
+        moving = ((dir > 0) & (q + delta < dest)) | ((dir < 0) & (q + delta > dest))
+        return np.where(moving, q + delta, dest), np.where(moving, vel_end, 0.0)
+
+    @staticmethod
+    def heading_to_point(
+        start_x: np.ndarray,
+        start_y: np.ndarray,
+        vel_x: np.ndarray,
+        vel_y: np.ndarray,
+        point_x: np.ndarray,
+        point_y: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Vectorized MoabModel.heading_to_point.
+
+        returns: offset angles in radians in the range [-pi .. pi]
+        """
+        # vector to point
+        dx = point_x - start_x
+        dy = point_y - start_y
+
+        # headings are 0 when at the point or not moving
+        valid = ((dx != 0) | (dy != 0)) & ((vel_x != 0) | (vel_y != 0))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ul = np.hypot(dx, dy)
+            vl = np.hypot(vel_x, vel_y)
+            ux, uy = dx / ul, dy / ul
+            vx, vy = vel_x / vl, vel_y / vl
+
+            # signed angle
+            angle = np.arctan2(-uy * vx + ux * vy, ux * vx + uy * vy)
+
+        return np.where(valid & ~np.isnan(angle), angle, 0.0)
+
+    def _plate_nor(self) -> np.ndarray:
+        """ (N, 3) Z-Up RH plate normals, pitch around X then roll around Y """
+        sx, cx = np.sin(self.plate_theta_x), np.cos(self.plate_theta_x)
+        sy, cy = np.sin(self.plate_theta_y), np.cos(self.plate_theta_y)
+        return np.stack((sy * cx, -sx, cy * cx), axis=1)
+
+    def update_plate(self, plate_reset: bool = False, mask: Mask = None):
+        # Find the target xth,yth & zpos
+        theta_x_target = self.plate_theta_limit * self.pitch  # pitch around X axis
+        theta_y_target = self.plate_theta_limit * self.roll  # roll around Y axis
+        z_target = (self.height_z * self.plate_z_limit) + PLATE_HEIGHT_MAX / 2.0
+
+        # quantize target positions to whole degree increments
+        # the Moab hardware can only command by whole degrees
+        theta_y_target = np.radians(np.round(np.degrees(theta_y_target)))
+        theta_x_target = np.radians(np.round(np.degrees(theta_x_target)))
+
+        # on reset, bypass the motion equations
+        if plate_reset:
+            theta_x = theta_x_target
+            theta_y = theta_y_target
+            z_pos = z_target
+
+        # smooth transition to target based on accel and velocity limits
+        else:
+            theta_x, vel_x = MoabBatchModel.accel_param(
+                self.plate_theta_x,
+                theta_x_target,
+                self.plate_theta_vel_x,
+                self.plate_theta_acc,
+                self.plate_theta_vel_limit,
+                self.step_time,
+            )
+            theta_y, vel_y = MoabBatchModel.accel_param(
+                self.plate_theta_y,
+                theta_y_target,
+                self.plate_theta_vel_y,
+                self.plate_theta_acc,
+                self.plate_theta_vel_limit,
+                self.step_time,
+            )
+            z_pos, vel_z = MoabBatchModel.accel_param(
+                self.plate[:, 2],
+                z_target,
+                self.plate_vel_z,
+                np.full(self.num_envs, PLATE_Z_ACCEL),
+                np.full(self.num_envs, PLATE_MAX_Z_VELOCITY),
+                self.step_time,
+            )
+            _assign(self.plate_theta_vel_x, vel_x, mask)
+            _assign(self.plate_theta_vel_y, vel_y, mask)
+            _assign(self.plate_vel_z, vel_z, mask)
+
+            # add noise to the plate positions
+            theta_x = theta_x + self.random_noise(self.plate_noise)
+            theta_y = theta_y + self.random_noise(self.plate_noise)
+
+        # clamp to range limits
+        theta_x = np.clip(theta_x, -self.plate_theta_limit, self.plate_theta_limit)
+        theta_y = np.clip(theta_y, -self.plate_theta_limit, self.plate_theta_limit)
+        z_pos = np.clip(
+            z_pos,
+            PLATE_HEIGHT_MAX / 2.0 - self.plate_z_limit,
+            PLATE_HEIGHT_MAX / 2.0 + self.plate_z_limit,
+        )
+
+        # Now convert back to plane parameters
+        _assign(self.plate_theta_x, theta_x, mask)
+        _assign(self.plate_theta_y, theta_y, mask)
+        _assign(self.plate[:, 2], z_pos, mask)
+
+    # ball intertia with radius and hollow radius
+    # I = 2/5 * m * ((r^5 - h^5) / (r^3 - h^3))
+    def _ball_inertia(self) -> np.ndarray:
+        hollow_radius = self.ball_radius - self.ball_shell
+        return (
+            2.0
+            / 5.0
+            * self.ball_mass
+            * (
+                (self.ball_radius ** 5.0 - hollow_radius ** 5.0)
+                / (self.ball_radius ** 3.0 - hollow_radius ** 3.0)
+            )
+        )
+
+    def _ray_intersect_surface(self, target: np.ndarray) -> np.ndarray:
+        """
+        Intersect the line from the camera through each (N, 3) target point
+        with the plate surface plane. Returns the (N, 3) contact points.
+        """
+        nor = self._plate_nor()
+        surface = self.plate.copy()
+        surface[:, 2] += PLATE_ORIGIN_TO_SURFACE_OFFSET
+
+        camera = np.array([0.0, 0.0, CAMERA_Z_POSITION])
+        displacement = camera - target
+
+        # t = (pd - p0.n) / rd.n, see pyrr.geometric_tests.ray_intersect_plane
+        pd = np.sum(surface * nor, axis=1)
+        p0_n = CAMERA_Z_POSITION * nor[:, 2]
+        rd_n = np.sum(displacement * nor, axis=1)
+        t = (pd - p0_n) / rd_n
+        return camera + displacement * t[:, np.newaxis]
+
+    def _update_estimated_ball(self, mask: Mask = None):
+        """
+        Ray trace the ball position and an edge of the ball back to the camera
+        origin and use the collision points with the tilted plate to estimate
+        what a camera might perceive the ball position and size to be.
+        """
+        radius_edge = self.ball.copy()
+        radius_edge[:, 0] += self.ball_radius
+
+        contact = self._ray_intersect_surface(self.ball)
+        radius_contact = self._ray_intersect_surface(radius_edge)
+
+        x, y = contact[:, 0], contact[:, 1]
+        r = np.fabs(contact[:, 0] - radius_contact[:, 0])
+
+        # add the noise in
+        estimated_x = x + self.random_noise(self.ball_noise)
+        estimated_y = y + self.random_noise(self.ball_noise)
+        estimated_radius = r + self.random_noise(self.ball_noise)
+        _assign(self.estimated_x, estimated_x, mask)
+        _assign(self.estimated_y, estimated_y, mask)
+        _assign(self.estimated_radius, estimated_radius, mask)
+
+        # Use n-1 states to calculate an estimated velocity.
+        _assign(
+            self.estimated_vel_x,
+            (estimated_x - self.prev_estimated_x) / self.step_time,
+            mask,
+        )
+        _assign(
+            self.estimated_vel_y,
+            (estimated_y - self.prev_estimated_y) / self.step_time,
+            mask,
+        )
+
+        # distance to target
+        _assign(
+            self.estimated_distance,
+            np.sqrt(
+                (self.target_x - estimated_x) ** 2.0
+                + (self.target_y - estimated_y) ** 2.0
+            ),
+            mask,
+        )
+
+        # update the derived states
+        _assign(self.estimated_speed, np.sqrt(np.sum(self.ball_vel ** 2, axis=1)), mask)
+        _assign(
+            self.estimated_direction,
+            MoabBatchModel.heading_to_point(
+                self.estimated_x,
+                self.estimated_y,
+                self.estimated_vel_x,
+                self.estimated_vel_y,
+                self.target_x,
+                self.target_y,
+            ),
+            mask,
+        )
+
+        # update for next time
+        _assign(self.prev_estimated_x, self.estimated_x, mask)
+        _assign(self.prev_estimated_y, self.estimated_y, mask)
+
+        # update ball position in plate origin coordinates, and obstacle distance and direction
+        _assign(self.ball_on_plate, self.world_to_plate(self.ball), mask)
+        _assign(
+            self.obstacle_distance,
+            np.sqrt(
+                (self.ball_on_plate[:, 0] - self.obstacle_x) ** 2.0
+                + (self.ball_on_plate[:, 1] - self.obstacle_y) ** 2.0
+            )
+            - self.ball_radius
+            - self.obstacle_radius,
+            mask,
+        )
+        _assign(
+            self.obstacle_direction,
+            MoabBatchModel.heading_to_point(
+                self.ball[:, 0],
+                self.ball[:, 1],
+                self.ball_vel[:, 0],
+                self.ball_vel[:, 1],
+                self.obstacle_x,
+                self.obstacle_y,
+            ),
+            mask,
+        )
+
+    def _update_ball_z(self, mask: Mask = None):
+        _assign(
+            self.ball[:, 2],
+            self.ball[:, 0] * np.sin(-self.plate_theta_y)
+            + self.ball[:, 1] * np.sin(self.plate_theta_x)
+            + self.ball_radius
+            + self.plate[:, 2]
+            + PLATE_ORIGIN_TO_SURFACE_OFFSET,
+            mask,
+        )
+
+    def _ball_plate_contact(self):
+        # Equations for acceleration on a plate at rest
+        # accel = (mass * g * theta) / (mass + inertia / radius^2)
+        # (y_theta,x are intentional swapped here.)
+        denom = self.ball_mass + self._ball_inertia() / (self.ball_radius ** 2)
+        self.ball_acc[:, 0] = self.plate_theta_y / denom * self.ball_mass * self.gravity
+        self.ball_acc[:, 1] = (
+            -self.plate_theta_x / denom * self.ball_mass * self.gravity
+        )
+        self.ball_acc[:, 2] = 0.0
+
+        # get contact displacement
+        # d = ut + 1/2at^2, v = u + at
+        t = self.step_time[:, np.newaxis]
+        disp = (self.ball_vel * t) + (0.5 * self.ball_acc * (t ** 2))
+        self.ball_vel += self.ball_acc * t
+
+        # simplified ball mechanics against a plane
+        self.ball[:, 0] += disp[:, 0]
+        self.ball[:, 1] += disp[:, 1]
+        self._update_ball_z()
+
+        # For rotation on plate motion we use infinite friction and
+        # perfect ball / plate coupling. See MoabModel._ball_plate_contact.
+        rot_distance = np.hypot(disp[:, 0], disp[:, 1])
+        rolling = rot_distance > 0
+        if not rolling.any():
+            return
+
+        rot_distance = np.where(rolling, rot_distance, 1.0)
+        half_angle = rot_distance / self.ball_radius / 2.0
+        sin_half = np.sin(half_angle)
+        rot_q = _normalize(
+            np.stack(
+                (
+                    disp[:, 1] / rot_distance * sin_half,
+                    -disp[:, 0] / rot_distance * sin_half,
+                    np.zeros(self.num_envs),
+                    np.cos(half_angle),
+                ),
+                axis=1,
+            )
+        )
+
+        # quaternion cross product old_rot x rot_q, see pyrr.quaternion.cross
+        q1x, q1y, q1z, q1w = self.ball_qat.T
+        q2x, q2y, q2z, q2w = rot_q.T
+        new_rot = np.stack(
+            (
+                q1x * q2w + q1y * q2z - q1z * q2y + q1w * q2x,
+                -q1x * q2z + q1y * q2w + q1z * q2x + q1w * q2y,
+                q1x * q2y - q1y * q2x + q1z * q2w + q1w * q2z,
+                -q1x * q2x - q1y * q2y - q1z * q2z + q1w * q2w,
+            ),
+            axis=1,
+        )
+        _assign(self.ball_qat, _normalize(new_rot), rolling)
+
+    def plate_to_world(self, vec: np.ndarray) -> np.ndarray:
+        """ transform (N, 3) plate space points to world space """
+        sx, cx = np.sin(self.plate_theta_x), np.cos(self.plate_theta_x)
+        sy, cy = np.sin(self.plate_theta_y), np.cos(self.plate_theta_y)
+        x, y, z = vec[:, 0], vec[:, 1], vec[:, 2]
+
+        # rotate around X, then around Y
+        y, z = cx * y - sx * z, sx * y + cx * z
+        x, z = cy * x + sy * z, -sy * x + cy * z
+
+        # translate
+        return np.stack(
+            (
+                x + self.plate[:, 0],
+                y + self.plate[:, 1],
+                z + self.plate[:, 2] + PLATE_ORIGIN_TO_SURFACE_OFFSET,
+            ),
+            axis=1,
+        )
+
+    def world_to_plate(self, vec: np.ndarray) -> np.ndarray:
+        """ transform (N, 3) world space points to plate space """
+        sx, cx = np.sin(self.plate_theta_x), np.cos(self.plate_theta_x)
+        sy, cy = np.sin(self.plate_theta_y), np.cos(self.plate_theta_y)
+
+        # translate
+        x = vec[:, 0] - self.plate[:, 0]
+        y = vec[:, 1] - self.plate[:, 1]
+        z = vec[:, 2] - (self.plate[:, 2] + PLATE_ORIGIN_TO_SURFACE_OFFSET)
+
+        # rotate back around X, then around Y
+        y, z = cx * y + sx * z, -sx * y + cx * z
+        x, z = cy * x - sy * z, sy * x + cy * z
+
+        return np.stack((x, y, z), axis=1)
+
+    def set_initial_ball(
+        self, x: np.ndarray, y: np.ndarray, z: np.ndarray, mask: Mask = None
+    ):
+        _assign(self.ball[:, 0], np.broadcast_to(x, self.num_envs), mask)
+        _assign(self.ball[:, 1], np.broadcast_to(y, self.num_envs), mask)
+        _assign(self.ball[:, 2], np.broadcast_to(z, self.num_envs), mask)
+        self._update_ball_z(mask)
+
+        # Set initial observations
+        self._update_estimated_ball(mask)
+
+    def update_ball(self, ball_reset: bool = False, mask: Mask = None):
+        """
+        Update the ball positions with the physics model.
+
+        The mask only applies to resets, the physics always advances every
+        environment.
+        """
+        if ball_reset:
+            # this just ensures that the ball is on the plate
+            self._update_ball_z(mask)
+        else:
+            self._ball_plate_contact()
+
+        # Finally, lets make some approximations for observations
+        self._update_estimated_ball(mask)
+
+    def state_array(self) -> np.ndarray:
+        """
+        Returns the state as a new (N, len(STATE_FIELDS)) float64 array.
+        """
+        out = np.empty((self.num_envs, len(STATE_FIELDS)))
+        self.state_into(out)
+        return out
+
+    def state_into(self, out: np.ndarray):
+        """
+        Writes the state of every environment into a caller supplied
+        (N, len(STATE_FIELDS)) float64 array, one row per environment in
+        the same field order as MoabModel.state_into().
+        """
+        if out.shape != (self.num_envs, len(STATE_FIELDS)):
+            raise ValueError(
+                "Expected a state array of shape ({}, {}), got {}".format(
+                    self.num_envs, len(STATE_FIELDS), out.shape
+                )
+            )
+        for column, values in enumerate(self._state_views().values()):
+            out[:, column] = values
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the same keys as MoabModel.state(), with an (N,) array
+        per key instead of a float. Like MoabModel.state() it is a snapshot:
+        the arrays are copies that later steps don't change.
+        """
+        return {name: np.array(values) for name, values in self._state_views().items()}
+
+    def _state_views(self) -> Dict[str, np.ndarray]:
+        """ the state() arrays, as views of the live model arrays where possible """
+        plate_nor = self._plate_nor()
+
+        return dict(
+            # reflected input controls
+            roll=self.roll,
+            pitch=self.pitch,
+            height_z=self.height_z,
+            # reflected constants
+            time_delta=self.time_delta,
+            jitter=self.jitter,
+            step_time=self.step_time,
+            elapsed_time=self.elapsed_time,
+            gravity=self.gravity,
+            plate_radius=self.plate_radius,
+            plate_theta_vel_limit=self.plate_theta_vel_limit,
+            plate_theta_acc=self.plate_theta_acc,
+            plate_theta_limit=self.plate_theta_limit,
+            plate_z_limit=self.plate_z_limit,
+            ball_mass=self.ball_mass,
+            ball_radius=self.ball_radius,
+            ball_shell=self.ball_shell,
+            obstacle_radius=self.obstacle_radius,
+            obstacle_x=self.obstacle_x,
+            obstacle_y=self.obstacle_y,
+            target_x=self.target_x,
+            target_y=self.target_y,
+            # modelled plate metrics
+            plate_x=self.plate[:, 0],
+            plate_y=self.plate[:, 1],
+            plate_z=self.plate[:, 2],
+            plate_nor_x=plate_nor[:, 0],
+            plate_nor_y=plate_nor[:, 1],
+            plate_nor_z=plate_nor[:, 2],
+            plate_theta_x=self.plate_theta_x,
+            plate_theta_y=self.plate_theta_y,
+            plate_theta_vel_x=self.plate_theta_vel_x,
+            plate_theta_vel_y=self.plate_theta_vel_y,
+            plate_vel_z=self.plate_vel_z,
+            # modelled ball metrics
+            ball_x=self.ball[:, 0],
+            ball_y=self.ball[:, 1],
+            ball_z=self.ball[:, 2],
+            ball_vel_x=self.ball_vel[:, 0],
+            ball_vel_y=self.ball_vel[:, 1],
+            ball_vel_z=self.ball_vel[:, 2],
+            ball_qat_x=self.ball_qat[:, 0],
+            ball_qat_y=self.ball_qat[:, 1],
+            ball_qat_z=self.ball_qat[:, 2],
+            ball_qat_w=self.ball_qat[:, 3],
+            ball_on_plate_x=self.ball_on_plate[:, 0],
+            ball_on_plate_y=self.ball_on_plate[:, 1],
+            obstacle_distance=self.obstacle_distance,
+            obstacle_direction=self.obstacle_direction,
+            # modelled camera observations
+            estimated_x=self.estimated_x,
+            estimated_y=self.estimated_y,
+            estimated_radius=self.estimated_radius,
+            estimated_vel_x=self.estimated_vel_x,
+            estimated_vel_y=self.estimated_vel_y,
+            # modelled positions and velocities
+            estimated_speed=self.estimated_speed,
+            estimated_direction=self.estimated_direction,
+            estimated_distance=self.estimated_distance,
+            ball_noise=self.ball_noise,
+            plate_noise=self.plate_noise,
+            # meta vars
+            ball_fell_off=self.halted().astype(np.int64),
+            iteration_count=self.iteration_count,
+        )
@@ -0,0 +1,341 @@
+"""
+Benchmarks of the Moab model and simulator hot paths.
+
+Each case times single calls with perf_counter_ns() after a warmup, with
+setup and the resets between episodes outside the timed calls and the
+garbage collector off, and reports the median, p95 and p99 call times.
+Results are saved as JSON and can be compared against a baseline saved on
+the same machine, which flags every case whose median slowed down by more
+than the tolerance:
+
+    python3 moab_bench.py --output baseline.json
+    python3 moab_bench.py --baseline baseline.json --tolerance 0.25
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import argparse
+import fnmatch
+import gc
+import json
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from moab_batch_model import MoabBatchModel
+from moab_compact_model import CompactMoabModel
+from moab_model import Config, MoabModel
+
+DEFAULT_CALLS = 2000
+DEFAULT_WARMUP = 200
+DEFAULT_TOLERANCE = 0.25  # allowed slowdown of a median against the baseline
+EPISODE_LENGTH = 250  # calls between resets
+BATCH_SIZES = (1, 16, 256)
+SUBSTEP_COUNTS = (4, 16)
+ADVANCE_STEPS = 250
+RESULTS_VERSION = 1
+
+NO_NOISE = {"ball_noise": 0.0, "plate_noise": 0.0, "jitter": 0.0}
+ACTION = {"input_pitch": 0.05, "input_roll": -0.05}
+
+# the call to time, and the reset to run between episodes
+Timed = Tuple[Callable[[], Any], Callable[[], Any]]
+
+
+class SkipCase(Exception):
+    """ raised by a case's setup when it can't run here """
+
+
+class Case(NamedTuple):
+    """
+    A benchmark. setup() returns the call to time and the reset between
+    episodes of episode_length calls. items is the number of steps per
+    call, e.g. the batch size.
+    """
+
+    name: str
+    setup: Callable[[], Timed]
+    items: int = 1
+    episode_length: int = EPISODE_LENGTH
+
+
+def _model_step(
+    config: Config, engine: str = "python", model_type: type = MoabModel
+) -> Callable[[], Timed]:
+    def setup() -> Timed:
+        model = model_type(seed=0, engine=engine)
+        if model.engine != engine:
+            raise SkipCase("the {} engine is not available".format(engine))
+
+        def reset():
+            model.reset()
+            model.configure(config)
+            model.apply_action(ACTION)
+
+        reset()
+        return model.step, reset
+
+    return setup
+
+
+def _model_advance() -> Timed:
+    model = MoabModel(seed=0)
+
+    # settled and quiet, so advance() takes the closed form, see MoabModel
+    def reset():
+        model.reset()
+        model.configure(dict(NO_NOISE, initial_vel_x=0.005))
+        model.step()
+
+    reset()
+    return lambda: model.advance(ADVANCE_STEPS), reset
+
+
+def _model_state() -> Timed:
+    model = MoabModel(seed=0)
+    model.configure(NO_NOISE)
+    model.apply_action(ACTION)
+    for _ in range(10):
+        model.step()
+    return model.state, lambda: None
+
+
+def _batch_step(num_envs: int, noise: bool) -> Callable[[], Timed]:
+    def setup() -> Timed:
+        batch = MoabBatchModel(num_envs, seed=0)
+
+        def reset():
+            batch.reset()
+            if not noise:
+                for name, value in NO_NOISE.items():
+                    getattr(batch, name)[...] = value
+            batch.pitch[...] = ACTION["input_pitch"]
+            batch.roll[...] = ACTION["input_roll"]
+            batch.update_plate(True)
+            batch.update_ball(True)
+
+        reset()
+        return batch.step, reset
+
+    return setup
+
+
+def _sim() -> Any:
+    """ a MoabSim that isn't connected to the platform """
+    try:
+        from microsoft_bonsai_api.simulator.client import BonsaiClientConfig
+        from moab_sim import MoabSim
+    except ImportError as error:
+        raise SkipCase(str(error))
+    return MoabSim(BonsaiClientConfig(workspace="moab", access_key="utah"))
+
+
+def _sim_episode_start() -> Timed:
+    sim = _sim()
+    return lambda: sim.episode_start({"initial_x": 0.01}), lambda: None
+
+
+def _sim_episode_step() -> Timed:
+    sim = _sim()
+
+    def reset():
+        sim.episode_start(NO_NOISE)
+
+    reset()
+    return lambda: sim.episode_step(ACTION), reset
+
+
+def default_cases() -> List[Case]:
+    cases = [
+        Case("model_step", _model_step(NO_NOISE)),
+        Case("model_step_noise", _model_step({})),
+        Case("model_step_numba", _model_step(NO_NOISE, "numba")),
+        Case("compact_step_numba", _model_step(NO_NOISE, "numba", CompactMoabModel)),
+        Case("model_advance", _model_advance, ADVANCE_STEPS, episode_length=1),
+        Case("model_state", _model_state),
+        Case("sim_episode_start", _sim_episode_start),
+        Case("sim_episode_step", _sim_episode_step),
+    ]
+    for substeps in SUBSTEP_COUNTS:
+        config = dict(NO_NOISE, physics_substeps=substeps)
+        cases.append(
+            Case("model_step_substeps_{}".format(substeps), _model_step(config))
+        )
+    for size in BATCH_SIZES:
+        cases.append(Case("batch_step_{}".format(size), _batch_step(size, False), size))
+        cases.append(
+            Case("batch_step_{}_noise".format(size), _batch_step(size, True), size)
+        )
+    return cases
+
+
+def select_cases(cases: Sequence[Case], patterns: Sequence[str]) -> List[Case]:
+    """ the cases whose names match one of the fnmatch patterns """
+    return [
+        case
+        for case in cases
+        if any(fnmatch.fnmatchcase(case.name, pattern) for pattern in patterns)
+    ]
+
+
+def time_calls(
+    timed: Timed,
+    calls: int = DEFAULT_CALLS,
+    warmup: int = DEFAULT_WARMUP,
+    episode_length: int = EPISODE_LENGTH,
+) -> np.ndarray:
+    """ the time in ns of each of `calls` calls, after `warmup` untimed ones """
+    call, reset = timed
+    counter = time.perf_counter_ns
+    times = np.empty(calls, dtype=np.int64)
+
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(warmup + calls):
+            if i % episode_length == 0:
+                reset()
+            start = counter()
+            call()
+            end = counter()
+            if i >= warmup:
+                times[i - warmup] = end - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return times
+
+
+def summarize(times: np.ndarray, items: int = 1) -> Dict[str, float]:
+    """ percentiles of call times in ns, and the steps per second """
+    p50, p95, p99 = np.percentile(times, (50, 95, 99))
+    return {
+        "calls": float(len(times)),
+        "items": float(items),
+        "median_ns": float(p50),
+        "p95_ns": float(p95),
+        "p99_ns": float(p99),
+        "mean_ns": float(times.mean()),
+        "min_ns": float(times.min()),
+        "items_per_second": float(items * len(times) * 1e9 / times.sum()),
+    }
+
+
+def run_cases(
+    cases: Sequence[Case],
+    calls: int = DEFAULT_CALLS,
+    warmup: int = DEFAULT_WARMUP,
+) -> Dict[str, Any]:
+    """ runs the cases, skipping those that can't run here, as saved to JSON """
+    results = {}  # type: Dict[str, Dict[str, float]]
+    skipped = {}  # type: Dict[str, str]
+    for case in cases:
+        try:
+            timed = case.setup()
+        except SkipCase as reason:
+            skipped[case.name] = str(reason)
+            continue
+        times = time_calls(timed, calls, warmup, case.episode_length)
+        results[case.name] = summarize(times, case.items)
+
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cases": results,
+        "skipped": skipped,
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """ the cases whose median is more than tolerance slower than the baseline """
+    regressions = []  # type: List[str]
+    for name, case in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        ratio = case["median_ns"] / base["median_ns"]
+        if ratio > 1.0 + tolerance:
+            regressions.append(
+                "{}: median {:.0f} ns is {:.0%} slower than the baseline {:.0f} ns".format(
+                    name, case["median_ns"], ratio - 1.0, base["median_ns"]
+                )
+            )
+    return regressions
+
+
+def format_results(
+    results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None
+) -> str:
+    lines = ["case                      median us   p95 us   p99 us   steps/s  vs base"]
+    for name, case in results["cases"].items():
+        versus = ""
+        if baseline is not None and name in baseline["cases"]:
+            ratio = case["median_ns"] / baseline["cases"][name]["median_ns"]
+            versus = "{:+.0%}".format(ratio - 1.0)
+        lines.append(
+            "{:24s} {:10.2f} {:8.2f} {:8.2f} {:9.0f}  {}".format(
+                name,
+                case["median_ns"] / 1e3,
+                case["p95_ns"] / 1e3,
+                case["p99_ns"] / 1e3,
+                case["items_per_second"],
+                versus,
+            )
+        )
+    for name, reason in results["skipped"].items():
+        lines.append("{:24s} skipped: {}".format(name, reason))
+    return "\n".join(lines)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_results(results: Dict[str, Any], path: str):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "cases", nargs="*", help="names or fnmatch patterns of the cases to run"
+    )
+    parser.add_argument("--calls", type=int, default=DEFAULT_CALLS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    cases = default_cases()
+    if args.cases:
+        cases = select_cases(cases, args.cases)
+    results = run_cases(cases, args.calls, args.warmup)
+    baseline = load_results(args.baseline) if args.baseline else None
+    print(format_results(results, baseline))
+
+    if args.output:
+        save_results(results, args.output)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Memory compact variant of the Moab plate+ball model.
+
+CompactMoabModel behaves exactly like MoabModel but keeps all of its dynamic
+state in a single contiguous float64 buffer. Every attribute is a named view
+into that buffer, nothing is stored in the instance __dict__, and copy() is a
+memcpy of the buffer plus the noise generator state. This is meant for
+holding many thousands of models per process.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pyrr import Quaternion, Vector3
+
+from moab_model import (
+    SCALAR_FIELDS,
+    SCALAR_INT_FIELDS,
+    VECTOR_FIELDS,
+    MoabModel,
+    NoiseGenerator,
+)
+
+# pyrr types of the VECTOR_FIELDS
+VECTOR_KINDS = {
+    name: Quaternion if size == 4 else Vector3 for name, size in VECTOR_FIELDS
+}
+
+
+def _build_layout() -> Tuple[Dict[str, slice], int]:
+    layout = {}  # type: Dict[str, slice]
+    offset = 0
+    for name in SCALAR_FIELDS:
+        layout[name] = slice(offset, offset + 1)
+        offset += 1
+    for name, size in VECTOR_FIELDS:
+        layout[name] = slice(offset, offset + size)
+        offset += size
+    return layout, offset
+
+
+# field name -> slice of the state buffer, and the total buffer length
+STATE_LAYOUT, STATE_SIZE = _build_layout()
+
+
+class CompactMoabModel(MoabModel):
+    """
+    A MoabModel whose state lives in one float64 buffer, `buffer`.
+
+    Scalars are read and written through a memoryview of the buffer, and
+    vectors are pyrr views onto slices of it, so in-place updates such as
+    `model.ball.x = 0.1` write straight into the buffer. Vector views are
+    created on access rather than held, as each one costs more memory than
+    the whole buffer.
+    """
+
+    __slots__ = (
+        "_buf",
+        "_mem",
+        "_plate_pose_key",
+        "_plate_pose_cache",
+        "rng",
+        "engine",
+        "_profiler",
+        "_step_state",
+        "_step_noise",
+        "_step_buffer",
+    )
+
+    def __init__(
+        self,
+        buffer: Optional[np.ndarray] = None,
+        seed: Optional[int] = None,
+        engine: str = "python",
+    ):
+        """
+        buffer: an existing state buffer to wrap as is, without a reset.
+        seed:   seeds the model's noise and jitter stream.
+        engine: see MoabModel. The compiled kernel steps the buffer in place.
+        """
+        self._bind(np.zeros(STATE_SIZE) if buffer is None else buffer)
+        if buffer is None:
+            super().__init__(seed, engine)
+        else:
+            self.rng = NoiseGenerator(seed)
+            self._set_engine(engine)
+            self._profiler = None
+            self._plate_pose_key = None
+            self._plate_pose_cache = None
+
+    def _bind(self, buffer: np.ndarray):
+        if buffer.dtype != np.float64 or buffer.shape != (STATE_SIZE,):
+            raise ValueError(
+                "Expected a float64 buffer of shape ({},), got {} {}".format(
+                    STATE_SIZE, buffer.dtype, buffer.shape
+                )
+            )
+        if not buffer.flags.c_contiguous:
+            raise ValueError("State buffer must be contiguous")
+
+        self._buf = buffer
+        self._mem = memoryview(buffer)
+
+    @property
+    def buffer(self) -> np.ndarray:
+        """ the float64 array holding all of the model state """
+        return self._buf
+
+    def copy(self) -> "CompactMoabModel":
+        """
+        Returns an independent model with a copy of this model's state,
+        including the position in its noise stream.
+        """
+        # seeded rather than from OS entropy, as the state is replaced
+        clone = CompactMoabModel(self._buf.copy(), seed=0, engine=self.engine)
+        clone.rng.copy_from(self.rng)
+        clone._plate_pose_key = self._plate_pose_key
+        clone._plate_pose_cache = self._plate_pose_cache
+        return clone
+
+    def _compiled_step(self):
+        self._step_state(self._buf, self._draw_step_noise())
+
+
+def _scalar_property(index: int) -> property:
+    def fget(self: CompactMoabModel) -> float:
+        return self._mem[index]  # type: ignore
+
+    def fset(self: CompactMoabModel, value: float):
+        self._mem[index] = float(value)  # type: ignore
+
+    return property(fget, fset)
+
+
+def _int_scalar_property(index: int) -> property:
+    """ an integer stored as a float """
+
+    def fget(self: CompactMoabModel) -> int:
+        return int(self._mem[index])  # type: ignore
+
+    def fset(self: CompactMoabModel, value: int):
+        self._mem[index] = float(value)  # type: ignore
+
+    return property(fget, fset)
+
+
+def _vector_property(field: slice, kind: type) -> property:
+    def fget(self: CompactMoabModel) -> np.ndarray:
+        return self._buf[field].view(kind)
+
+    def fset(self: CompactMoabModel, value: np.ndarray):
+        self._buf[field] = value
+
+    return property(fget, fset)
+
+
+for _name in SCALAR_FIELDS:
+    if _name in SCALAR_INT_FIELDS:
+        setattr(
+            CompactMoabModel, _name, _int_scalar_property(STATE_LAYOUT[_name].start)
+        )
+    else:
+        setattr(CompactMoabModel, _name, _scalar_property(STATE_LAYOUT[_name].start))
+for _name, _ in VECTOR_FIELDS:
+    setattr(
+        CompactMoabModel,
+        _name,
+        _vector_property(STATE_LAYOUT[_name], VECTOR_KINDS[_name]),
+    )
@@ -0,0 +1,216 @@
+"""
+Runs many Moab simulator sessions in one process.
+
+Instead of one blocking `while sim.run()` loop per interpreter, each MoabSim
+session is an asyncio task. The blocking platform calls of every session
+run on a shared thread pool, so their network waits overlap, while the
+episode callbacks and physics steps run on the event loop in between. Idle
+events wait with asyncio.sleep() rather than holding a thread.
+
+All sessions share one interpreter and its imports, which keeps the memory
+cost per session to its model and connection:
+
+    python3 moab_driver.py --sessions 7
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict, reportUnknownMemberType=false
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+from microsoft_bonsai_api.simulator.client import BonsaiClient, BonsaiClientConfig
+from microsoft_bonsai_api.simulator.generated.models import SimulatorState
+
+from moab_recorder import TrajectoryRecorder
+from moab_sim import MoabSim
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SESSIONS = 7  # the number of processes moab.sh used to start
+
+_T = TypeVar("_T")
+
+
+class SessionDriver:
+    """
+    Drives one MoabSim through the simulator session protocol: register,
+    then report state and handle the returned event until unregistered.
+
+    client is the session's own BonsaiClient, whose blocking calls run on
+    executor.
+    """
+
+    def __init__(
+        self,
+        sim: MoabSim,
+        client: Any,
+        workspace: str,
+        executor: ThreadPoolExecutor,
+    ):
+        self.sim = sim
+        self.client = client
+        self.workspace = workspace
+        self.executor = executor
+        self.session_id = None  # type: Optional[str]
+        self.registered = False
+        self.sequence_id = 1
+        self.event_count = 0
+
+    async def _call(self, func: Callable[..., _T], **kwargs: Any) -> _T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, **kwargs)
+        )
+
+    async def run(self):
+        """ runs the session until the platform unregisters it """
+        registered = await self._call(
+            self.client.session.create,
+            workspace_name=self.workspace,
+            body=self.sim.get_interface(),
+        )
+        self.session_id = registered.session_id
+        self.registered = True
+        log.info("Registered session {}".format(self.session_id))
+
+        try:
+            while await self.advance():
+                continue
+        finally:
+            await self.unregister()
+
+    async def advance(self) -> bool:
+        """ reports the state, handles one event, returns False on unregister """
+        state = SimulatorState(
+            sequence_id=self.sequence_id,
+            state=self.sim.get_state(),
+            halted=self.sim.halted(),
+        )
+        start = time.perf_counter_ns()
+        event = await self._call(
+            self.client.session.advance,
+            workspace_name=self.workspace,
+            session_id=self.session_id,
+            body=state,
+        )
+        # the other sessions run meanwhile, so only the call itself is waiting
+        self.sim.latency["wait"].record(time.perf_counter_ns() - start)
+        self.sequence_id = event.sequence_id
+        self.event_count += 1
+
+        if event.type == "Idle":
+            await asyncio.sleep(event.idle.callback_time)
+        elif event.type == "EpisodeStart":
+            self.sim.episode_start(event.episode_start.config)
+        elif event.type == "EpisodeStep":
+            self.sim.episode_step(event.episode_step.action)
+        elif event.type == "EpisodeFinish":
+            self.sim.episode_finish(event.episode_finish.reason or "")
+        elif event.type == "Unregister":
+            log.info("Session {} unregistered by the platform".format(self.session_id))
+            self.registered = False
+            return False
+        return True
+
+    async def unregister(self):
+        if not self.registered:
+            return
+        self.registered = False
+        try:
+            await self._call(
+                self.client.session.delete,
+                workspace_name=self.workspace,
+                session_id=self.session_id,
+            )
+        except Exception:
+            log.exception("Failed to unregister session {}".format(self.session_id))
+
+
+async def run_sessions(drivers: Sequence[SessionDriver]):
+    """
+    Runs the sessions until each is unregistered. A session that fails is
+    logged and ends without stopping the others.
+    """
+
+    async def run(driver: SessionDriver):
+        try:
+            await driver.run()
+        except Exception:
+            log.exception("Session {} failed".format(driver.session_id))
+
+    await asyncio.gather(*(run(driver) for driver in drivers))
+
+
+def make_drivers(
+    config: BonsaiClientConfig,
+    count: int,
+    executor: ThreadPoolExecutor,
+    split_state: bool = False,
+    record_dir: str = "",
+    record_format: Optional[str] = None,
+) -> List[SessionDriver]:
+    """
+    count MoabSim sessions on the platform of config, one client each.
+    With record_dir, session i records its episodes into record_dir/session_<i>.
+    """
+    drivers = []  # type: List[SessionDriver]
+    for i in range(count):
+        recorder = None
+        if record_dir:
+            session_dir = os.path.join(record_dir, "session_{}".format(i))
+            recorder = TrajectoryRecorder(session_dir, record_format)
+        sim = MoabSim(config, split_state=split_state, recorder=recorder)
+        client = BonsaiClient(config)
+        drivers.append(SessionDriver(sim, client, config.workspace, executor))
+    return drivers
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[1], add_help=False
+    )
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS)
+    parser.add_argument(
+        "--threads", type=int, default=None, help="blocking calls in flight"
+    )
+    args, remaining = parser.parse_known_args(argv)
+
+    # the rest of the command line is for BonsaiClientConfig
+    config = BonsaiClientConfig(argv=[sys.argv[0]] + remaining)
+    threads = args.threads or args.sessions
+    with ThreadPoolExecutor(threads, thread_name_prefix="moab-session") as executor:
+        # the same options as moab_sim.py
+        drivers = make_drivers(
+            config,
+            args.sessions,
+            executor,
+            split_state=bool(int(os.environ.get("MOAB_SPLIT_STATE", "0"))),
+            record_dir=os.environ.get("MOAB_RECORD_DIR", ""),
+            record_format=os.environ.get("MOAB_RECORD_FORMAT") or None,
+        )
+        try:
+            asyncio.run(run_sessions(drivers))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for driver in drivers:
+                if driver.sim.recorder is not None:
+                    driver.sim.recorder.close()
+    log.info(
+        "{} sessions handled {} events in pid {}".format(
+            len(drivers), sum(d.event_count for d in drivers), os.getpid()
+        )
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,161 @@
+"""
+The simulator interface, rendered from the moab_interface.json template.
+
+The template is filled in with the model's constants and current ball state.
+Renders are cached per process, keyed on the template's modification time
+and the values filled in. A build can also write the rendered interface
+next to the template with
+
+    python3 moab_interface.py
+
+so that simulators started from it load plain JSON and never import jinja2.
+The rendered file is only used while it matches the template and values.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# We need to disable a check because the typeshed stubs for jinja are incomplete.
+# pyright: strict, reportUnknownMemberType=false
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from moab_model import MoabModel
+
+log = logging.getLogger(__name__)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.join(_HERE, "moab_interface.json")
+RENDERED_PATH = os.path.join(_HERE, "moab_interface.rendered.json")
+
+# template path, template mtime and template values
+_CacheKey = Tuple[str, int, Tuple[Tuple[str, float], ...]]
+_cache = {}  # type: Dict[_CacheKey, str]
+
+
+def template_params(model: MoabModel) -> Dict[str, float]:
+    """ the values the interface template is rendered with """
+    return dict(
+        initial_pitch=model.pitch,
+        initial_roll=model.roll,
+        initial_height_z=model.height_z,
+        time_delta=model.time_delta,
+        gravity=model.time_delta,
+        physics_substeps=model.physics_substeps,
+        plate_radius=model.plate_radius,
+        plate_theta_vel_limit=model.plate_theta_vel_limit,
+        plate_theta_acc=model.plate_theta_acc,
+        plate_theta_limit=model.plate_theta_limit,
+        plate_z_limit=model.plate_z_limit,
+        ball_mass=model.ball_mass,
+        ball_radius=model.ball_radius,
+        ball_shell=model.ball_shell,
+        obstacle_radius=model.obstacle_radius,
+        obstacle_x=model.obstacle_x,
+        obstacle_y=model.obstacle_y,
+        target_x=model.target_x,
+        target_y=model.target_y,
+        initial_x=model.ball.x,
+        initial_y=model.ball.y,
+        initial_z=model.ball.z,
+        initial_vel_x=model.ball_vel.x,
+        initial_vel_y=model.ball_vel.y,
+        initial_vel_z=model.ball_vel.z,
+        initial_speed=0,
+        initial_direction=0,
+        ball_noise=model.ball_noise,
+        plate_noise=model.plate_noise,
+    )
+
+
+def _read_template(template_path: str) -> str:
+    try:
+        with open(template_path, "r") as file:
+            return file.read()
+    except:
+        log.info("Failed to load interface template file: {}".format(template_path))
+        raise
+
+
+def _template_hash(template_str: str) -> str:
+    return hashlib.sha256(template_str.encode("utf-8")).hexdigest()
+
+
+def render_interface(template_str: str, params: Dict[str, float]) -> Dict[str, Any]:
+    """ renders the template with params, and parses the result """
+    from jinja2 import Template
+
+    return json.loads(Template(template_str).render(**params))
+
+
+def _load_rendered(
+    rendered_path: str, template_str: str, params: Dict[str, float]
+) -> Optional[Dict[str, Any]]:
+    """ the interface from a rendered file, if it matches the template and params """
+    try:
+        with open(rendered_path, "r") as file:
+            rendered = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if (
+        rendered.get("template_sha256") != _template_hash(template_str)
+        or rendered.get("params") != params
+    ):
+        return None
+    return rendered["interface"]
+
+
+def load_interface(
+    model: MoabModel,
+    template_path: str = TEMPLATE_PATH,
+    rendered_path: str = RENDERED_PATH,
+) -> Dict[str, Any]:
+    """
+    The interface rendered for model, from the cache, the rendered file or
+    the template, in that order. The result is the caller's to modify.
+    """
+    params = template_params(model)
+    key = (
+        template_path,
+        os.stat(template_path).st_mtime_ns,
+        tuple(sorted(params.items())),
+    )
+
+    # kept as JSON, which parses into a fresh copy faster than deepcopy()
+    interface_str = _cache.get(key)
+    if interface_str is None:
+        template_str = _read_template(template_path)
+        interface = _load_rendered(rendered_path, template_str, params)
+        if interface is None:
+            interface = render_interface(template_str, params)
+        interface_str = _cache[key] = json.dumps(interface)
+    return json.loads(interface_str)
+
+
+def write_rendered(
+    model: Optional[MoabModel] = None,
+    template_path: str = TEMPLATE_PATH,
+    rendered_path: str = RENDERED_PATH,
+):
+    """ renders the interface of a reset model, or of model, into rendered_path """
+    if model is None:
+        model = MoabModel()
+        model.reset()
+
+    template_str = _read_template(template_path)
+    params = template_params(model)
+    rendered = {
+        "template_sha256": _template_hash(template_str),
+        "params": params,
+        "interface": render_interface(template_str, params),
+    }
+    with open(rendered_path, "w") as file:
+        json.dump(rendered, file, indent=2)
+
+
+if __name__ == "__main__":
+    write_rendered()
+    print("Wrote {}".format(RENDERED_PATH))
@@ -0,0 +1,393 @@
+"""
+Compiled step kernel for the Moab plate+ball model.
+
+step_state() runs one MoabModel.step() on a flat float64 state array laid out
+as moab_compact_model.STATE_LAYOUT, the same math as the reference
+implementation written out as scalar float code. When numba is installed it
+is compiled to machine code, which removes the interpreter overhead that
+dominates the reference step. Without numba it is plain Python and models
+keep using their reference step instead, see MoabModel(engine=...).
+
+Noise is drawn by the caller, in the order the reference step draws it, and
+passed in as an array of STEP_NOISE_SIZE values.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import math
+from typing import Any, Callable
+
+import numpy as np
+
+from moab_compact_model import STATE_LAYOUT, STATE_SIZE
+from moab_model import (
+    CAMERA_Z_POSITION,
+    PLATE_HEIGHT_MAX,
+    PLATE_MAX_Z_VELOCITY,
+    PLATE_ORIGIN_TO_SURFACE_OFFSET,
+    PLATE_Z_ACCEL,
+)
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# True when step_state() is compiled
+COMPILED = numba is not None
+
+# noise values of a step: jitter, plate theta x and y, ball estimated x, y and radius
+STEP_NOISE_SIZE = 6
+
+
+def _jit(func: Callable[..., Any]) -> Callable[..., Any]:
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+# state array indices, see moab_compact_model.STATE_LAYOUT
+_TIME_DELTA = STATE_LAYOUT["time_delta"].start
+_STEP_TIME = STATE_LAYOUT["step_time"].start
+_ELAPSED_TIME = STATE_LAYOUT["elapsed_time"].start
+_GRAVITY = STATE_LAYOUT["gravity"].start
+_PHYSICS_SUBSTEPS = STATE_LAYOUT["physics_substeps"].start
+_PLATE_THETA_LIMIT = STATE_LAYOUT["plate_theta_limit"].start
+_PLATE_THETA_VEL_LIMIT = STATE_LAYOUT["plate_theta_vel_limit"].start
+_PLATE_THETA_ACC = STATE_LAYOUT["plate_theta_acc"].start
+_PLATE_Z_LIMIT = STATE_LAYOUT["plate_z_limit"].start
+_BALL_MASS = STATE_LAYOUT["ball_mass"].start
+_BALL_RADIUS = STATE_LAYOUT["ball_radius"].start
+_BALL_SHELL = STATE_LAYOUT["ball_shell"].start
+_PITCH = STATE_LAYOUT["pitch"].start
+_ROLL = STATE_LAYOUT["roll"].start
+_HEIGHT_Z = STATE_LAYOUT["height_z"].start
+_PLATE_THETA_X = STATE_LAYOUT["plate_theta_x"].start
+_PLATE_THETA_Y = STATE_LAYOUT["plate_theta_y"].start
+_PLATE_THETA_VEL_X = STATE_LAYOUT["plate_theta_vel_x"].start
+_PLATE_THETA_VEL_Y = STATE_LAYOUT["plate_theta_vel_y"].start
+_PLATE_VEL_Z = STATE_LAYOUT["plate_vel_z"].start
+_TARGET_X = STATE_LAYOUT["target_x"].start
+_TARGET_Y = STATE_LAYOUT["target_y"].start
+_OBSTACLE_DISTANCE = STATE_LAYOUT["obstacle_distance"].start
+_OBSTACLE_DIRECTION = STATE_LAYOUT["obstacle_direction"].start
+_OBSTACLE_RADIUS = STATE_LAYOUT["obstacle_radius"].start
+_OBSTACLE_X = STATE_LAYOUT["obstacle_x"].start
+_OBSTACLE_Y = STATE_LAYOUT["obstacle_y"].start
+_ESTIMATED_X = STATE_LAYOUT["estimated_x"].start
+_ESTIMATED_Y = STATE_LAYOUT["estimated_y"].start
+_ESTIMATED_VEL_X = STATE_LAYOUT["estimated_vel_x"].start
+_ESTIMATED_VEL_Y = STATE_LAYOUT["estimated_vel_y"].start
+_ESTIMATED_RADIUS = STATE_LAYOUT["estimated_radius"].start
+_ESTIMATED_SPEED = STATE_LAYOUT["estimated_speed"].start
+_ESTIMATED_DIRECTION = STATE_LAYOUT["estimated_direction"].start
+_ESTIMATED_DISTANCE = STATE_LAYOUT["estimated_distance"].start
+_PREV_ESTIMATED_X = STATE_LAYOUT["prev_estimated_x"].start
+_PREV_ESTIMATED_Y = STATE_LAYOUT["prev_estimated_y"].start
+_ITERATION_COUNT = STATE_LAYOUT["iteration_count"].start
+_PLATE = STATE_LAYOUT["plate"].start
+_BALL = STATE_LAYOUT["ball"].start
+_BALL_VEL = STATE_LAYOUT["ball_vel"].start
+_BALL_ACC = STATE_LAYOUT["ball_acc"].start
+_BALL_QAT = STATE_LAYOUT["ball_qat"].start
+_BALL_ON_PLATE = STATE_LAYOUT["ball_on_plate"].start
+
+
+@_jit
+def _clamp(val: float, min_val: float, max_val: float) -> float:
+    return min(max_val, max(min_val, val))
+
+
+@_jit
+def _accel_param(
+    q: float, dest: float, vel: float, acc: float, max_vel: float, delta_t: float
+) -> Any:
+    """ MoabModel.accel_param() """
+    dir = 0.0
+    if q < dest:
+        dir = 1.0
+    if q > dest:
+        dir = -1.0
+
+    acc = acc * dir * delta_t
+    vel_end = _clamp(vel + acc * delta_t, -max_vel, max_vel)
+    delta = (vel + vel_end) * 0.5 * delta_t
+    if (dir > 0 and q < dest and q + delta < dest) or (
+        dir < 0 and q > dest and q + delta > dest
+    ):
+        return q + delta, vel_end
+    return dest, 0.0
+
+
+@_jit
+def _heading_to_point(
+    start_x: float,
+    start_y: float,
+    vel_x: float,
+    vel_y: float,
+    point_x: float,
+    point_y: float,
+) -> float:
+    """ MoabModel.heading_to_point() """
+    dx = point_x - start_x
+    dy = point_y - start_y
+    if dx == 0 and dy == 0:
+        return 0.0
+    if vel_x == 0 and vel_y == 0:
+        return 0.0
+
+    u_length = math.sqrt(dx * dx + dy * dy)
+    v_length = math.sqrt(vel_x * vel_x + vel_y * vel_y)
+    ux, uy = dx / u_length, dy / u_length
+    vx, vy = vel_x / v_length, vel_y / v_length
+    # + 0.0 for the z terms of the reference's 3D dot products, which turn a
+    # -0.0 into 0.0 and so pick the same side of atan2's branch cut
+    angle = math.atan2(-uy * vx + ux * vy + 0.0, ux * vx + uy * vy + 0.0)
+    if math.isnan(angle):
+        return 0.0
+    return angle
+
+
+@_jit
+def _update_plate(state: np.ndarray, noise: np.ndarray):
+    """ MoabModel.update_plate(False) """
+    limit = state[_PLATE_THETA_LIMIT]
+    theta_x_target = math.radians(round(math.degrees(limit * state[_PITCH])))
+    theta_y_target = math.radians(round(math.degrees(limit * state[_ROLL])))
+    z_target = (state[_HEIGHT_Z] * state[_PLATE_Z_LIMIT]) + PLATE_HEIGHT_MAX / 2.0
+
+    step_time = state[_STEP_TIME]
+    theta_x, state[_PLATE_THETA_VEL_X] = _accel_param(
+        state[_PLATE_THETA_X],
+        theta_x_target,
+        state[_PLATE_THETA_VEL_X],
+        state[_PLATE_THETA_ACC],
+        state[_PLATE_THETA_VEL_LIMIT],
+        step_time,
+    )
+    theta_y, state[_PLATE_THETA_VEL_Y] = _accel_param(
+        state[_PLATE_THETA_Y],
+        theta_y_target,
+        state[_PLATE_THETA_VEL_Y],
+        state[_PLATE_THETA_ACC],
+        state[_PLATE_THETA_VEL_LIMIT],
+        step_time,
+    )
+    z_pos, state[_PLATE_VEL_Z] = _accel_param(
+        state[_PLATE + 2],
+        z_target,
+        state[_PLATE_VEL_Z],
+        PLATE_Z_ACCEL,
+        PLATE_MAX_Z_VELOCITY,
+        step_time,
+    )
+    theta_x += noise[1]
+    theta_y += noise[2]
+
+    state[_PLATE_THETA_X] = _clamp(theta_x, -limit, limit)
+    state[_PLATE_THETA_Y] = _clamp(theta_y, -limit, limit)
+    state[_PLATE + 2] = _clamp(
+        z_pos,
+        PLATE_HEIGHT_MAX / 2.0 - state[_PLATE_Z_LIMIT],
+        PLATE_HEIGHT_MAX / 2.0 + state[_PLATE_Z_LIMIT],
+    )
+
+
+@_jit
+def _ball_inertia_term(state: np.ndarray) -> float:
+    """ mass + inertia / radius^2, see MoabModel._ball_inertia() """
+    mass, radius = state[_BALL_MASS], state[_BALL_RADIUS]
+    hollow_radius = radius - state[_BALL_SHELL]
+    inertia = (
+        2.0
+        / 5.0
+        * mass
+        * (
+            (math.pow(radius, 5.0) - math.pow(hollow_radius, 5.0))
+            / (math.pow(radius, 3.0) - math.pow(hollow_radius, 3.0))
+        )
+    )
+    return mass + inertia / (radius ** 2)
+
+
+@_jit
+def _roll_ball(state: np.ndarray, dx: float, dy: float):
+    """ rotates ball_qat by rolling the ball dx, dy across the plate """
+    rot_distance = math.hypot(dx, dy)
+    if rot_distance <= 0:
+        return
+
+    half_angle = rot_distance / state[_BALL_RADIUS] / 2.0
+    rx = dy / rot_distance * math.sin(half_angle)
+    ry = -dx / rot_distance * math.sin(half_angle)
+    rw = math.cos(half_angle)
+    norm = math.sqrt(rx * rx + ry * ry + rw * rw)
+    rx, ry, rw = rx / norm, ry / norm, rw / norm
+
+    # quaternion cross product q x r with r.z = 0, see pyrr.quaternion.cross
+    qx, qy = state[_BALL_QAT], state[_BALL_QAT + 1]
+    qz, qw = state[_BALL_QAT + 2], state[_BALL_QAT + 3]
+    qx, qy, qz, qw = (
+        qx * rw - qz * ry + qw * rx,
+        qy * rw + qz * rx + qw * ry,
+        qx * ry - qy * rx + qz * rw,
+        -qx * rx - qy * ry + qw * rw,
+    )
+    norm = math.sqrt(qx * qx + qy * qy + qz * qz + qw * qw)
+    state[_BALL_QAT] = qx / norm
+    state[_BALL_QAT + 1] = qy / norm
+    state[_BALL_QAT + 2] = qz / norm
+    state[_BALL_QAT + 3] = qw / norm
+
+
+@_jit
+def _ball_plate_contact(state: np.ndarray):
+    """ MoabModel._ball_plate_contact(), without the ball z update """
+    denominator = _ball_inertia_term(state)
+    mass, gravity = state[_BALL_MASS], state[_GRAVITY]
+    acc_x = state[_PLATE_THETA_Y] / denominator * mass * gravity
+    acc_y = -state[_PLATE_THETA_X] / denominator * mass * gravity
+    state[_BALL_ACC] = acc_x
+    state[_BALL_ACC + 1] = acc_y
+    state[_BALL_ACC + 2] = 0.0
+
+    t = state[_STEP_TIME]
+    vel_x, vel_y = state[_BALL_VEL], state[_BALL_VEL + 1]
+    dx = vel_x * t + 0.5 * acc_x * (t ** 2)
+    dy = vel_y * t + 0.5 * acc_y * (t ** 2)
+    state[_BALL] += dx
+    state[_BALL + 1] += dy
+    state[_BALL_VEL] = vel_x + acc_x * t
+    state[_BALL_VEL + 1] = vel_y + acc_y * t
+    _roll_ball(state, dx, dy)
+
+
+@_jit
+def _substep_ball(state: np.ndarray, start_x: float, start_y: float):
+    """ MoabModel._substep_ball(), without the ball z update """
+    end_x, end_y = state[_PLATE_THETA_X], state[_PLATE_THETA_Y]
+    substeps = int(state[_PHYSICS_SUBSTEPS])
+    t = state[_STEP_TIME] / substeps
+    gain = state[_BALL_MASS] * state[_GRAVITY] / _ball_inertia_term(state)
+
+    acc_x = acc_y = 0.0
+    for substep in range(1, substeps + 1):
+        f = substep / substeps
+        acc_x = gain * (start_y + (end_y - start_y) * f)
+        acc_y = -gain * (start_x + (end_x - start_x) * f)
+
+        vel_x, vel_y = state[_BALL_VEL], state[_BALL_VEL + 1]
+        dx = vel_x * t + 0.5 * acc_x * t * t
+        dy = vel_y * t + 0.5 * acc_y * t * t
+        state[_BALL_VEL] = vel_x + acc_x * t
+        state[_BALL_VEL + 1] = vel_y + acc_y * t
+        state[_BALL] += dx
+        state[_BALL + 1] += dy
+        _roll_ball(state, dx, dy)
+
+    state[_BALL_ACC] = acc_x
+    state[_BALL_ACC + 1] = acc_y
+    state[_BALL_ACC + 2] = 0.0
+
+
+@_jit
+def _update_estimated_ball(state: np.ndarray, noise: np.ndarray):
+    """ MoabModel._update_ball_z() then MoabModel._update_estimated_ball() """
+    # plate pose, see MoabModel._plate_pose()
+    theta_x, theta_y = state[_PLATE_THETA_X], state[_PLATE_THETA_Y]
+    sin_x, cos_x = math.sin(theta_x), math.cos(theta_x)
+    sin_y, cos_y = math.sin(theta_y), math.cos(theta_y)
+    nor_x, nor_y, nor_z = sin_y * cos_x, -sin_x, cos_y * cos_x
+    plate_x, plate_y, plate_z = state[_PLATE], state[_PLATE + 1], state[_PLATE + 2]
+    surface_z = plate_z + PLATE_ORIGIN_TO_SURFACE_OFFSET
+    surface_d = nor_x * plate_x + nor_y * plate_y + nor_z * surface_z
+
+    ball_x, ball_y = state[_BALL], state[_BALL + 1]
+    radius = state[_BALL_RADIUS]
+    ball_z = ball_x * -sin_y + ball_y * sin_x + radius + plate_z
+    ball_z += PLATE_ORIGIN_TO_SURFACE_OFFSET
+    state[_BALL + 2] = ball_z
+
+    # camera ray contacts of the ball center and edge, see _camera_ray_contact()
+    dir_z = CAMERA_Z_POSITION - ball_z
+    t = (surface_d - nor_z * CAMERA_Z_POSITION) / (
+        nor_x * -ball_x + nor_y * -ball_y + nor_z * dir_z
+    )
+    x, y = -ball_x * t, -ball_y * t
+    edge_t = (surface_d - nor_z * CAMERA_Z_POSITION) / (
+        nor_x * -(ball_x + radius) + nor_y * -ball_y + nor_z * dir_z
+    )
+    radius_x = -(ball_x + radius) * edge_t
+
+    estimated_x = x + noise[3]
+    estimated_y = y + noise[4]
+    state[_ESTIMATED_X] = estimated_x
+    state[_ESTIMATED_Y] = estimated_y
+    state[_ESTIMATED_RADIUS] = math.fabs(x - radius_x) + noise[5]
+
+    estimated_vel_x = (estimated_x - state[_PREV_ESTIMATED_X]) / state[_STEP_TIME]
+    estimated_vel_y = (estimated_y - state[_PREV_ESTIMATED_Y]) / state[_STEP_TIME]
+    state[_ESTIMATED_VEL_X] = estimated_vel_x
+    state[_ESTIMATED_VEL_Y] = estimated_vel_y
+
+    target_x, target_y = state[_TARGET_X], state[_TARGET_Y]
+    state[_ESTIMATED_DISTANCE] = math.sqrt(
+        ((target_x - estimated_x) ** 2.0) + ((target_y - estimated_y) ** 2.0)
+    )
+    vel_x, vel_y, vel_z = state[_BALL_VEL], state[_BALL_VEL + 1], state[_BALL_VEL + 2]
+    state[_ESTIMATED_SPEED] = math.sqrt(vel_x * vel_x + vel_y * vel_y + vel_z * vel_z)
+    state[_ESTIMATED_DIRECTION] = _heading_to_point(
+        estimated_x, estimated_y, estimated_vel_x, estimated_vel_y, target_x, target_y
+    )
+
+    state[_PREV_ESTIMATED_X] = estimated_x
+    state[_PREV_ESTIMATED_Y] = estimated_y
+
+    # ball in plate coordinates, see MoabModel._world_to_plate_xyz()
+    px, py, pz = ball_x - plate_x, ball_y - plate_y, ball_z - surface_z
+    py, pz = cos_x * py + sin_x * pz, -sin_x * py + cos_x * pz
+    px, pz = cos_y * px - sin_y * pz, sin_y * px + cos_y * pz
+    state[_BALL_ON_PLATE] = px
+    state[_BALL_ON_PLATE + 1] = py
+    state[_BALL_ON_PLATE + 2] = pz
+
+    obstacle_x, obstacle_y = state[_OBSTACLE_X], state[_OBSTACLE_Y]
+    state[_OBSTACLE_DISTANCE] = (
+        math.sqrt(math.pow(px - obstacle_x, 2.0) + math.pow(py - obstacle_y, 2.0))
+        - radius
+        - state[_OBSTACLE_RADIUS]
+    )
+    state[_OBSTACLE_DIRECTION] = _heading_to_point(
+        ball_x, ball_y, vel_x, vel_y, obstacle_x, obstacle_y
+    )
+
+
+@_jit
+def step_state(state: np.ndarray, noise: np.ndarray):
+    """
+    MoabModel.step() on a STATE_LAYOUT array, in place. noise holds the
+    STEP_NOISE_SIZE noise values of the step, zero where noise is off.
+    """
+    state[_STEP_TIME] = state[_TIME_DELTA] + noise[0]
+    state[_ELAPSED_TIME] += state[_STEP_TIME]
+
+    start_x, start_y = state[_PLATE_THETA_X], state[_PLATE_THETA_Y]
+    _update_plate(state, noise)
+    if state[_PHYSICS_SUBSTEPS] > 1:
+        _substep_ball(state, start_x, start_y)
+    else:
+        _ball_plate_contact(state)
+    _update_estimated_ball(state, noise)
+
+    state[_ITERATION_COUNT] += 1
+
+
+def new_state() -> np.ndarray:
+    """ a zeroed STATE_LAYOUT array """
+    return np.zeros(STATE_SIZE)
+
+
+def new_noise() -> np.ndarray:
+    """ a zeroed noise array for step_state() """
+    return np.zeros(STEP_NOISE_SIZE)
@@ -0,0 +1,213 @@
+"""
+Starts and supervises a fleet of Moab simulator processes.
+
+Instead of a cold interpreter start per simulator, the launcher imports the
+simulator and its dependencies and renders the interface once, then forks
+the workers, which share those pages with it copy-on-write. Each worker is
+pinned to a core and runs a MoabSim like moab_sim.py. A worker that crashes
+is restarted after a delay that doubles with every crash in a row, one that
+is unregistered by the platform is done.
+
+By default there is one worker per core this process may run on:
+
+    python3 moab_launcher.py --workers 7
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict, reportUnknownMemberType=false
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from typing import Any, Callable, List, Optional, Sequence
+
+from microsoft_bonsai_api.simulator.client import BonsaiClientConfig
+
+from moab_interface import load_interface
+from moab_model import MoabModel
+from moab_sim import run_simulator
+
+log = logging.getLogger(__name__)
+
+RESTART_DELAY = 1.0  # s, before the first restart of a crashed worker
+MAX_RESTART_DELAY = 60.0  # s
+STABLE_RUN_TIME = 60.0  # s, a worker up this long starts over at RESTART_DELAY
+
+Worker = Callable[[int], None]
+
+
+def available_cpus() -> List[int]:
+    """ the cores this process may run on """
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # not available on every platform
+        return list(range(os.cpu_count() or 1))
+
+
+class _Slot:
+    """ one supervised worker: its process, core and restart schedule """
+
+    def __init__(self, index: int, cpu: int):
+        self.index = index
+        self.cpu = cpu
+        self.process = None  # type: Optional[Any]
+        self.started = 0.0
+        self.crashes = 0  # in a row
+        self.restart_at = 0.0
+        self.done = False
+
+
+class Launcher:
+    """
+    Runs worker(i) for i in range(count) in forked processes, worker i pinned
+    to cpus[i % len(cpus)] when pin is set. A worker that exits with an error
+    is restarted, one that returns is done, and run() returns once every
+    worker is done.
+    """
+
+    def __init__(
+        self,
+        worker: Worker,
+        count: Optional[int] = None,
+        cpus: Optional[Sequence[int]] = None,
+        pin: bool = True,
+        restart_delay: float = RESTART_DELAY,
+        max_restart_delay: float = MAX_RESTART_DELAY,
+        stable_run_time: float = STABLE_RUN_TIME,
+    ):
+        cpus = list(cpus) if cpus is not None else available_cpus()
+        if count is None:
+            count = len(cpus)
+
+        self.worker = worker
+        self.pin = pin
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_run_time = stable_run_time
+        self.slots = [_Slot(i, cpus[i % len(cpus)]) for i in range(count)]
+        self.restarts = 0
+        self._context = multiprocessing.get_context("fork")
+
+    def run(self):
+        """ starts the workers and supervises them until they are all done """
+        # objects the collector never visits stay shared with the workers
+        gc.freeze()
+        for slot in self.slots:
+            self._start(slot)
+        try:
+            while not all(slot.done for slot in self.slots):
+                self._supervise()
+        finally:
+            self.stop()
+            gc.unfreeze()
+
+    def stop(self):
+        """ terminates the running workers """
+        running = [slot.process for slot in self.slots if slot.process is not None]
+        for process in running:
+            if process.is_alive():
+                process.terminate()
+        for process in running:
+            process.join()
+        for slot in self.slots:
+            slot.process = None
+
+    def _start(self, slot: _Slot):
+        slot.process = self._context.Process(
+            target=self._run_worker,
+            args=(slot.index, slot.cpu),
+            name="moab-worker-{}".format(slot.index),
+        )
+        slot.process.start()
+        slot.started = time.monotonic()
+
+    def _run_worker(self, index: int, cpu: int):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.pin:
+            os.sched_setaffinity(0, {cpu})
+        self.worker(index)
+
+    def _supervise(self):
+        """ waits for a worker to exit or be due a restart, and handles it """
+        running = [s.process.sentinel for s in self.slots if s.process is not None]
+        pending = [s.restart_at for s in self.slots if s.process is None and not s.done]
+        timeout = None
+        if pending:
+            timeout = max(0.0, min(pending) - time.monotonic())
+        wait(running, timeout)
+
+        now = time.monotonic()
+        for slot in self.slots:
+            process = slot.process
+            if process is not None and not process.is_alive():
+                process.join()
+                slot.process = None
+                if process.exitcode == 0:
+                    log.info("Worker {} is done".format(slot.index))
+                    slot.done = True
+                    continue
+
+                if now - slot.started >= self.stable_run_time:
+                    slot.crashes = 0
+                delay = min(
+                    self.restart_delay * 2 ** slot.crashes, self.max_restart_delay
+                )
+                slot.crashes += 1
+                slot.restart_at = now + delay
+                log.warning(
+                    "Worker {} exited with code {}, restarting in {:.1f} s".format(
+                        slot.index, process.exitcode, delay
+                    )
+                )
+            elif process is None and not slot.done and now >= slot.restart_at:
+                self.restarts += 1
+                self._start(slot)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[1], add_help=False
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="default: one per available core"
+    )
+    parser.add_argument(
+        "--no-pin", action="store_true", help="let workers run on any core"
+    )
+    args, remaining = parser.parse_known_args(argv)
+
+    # the rest of the command line is for BonsaiClientConfig
+    config = BonsaiClientConfig(argv=[sys.argv[0]] + remaining)
+    record_dir = os.environ.get("MOAB_RECORD_DIR", "")
+
+    # rendered here, the workers find the interface in their copy of the cache
+    model = MoabModel()
+    model.reset()
+    load_interface(model)
+
+    def worker(index: int):
+        session_dir = ""
+        if record_dir:
+            session_dir = os.path.join(record_dir, "session_{}".format(index))
+        run_simulator(config, session_dir)
+
+    # stop the workers along with the launcher
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    launcher = Launcher(worker, args.workers, pin=not args.no_pin)
+    log.info("Starting {} Moab simulators".format(len(launcher.slots)))
+    try:
+        launcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,344 @@
+"""
+A local stand-in for the platform's simulator session API.
+
+MockPlatform serves the register, advance and unregister calls that
+MoabSim and moab_driver.py make, so the whole simulator I/O path can be
+run and timed without the live platform. Each registered session is sent
+episodes of the given configs, with actions from a local policy, until it
+has run its share of episodes and is told to unregister. A delay can be
+added to every advance response to stand in for network and platform
+latency.
+
+For every session the server times each iteration's round trip, from one
+advance call to the next, and the share of it spent in the simulator, from
+sending an event to receiving the next call. stats() reports percentiles of
+both over all sessions.
+
+    python3 moab_mock_server.py --port 9000 --sessions 7 --episodes 10 &
+    SIM_API_HOST=http://localhost:9000 SIM_WORKSPACE=local SIM_ACCESS_KEY=local \\
+        python3 moab_driver.py --sessions 7
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import argparse
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from moab_assess import load_policy
+from moab_model import Config
+from moab_rollout import (
+    DEFAULT_EPISODE_ITERATION_LIMIT,
+    Policy,
+    load_episode_configs,
+    zero_policy,
+)
+
+DEFAULT_EPISODES = 10  # per session
+LATENCY_PERCENTILES = (50, 90, 99)
+
+_SESSIONS_PATH = re.compile(r"^/v2/workspaces/([^/]+)/simulatorSessions/?$")
+_SESSION_PATH = re.compile(r"^/v2/workspaces/([^/]+)/simulatorSessions/([^/]+)/?$")
+_ADVANCE_PATH = re.compile(
+    r"^/v2/workspaces/([^/]+)/simulatorSessions/([^/]+)/advance/?$"
+)
+
+
+class MockSession:
+    """ the episode schedule and timings of one registered session """
+
+    def __init__(self, session_id: str, interface: Dict[str, Any], episodes: int):
+        self.session_id = session_id
+        self.interface = interface
+        self.episodes_left = episodes
+        self.sequence_id = 0
+        self.iteration = 0
+        self.in_episode = False
+
+        self.registered_at = time.perf_counter()
+        self.finished_at = None  # type: Optional[float]
+        self.last_request = None  # type: Optional[float]
+        self.last_response = None  # type: Optional[float]
+        self.round_trips = []  # type: List[float]
+        self.sim_times = []  # type: List[float]
+
+
+class MockPlatform(ThreadingHTTPServer):
+    """
+    A simulator session API on (host, port); port 0 picks a free one.
+
+    configs:         episode configs, handed out in turn across sessions.
+    policy:          maps a session's state to the action of each step.
+    episodes:        episodes each session runs before it is unregistered.
+    iteration_limit: steps before an episode that hasn't halted finishes.
+    latency:         seconds added to each advance response, plus up to
+                     latency_jitter more at random.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 0,
+        configs: Sequence[Config] = ({},),
+        policy: Policy = zero_policy,
+        episodes: int = DEFAULT_EPISODES,
+        iteration_limit: int = DEFAULT_EPISODE_ITERATION_LIMIT,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+    ):
+        super().__init__((host, port), _MockHandler)
+        self.configs = itertools.cycle(list(configs))
+        self.policy = policy
+        self.episodes = episodes
+        self.iteration_limit = iteration_limit
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+
+        self.lock = threading.Lock()
+        self.sessions = {}  # type: Dict[str, MockSession]
+        self.finished = []  # type: List[MockSession]
+        self._session_ids = itertools.count(1)
+        self._random = random.Random(0)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def serve_in_background(self) -> threading.Thread:
+        """ serves from a daemon thread until shutdown() """
+        thread = threading.Thread(
+            target=self.serve_forever, name="MockPlatform", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def wait_for_sessions(self, count: int, timeout: Optional[float] = None) -> bool:
+        """ waits until count sessions have unregistered """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.finished) < count:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def register(self, interface: Dict[str, Any]) -> MockSession:
+        with self.lock:
+            session_id = "mock-{}".format(next(self._session_ids))
+            session = MockSession(session_id, interface, self.episodes)
+            self.sessions[session_id] = session
+            return session
+
+    def unregister(self, session_id: str) -> bool:
+        """ ends a session, False if it was never registered """
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return any(s.session_id == session_id for s in self.finished)
+            session.finished_at = time.perf_counter()
+            self.finished.append(session)
+            return True
+
+    def advance(self, session: MockSession, state: Dict[str, Any]) -> Dict[str, Any]:
+        """ the next event for a session, given the state it reported """
+        now = time.perf_counter()
+        if session.last_request is not None and session.last_response is not None:
+            session.round_trips.append(now - session.last_request)
+            session.sim_times.append(now - session.last_response)
+        session.last_request = now
+
+        session.sequence_id = int(state.get("sequenceId", session.sequence_id)) + 1
+        event = self._next_event(
+            session, state.get("state") or {}, bool(state.get("halted"))
+        )
+        event["sessionId"] = session.session_id
+        event["sequenceId"] = session.sequence_id
+
+        delay = self.latency + self._random.random() * self.latency_jitter
+        if delay > 0:
+            time.sleep(delay)
+        return event
+
+    def _next_event(
+        self, session: MockSession, state: Dict[str, Any], halted: bool
+    ) -> Dict[str, Any]:
+        if session.in_episode:
+            if halted or session.iteration >= self.iteration_limit:
+                session.in_episode = False
+                reason = "Terminal" if halted else "EpisodeComplete"
+                return {"type": "EpisodeFinish", "episodeFinish": {"reason": reason}}
+
+            session.iteration += 1
+            action = dict(self.policy(state))
+            return {"type": "EpisodeStep", "episodeStep": {"action": action}}
+
+        if session.episodes_left <= 0:
+            # the simulator doesn't unregister itself after this
+            self.unregister(session.session_id)
+            return {
+                "type": "Unregister",
+                "unregister": {"reason": "Finished", "details": ""},
+            }
+
+        session.episodes_left -= 1
+        session.iteration = 0
+        session.in_episode = True
+        with self.lock:
+            config = dict(next(self.configs))
+        return {"type": "EpisodeStart", "episodeStart": {"config": config}}
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Percentiles in seconds of the iteration round trips and of the time
+        spent in the simulators, over every session so far, and the
+        iterations per second of the finished sessions, from the first
+        registering to the last unregistering.
+        """
+        with self.lock:
+            sessions = self.finished + list(self.sessions.values())
+        round_trips = np.array([t for s in sessions for t in s.round_trips])
+        sim_times = np.array([t for s in sessions for t in s.sim_times])
+
+        stats = {"iterations": float(len(round_trips))}  # type: Dict[str, float]
+        for name, times in (("round_trip", round_trips), ("sim", sim_times)):
+            for percentile in LATENCY_PERCENTILES:
+                stats["{}_p{}".format(name, percentile)] = (
+                    float(np.percentile(times, percentile)) if len(times) else 0.0
+                )
+            stats["{}_max".format(name)] = float(times.max()) if len(times) else 0.0
+
+        finished = [s for s in sessions if s.finished_at is not None]
+        elapsed = 0.0
+        if finished:
+            elapsed = max(s.finished_at or 0.0 for s in finished) - min(
+                s.registered_at for s in finished
+            )
+        iterations = sum(len(s.round_trips) for s in finished)
+        stats["iterations_per_second"] = iterations / elapsed if elapsed > 0 else 0.0
+        return stats
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    server: MockPlatform
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def _read_json(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status: int, body: Optional[Dict[str, Any]] = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _session(self, match: "re.Match[str]") -> Tuple[str, Optional[MockSession]]:
+        session_id = match.group(2)
+        with self.server.lock:
+            return session_id, self.server.sessions.get(session_id)
+
+    def do_POST(self):
+        body = self._read_json()
+        match = _ADVANCE_PATH.match(self.path)
+        if match:
+            session_id, session = self._session(match)
+            if session is None:
+                self._send(404, {"error": "Unknown session {}".format(session_id)})
+                return
+            event = self.server.advance(session, body)
+            self._send(200, event)
+            session.last_response = time.perf_counter()
+            return
+
+        match = _SESSIONS_PATH.match(self.path)
+        if match:
+            session = self.server.register(body)
+            now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            self._send(
+                201,
+                {
+                    "sessionId": session.session_id,
+                    "sessionStatus": "Attachable",
+                    "interface": body,
+                    "registrationTime": now,
+                    "lastSeenTime": now,
+                    "lastIteratedTime": now,
+                },
+            )
+            return
+        self._send(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_DELETE(self):
+        match = _SESSION_PATH.match(self.path)
+        if match and self.server.unregister(match.group(2)):
+            self._send(204)
+            return
+        self._send(404, {"error": "Unknown session {}".format(self.path)})
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--sessions", type=int, default=1, help="sessions to serve before exiting"
+    )
+    parser.add_argument("--episodes", type=int, default=DEFAULT_EPISODES)
+    parser.add_argument(
+        "--iterations", type=int, default=DEFAULT_EPISODE_ITERATION_LIMIT
+    )
+    parser.add_argument("--config", help="assessment config with episodeConfigurations")
+    parser.add_argument(
+        "--policy",
+        default="moab_rollout:zero_policy",
+        help="module:function or an .onnx file",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="seconds")
+    args = parser.parse_args(argv)
+
+    server = MockPlatform(
+        args.host,
+        args.port,
+        configs=load_episode_configs(args.config) if args.config else ({},),
+        policy=load_policy(args.policy),
+        episodes=args.episodes,
+        iteration_limit=args.iterations,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+    )
+    server.serve_in_background()
+    print("Serving simulator sessions on {}".format(server.url), flush=True)
+    try:
+        server.wait_for_sessions(args.sessions)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for key, val in server.stats().items():
+        print(key, val)
+
+
+if __name__ == "__main__":
+    main()
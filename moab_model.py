@@ -6,18 +6,33 @@ __copyright__ = "Copyright 2021, Microsoft Corp."
 
 # pyright: strict
 
+import itertools
 import math
+import operator
 import random
-from typing import Dict, Tuple, cast
+import struct
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
 import numpy as np
-from pyrr import Quaternion, Vector3, matrix44, quaternion, ray, vector
-from pyrr.geometric_tests import ray_intersect_plane
-from pyrr.plane import create_from_position
+from pyrr import Quaternion, Vector3, matrix33, quaternion, vector
 
 # Some type aliases for clarity
 Plane = np.ndarray
 Ray = np.ndarray
+Buffer = Union[np.ndarray, memoryview, bytearray]
+Config = Mapping[str, Any]
 
 DEFAULT_TIME_DELTA = 0.045  # s, 45ms
 DEFAULT_GRAVITY = 9.81  # m/s^2, Earth: there's no place like it.
@@ -46,6 +61,9 @@ DEFAULT_BALL_Z_POSITION = (
     DEFAULT_PLATE_HEIGHT + PLATE_ORIGIN_TO_SURFACE_OFFSET + DEFAULT_BALL_RADIUS
 )
 
+# camera origin (lens center) in world space
+CAMERA_Z_POSITION = -0.052  # m, 52mm below the plate rot origin
+
 PLATE_MAX_Z_VELOCITY = 1.0  # m/s
 PLATE_Z_ACCEL = 10.0  # m/s^2
 
@@ -67,15 +85,524 @@ DEFAULT_PLATE_NOISE = 0.0  # noise added to plate_theta_* (rad)
 DEFAULT_BALL_NOISE = 0.0  # noise added to estimated_* ball location (m)
 DEFAULT_JITTER = 0.0  # jitter added to step_time (s)
 
+# ball motion is integrated in this many substeps per step
+DEFAULT_PHYSICS_SUBSTEPS = 1
+
+# noise is a clamped gaussian, mean zero with sigma = ~1/3 of the magnitude
+NOISE_SIGMA = 0.333
+NOISE_BLOCK_SIZE = 1024  # noise values drawn from the generator at a time
+
+# State schema.
+# The order of fields in MoabModel.state(), state_array() and state_into().
+# Bump STATE_SCHEMA_VERSION whenever fields are added, removed or reordered
+# so that stored state arrays can be told apart.
+STATE_SCHEMA_VERSION = 1
+STATE_FIELDS = (
+    # reflected input controls
+    "roll",
+    "pitch",
+    "height_z",
+    # reflected constants
+    "time_delta",
+    "jitter",
+    "step_time",
+    "elapsed_time",
+    "gravity",
+    "plate_radius",
+    "plate_theta_vel_limit",
+    "plate_theta_acc",
+    "plate_theta_limit",
+    "plate_z_limit",
+    "ball_mass",
+    "ball_radius",
+    "ball_shell",
+    "obstacle_radius",
+    "obstacle_x",
+    "obstacle_y",
+    "target_x",
+    "target_y",
+    # modelled plate metrics
+    "plate_x",
+    "plate_y",
+    "plate_z",
+    "plate_nor_x",
+    "plate_nor_y",
+    "plate_nor_z",
+    "plate_theta_x",
+    "plate_theta_y",
+    "plate_theta_vel_x",
+    "plate_theta_vel_y",
+    "plate_vel_z",
+    # modelled ball metrics
+    "ball_x",
+    "ball_y",
+    "ball_z",
+    "ball_vel_x",
+    "ball_vel_y",
+    "ball_vel_z",
+    "ball_qat_x",
+    "ball_qat_y",
+    "ball_qat_z",
+    "ball_qat_w",
+    "ball_on_plate_x",
+    "ball_on_plate_y",
+    "obstacle_distance",
+    "obstacle_direction",
+    # modelled camera observations
+    "estimated_x",
+    "estimated_y",
+    "estimated_radius",
+    "estimated_vel_x",
+    "estimated_vel_y",
+    # modelled positions and velocities
+    "estimated_speed",
+    "estimated_direction",
+    "estimated_distance",
+    "ball_noise",
+    "plate_noise",
+    # meta vars
+    "ball_fell_off",
+    "iteration_count",
+)
+
+# fields that state() reports as ints, they are stored as floats in arrays
+STATE_INT_FIELDS = ("ball_fell_off", "iteration_count")
+
+# fields of state() that never change during an episode, and those that do
+STATIC_STATE_FIELDS = (
+    "time_delta",
+    "jitter",
+    "gravity",
+    "plate_radius",
+    "plate_theta_vel_limit",
+    "plate_theta_acc",
+    "plate_theta_limit",
+    "plate_z_limit",
+    "ball_mass",
+    "ball_radius",
+    "ball_shell",
+    "obstacle_radius",
+    "obstacle_x",
+    "obstacle_y",
+    "target_x",
+    "target_y",
+    "plate_x",
+    "plate_y",
+    "ball_noise",
+    "plate_noise",
+)
+DYNAMIC_STATE_FIELDS = tuple(
+    name for name in STATE_FIELDS if name not in STATIC_STATE_FIELDS
+)
+
+_STATE_INDEX = {name: index for index, name in enumerate(STATE_FIELDS)}
+_STATIC_STATE_INDEX = tuple(_STATE_INDEX[name] for name in STATIC_STATE_FIELDS)
+_DYNAMIC_STATE_INDEX = tuple(_STATE_INDEX[name] for name in DYNAMIC_STATE_FIELDS)
+_STATE_STRUCT = struct.Struct("{}d".format(len(STATE_FIELDS)))
+
+# Model attributes.
+# Every attribute that makes up a model's state, scalars and then vectors with
+# their sizes, in the order MoabModel.snapshot() stores them.
+SCALAR_FIELDS = (
+    # general config
+    "time_delta",
+    "jitter",
+    "step_time",
+    "elapsed_time",
+    "gravity",
+    "physics_substeps",
+    # plate config
+    "plate_noise",
+    "plate_radius",
+    "plate_theta_limit",
+    "plate_theta_vel_limit",
+    "plate_theta_acc",
+    "plate_z_limit",
+    # ball config
+    "ball_noise",
+    "ball_mass",
+    "ball_radius",
+    "ball_shell",
+    # control input
+    "pitch",
+    "roll",
+    "height_z",
+    # plate state
+    "plate_theta_x",
+    "plate_theta_y",
+    "plate_theta_vel_x",
+    "plate_theta_vel_y",
+    "plate_vel_z",
+    # current target
+    "target_x",
+    "target_y",
+    # current obstacle
+    "obstacle_distance",
+    "obstacle_direction",
+    "obstacle_radius",
+    "obstacle_x",
+    "obstacle_y",
+    # camera observed estimated metrics
+    "estimated_x",
+    "estimated_y",
+    "estimated_vel_x",
+    "estimated_vel_y",
+    "estimated_radius",
+    "estimated_speed",
+    "estimated_direction",
+    "estimated_distance",
+    "prev_estimated_x",
+    "prev_estimated_y",
+    # meta
+    "iteration_count",
+)
+SCALAR_INT_FIELDS = ("physics_substeps", "iteration_count")
+VECTOR_FIELDS = (
+    ("plate", 3),
+    ("ball", 3),
+    ("ball_vel", 3),
+    ("ball_acc", 3),
+    ("ball_qat", 4),
+    ("ball_on_plate", 3),
+)
+
+# step() implementations, see MoabModel(engine=...)
+ENGINES = ("python", "numba")
+
+# flat layout of the attributes: SCALAR_FIELDS, then VECTOR_FIELDS
+_SCALAR_GETTER = operator.attrgetter(*SCALAR_FIELDS)
+_VECTOR_SLICES = tuple(
+    (name, slice(offset, offset + size))
+    for name, size, offset in zip(
+        (name for name, _ in VECTOR_FIELDS),
+        (size for _, size in VECTOR_FIELDS),
+        itertools.accumulate(
+            [len(SCALAR_FIELDS)] + [size for _, size in VECTOR_FIELDS]
+        ),
+    )
+)
+
+# the scalars a step changes, copied back after a compiled step
+_STEP_SCALARS = tuple(
+    (name, index)
+    for index, name in enumerate(SCALAR_FIELDS)
+    if name not in STATIC_STATE_FIELDS
+    and name not in ("physics_substeps", "pitch", "roll", "height_z")
+)
+
+# snapshot(): the attributes as float64, then the noise stream state
+_SNAPSHOT_STRUCT = struct.Struct(
+    "<{}d".format(len(SCALAR_FIELDS) + sum(size for _, size in VECTOR_FIELDS))
+)
+# noise stream: PCG64 state and increment as 16 bytes each, has_uint32,
+# uinteger, block size and the position in the current block (-1 for none)
+_NOISE_STATE_STRUCT = struct.Struct("<16s16sqQqq")
+
 
 def clamp(val: float, min_val: float, max_val: float):
     return min(max_val, max(min_val, val))
 
 
+def random_noise(scalar: float) -> float:
+    """
+    Returns a noise value in the range [-scalar .. scalar] with a gaussian
+    distribution, drawn from the global `random` stream. This is what the
+    former static MoabModel.random_noise(scalar) did. Models draw their noise
+    from their own seeded stream with model.random_noise(scalar) instead.
+    """
+    return scalar * clamp(random.gauss(mu=0, sigma=NOISE_SIGMA), -1, 1)
+
+
+def merge_state(
+    static_state: Mapping[str, float], dynamic_state: Mapping[str, float]
+) -> Dict[str, float]:
+    """
+    Rebuild the full state() dictionary from the static block sent at the
+    start of an episode and the dynamic fields of a later step.
+    """
+    return {
+        name: dynamic_state[name] if name in dynamic_state else static_state[name]
+        for name in STATE_FIELDS
+    }
+
+
+class StateView(Mapping[str, float]):
+    """
+    A read only, dictionary-like view of a state array in STATE_FIELDS order.
+
+    Values are read from the array on lookup, so a view over a preallocated
+    buffer costs nothing until it is used. to_dict() builds the same
+    dictionary that MoabModel.state() returns.
+    """
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    def __getitem__(self, key: str) -> float:
+        value = float(self._array[_STATE_INDEX[key]])
+        return int(value) if key in STATE_INT_FIELDS else value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(STATE_FIELDS)
+
+    def __len__(self) -> int:
+        return len(STATE_FIELDS)
+
+    def to_dict(self) -> Dict[str, float]:
+        values = dict(zip(STATE_FIELDS, self._array.tolist()))
+        for key in STATE_INT_FIELDS:
+            values[key] = int(values[key])
+        return values
+
+
+def _quaternion_product(quats: np.ndarray) -> np.ndarray:
+    """
+    The normalized product q0 x q1 x ... of an (N, 4) array of xyzw
+    quaternions, see pyrr.quaternion.cross, reduced pairwise.
+    """
+    while len(quats) > 1:
+        if len(quats) % 2:
+            quats = np.concatenate((quats, [[0.0, 0.0, 0.0, 1.0]]))
+        q1x, q1y, q1z, q1w = quats[0::2].T
+        q2x, q2y, q2z, q2w = quats[1::2].T
+        quats = np.stack(
+            (
+                q1x * q2w + q1y * q2z - q1z * q2y + q1w * q2x,
+                -q1x * q2z + q1y * q2w + q1z * q2x + q1w * q2y,
+                q1x * q2y - q1y * q2x + q1z * q2w + q1w * q2z,
+                -q1x * q2x - q1y * q2y - q1z * q2z + q1w * q2w,
+            ),
+            axis=1,
+        )
+        quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    return quats[0]
+
+
+class NoiseGenerator:
+    """
+    Per-model random stream for sensor/actuator noise and step jitter.
+
+    Values are drawn from a numpy Generator a block at a time to amortize
+    the cost of each draw. Seeding a model's stream makes its runs
+    reproducible and independent of other models and of the global `random`.
+    """
+
+    def __init__(self, seed: Optional[int] = None, block_size: int = NOISE_BLOCK_SIZE):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed: Optional[int] = None):
+        """ Restart the stream from a seed, or from OS entropy if None. """
+        self.generator = np.random.default_rng(seed)
+        self._block = []  # type: List[float]
+        self._index = 0
+
+        # generator state before the current block was drawn, see getstate()
+        self._block_state = None  # type: Optional[Dict[str, Any]]
+
+    def getstate(self) -> bytes:
+        """
+        The position in the stream as a few bytes. Rather than the prefetched
+        block itself this holds the generator state it was drawn from, and
+        setstate() draws it again.
+        """
+        if self._block_state is None:
+            state, index = self.generator.bit_generator.state, -1
+        else:
+            state, index = self._block_state, self._index
+        pcg = state["state"]
+        return _NOISE_STATE_STRUCT.pack(
+            pcg["state"].to_bytes(16, "little"),
+            pcg["inc"].to_bytes(16, "little"),
+            state["has_uint32"],
+            state["uinteger"],
+            self.block_size,
+            index,
+        )
+
+    def setstate(self, blob: bytes):
+        """ Returns to a position in the stream from getstate(). """
+        (
+            pcg_state,
+            pcg_inc,
+            has_uint32,
+            uinteger,
+            block_size,
+            index,
+        ) = _NOISE_STATE_STRUCT.unpack(blob)
+        state = {
+            "bit_generator": "PCG64",
+            "state": {
+                "state": int.from_bytes(pcg_state, "little"),
+                "inc": int.from_bytes(pcg_inc, "little"),
+            },
+            "has_uint32": has_uint32,
+            "uinteger": uinteger,
+        }  # type: Dict[str, Any]
+
+        # restoring into the block we already hold, e.g. when branching from
+        # one snapshot many times, only needs the position
+        if index >= 0 and block_size == self.block_size and state == self._block_state:
+            self._index = index
+            return
+
+        self.generator.bit_generator.state = state
+        self.block_size = block_size
+        self._block = []
+        self._index = 0
+        self._block_state = None
+        if index >= 0:
+            self._draw_block()
+            self._index = index
+
+    def copy_from(self, other: "NoiseGenerator"):
+        """ Moves this stream to the position of other, without drawing. """
+        self.generator.bit_generator.state = other.generator.bit_generator.state
+        self.block_size = other.block_size
+        # blocks are replaced rather than changed, so the copies can share one
+        self._block = other._block
+        self._index = other._index
+        self._block_state = other._block_state
+
+    def noise(self, scalar: float) -> float:
+        """
+        Returns a noise value in the range [-scalar .. scalar] with a
+        gaussian distribution. A zero scalar draws nothing from the stream.
+        """
+        if scalar == 0.0:
+            return 0.0
+
+        if self._index == len(self._block):
+            self._draw_block()
+
+        value = self._block[self._index]
+        self._index += 1
+        return scalar * value
+
+    def _draw_block(self):
+        self._block_state = self.generator.bit_generator.state
+        block = self.generator.normal(0.0, NOISE_SIGMA, self.block_size)
+        self._block = np.clip(block, -1.0, 1.0).tolist()
+        self._index = 0
+
+
+class PlatePose(NamedTuple):
+    """
+    Trigonometry derived from a plate pose (plate_theta_x, plate_theta_y, plate.z).
+    """
+
+    sin_x: float
+    cos_x: float
+    sin_y: float
+    cos_y: float
+
+    # Z-Up RH plate normal
+    nor_x: float
+    nor_y: float
+    nor_z: float
+
+    # surface plane distance from the origin along the normal
+    surface_d: float
+
+
 class MoabModel:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None, engine: str = "python"):
+        """
+        seed:   seeds the model's noise and jitter stream, see seed().
+        engine: "python" steps with the reference implementation below.
+                "numba" steps with the compiled kernel of moab_kernel when
+                numba is installed, and falls back to "python" otherwise.
+                `engine` holds the one in use.
+        """
+        self.rng = NoiseGenerator(seed)
+        self._set_engine(engine)
+        self._profiler = None  # type: Optional[Any]
         self.reset()
 
+    def _set_engine(self, engine: str):
+        if engine not in ENGINES:
+            raise ValueError(
+                "Unknown engine {}, expected one of {}".format(engine, ENGINES)
+            )
+
+        self.engine = "python"
+        if engine == "numba":
+            # imported here as moab_kernel builds on this module
+            import moab_kernel
+
+            if moab_kernel.COMPILED:
+                self.engine = engine
+                self._step_state = moab_kernel.step_state
+                self._step_noise = moab_kernel.new_noise()
+                self._step_buffer = moab_kernel.new_state()
+
+    def enable_profiling(self, alloc_sample_interval: int = 0):
+        """
+        Starts timing the phases of step() on this model, see profile_stats().
+        With alloc_sample_interval N, every Nth call of a phase also measures
+        its allocations with tracemalloc. See moab_profile for the details.
+        """
+        # imported here as profiling is opt-in
+        from moab_profile import PhaseProfiler
+
+        self.disable_profiling()
+        self._profiler = PhaseProfiler(
+            self, alloc_sample_interval=alloc_sample_interval
+        )
+
+    def disable_profiling(self):
+        if self._profiler is not None:
+            self._profiler.detach()
+            self._profiler = None
+
+    def profile_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per phase of step() since enable_profiling(): the calls, the total
+        and mean nanoseconds, and with allocation sampling the samples and
+        their mean peak and retained bytes. Empty when not profiling.
+        """
+        if self._profiler is None:
+            return {}
+        return self._profiler.stats()
+
+    def seed(self, seed: Optional[int] = None):
+        """
+        Reseed the noise and jitter stream. The stream is not reset by reset()
+        so consecutive episodes see different noise unless reseeded.
+        """
+        self.rng.seed(seed)
+
+    def snapshot(self) -> bytes:
+        """
+        Captures the model's state, including its position in the noise
+        stream, as a compact blob. A model restored from it steps exactly as
+        this one would from here on.
+        """
+        return _SNAPSHOT_STRUCT.pack(*self._flat_values()) + self.rng.getstate()
+
+    def restore(self, blob: bytes):
+        """ Returns the model to the state captured by snapshot(). """
+        self._set_flat_values(_SNAPSHOT_STRUCT.unpack_from(blob))
+        self.rng.setstate(blob[_SNAPSHOT_STRUCT.size :])
+        self._plate_pose_key = None
+        self._plate_pose_cache = None
+
+    def _flat_values(self) -> List[float]:
+        """ SCALAR_FIELDS then VECTOR_FIELDS, as floats """
+        values = list(_SCALAR_GETTER(self))
+        for name, _ in VECTOR_FIELDS:
+            values.extend(getattr(self, name).tolist())
+        return values
+
+    def _set_flat_values(self, values: Sequence[float]):
+        for name, value in zip(SCALAR_FIELDS, values):
+            setattr(self, name, value)
+        for name in SCALAR_INT_FIELDS:
+            setattr(self, name, int(getattr(self, name)))
+
+        for name, field in _VECTOR_SLICES:
+            getattr(self, name)[:] = values[field]
+
     def reset(self):
         """
         Resets the model to known default state.
@@ -90,6 +617,7 @@ class MoabModel:
         self.step_time = self.time_delta
         self.elapsed_time = 0.0
         self.gravity = DEFAULT_GRAVITY
+        self.physics_substeps = DEFAULT_PHYSICS_SUBSTEPS
 
         # plate config
         self.plate_noise = DEFAULT_PLATE_NOISE
@@ -122,6 +650,7 @@ class MoabModel:
         # ball state
         self.ball = Vector3([0.0, 0.0, DEFAULT_BALL_Z_POSITION])
         self.ball_vel = Vector3([0.0, 0.0, 0.0])
+        self.ball_acc = Vector3([0.0, 0.0, 0.0])
         self.ball_qat = Quaternion([0.0, 0.0, 0.0, 1.0])
         self.ball_on_plate = Vector3(
             [0.0, 0.0, PLATE_ORIGIN_TO_SURFACE_OFFSET + DEFAULT_BALL_RADIUS]
@@ -156,6 +685,10 @@ class MoabModel:
         # meta
         self.iteration_count = 0
 
+        # plate trigonometry, see _plate_pose()
+        self._plate_pose_key = None  # type: Optional[Tuple[float, float, float]]
+        self._plate_pose_cache = None  # type: Optional[PlatePose]
+
         # now that the base state has been set, run an update
         # to make sure the all variables are internally constistent
         self.update_plate(True)
@@ -186,21 +719,147 @@ class MoabModel:
         The current actions will be applied, and the model evaluated.
         All state variables will be updated.
         """
-        self.step_time = self.time_delta + MoabModel.random_noise(self.jitter)
+        if self.engine == "numba":
+            self._compiled_step()
+            return
+
+        self.step_time = self.time_delta + self.random_noise(self.jitter)
         self.elapsed_time += self.step_time
 
+        start_theta = (self.plate_theta_x, self.plate_theta_y)
         self.update_plate(False)
-        self.update_ball(False)
+
+        if self.physics_substeps > 1:
+            self._substep_ball(start_theta)
+            self._update_estimated_ball(self.ball)
+        else:
+            self.update_ball(False)
 
         # update meta
         self.iteration_count += 1
 
-    # returns a noise value in the range [-scalar .. scalar] with a gaussian distribution
-    @staticmethod
-    def random_noise(scalar: float) -> float:
-        return scalar * clamp(
-            random.gauss(mu=0, sigma=0.333), -1, 1
-        )  # mean zero gauss with sigma = ~sqrt(scalar)/3
+    def _compiled_step(self):
+        # copying the attributes in and out costs more than the kernel
+        state = self._step_buffer
+        _SNAPSHOT_STRUCT.pack_into(state, 0, *self._flat_values())
+        self._step_state(state, self._draw_step_noise())
+
+        values = state.tolist()
+        for name, index in _STEP_SCALARS:
+            setattr(self, name, values[index])
+        self.iteration_count = int(self.iteration_count)
+        for name, field in _VECTOR_SLICES:
+            getattr(self, name)[:] = values[field]
+
+    def _draw_step_noise(self) -> np.ndarray:
+        """ the noise of a step, drawn in the order step() draws it """
+        noise = self._step_noise
+        noise[0] = self.random_noise(self.jitter)
+        noise[1] = self.random_noise(self.plate_noise)
+        noise[2] = self.random_noise(self.plate_noise)
+        noise[3] = self.random_noise(self.ball_noise)
+        noise[4] = self.random_noise(self.ball_noise)
+        noise[5] = self.random_noise(self.ball_noise)
+        return noise
+
+    def advance(self, n: int, action: Optional[Config] = None) -> int:
+        """
+        Holds an action, if given, for up to n steps and stops early on the
+        step the ball falls off the plate. Returns the number of steps taken.
+
+        Once the plate has settled on the commanded pose and there is no noise
+        or jitter, the ball moves with a constant acceleration and the steps
+        are jumped in closed form, in one set of array operations. The result
+        matches stepping one at a time up to floating point rounding.
+        Otherwise this steps one at a time.
+        """
+        if n < 0:
+            raise ValueError("Cannot advance by {} steps".format(n))
+        if action is not None:
+            self.apply_action(action)
+
+        # a target beyond the limits settles at the limits
+        settled = (
+            self.plate_theta_x,
+            self.plate_theta_y,
+            self.plate.z,
+        ) == self._clamp_plate(*self._plate_target())
+        quiet = (
+            self.jitter == 0.0 and self.plate_noise == 0.0 and self.ball_noise == 0.0
+        )
+        # substeps split each step's roll of the ball differently
+        if n > 1 and settled and quiet and self.physics_substeps == 1:
+            return self._advance_settled(n)
+
+        for steps in range(1, n + 1):
+            self.step()
+            if self.halted():
+                return steps
+        return n
+
+    def _advance_settled(self, n: int) -> int:
+        # the same acceleration as _ball_plate_contact, and the per step
+        # displacements d_k = u t + a t^2 (k - 1/2) of its equations of motion
+        t = self.time_delta
+        gain = (
+            self.ball_mass
+            * self.gravity
+            / (self.ball_mass + self._ball_inertia() / (self.ball_radius ** 2))
+        )
+        acc_x, acc_y = gain * self.plate_theta_y, -gain * self.plate_theta_x
+        vel_x, vel_y, vel_z = self.ball_vel.tolist()
+        k = np.arange(1, n + 1, dtype=np.float64)
+        x = self.ball.x + vel_x * t * k + 0.5 * acc_x * (t * k) ** 2
+        y = self.ball.y + vel_y * t * k + 0.5 * acc_y * (t * k) ** 2
+
+        # stop on the first step that halts, see halted()
+        pose = self._plate_pose()
+        z = x * -pose.sin_y + y * pose.sin_x
+        off_plate = np.flatnonzero(x * x + y * y + z * z > self.plate_radius ** 2)
+        if len(off_plate):
+            n = int(off_plate[0]) + 1
+
+        # roll the ball through each step's displacement, see _ball_plate_contact
+        dx = vel_x * t + acc_x * t * t * (k[:n] - 0.5)
+        dy = vel_y * t + acc_y * t * t * (k[:n] - 0.5)
+        rot_distance = np.hypot(dx, dy)
+        half_angle = rot_distance / self.ball_radius / 2.0
+        scale = np.divide(
+            np.sin(half_angle),
+            rot_distance,
+            out=np.zeros(n),
+            where=rot_distance > 0,
+        )
+        rot = np.stack((dy * scale, -dx * scale, np.zeros(n), np.cos(half_angle)), 1)
+        self.ball_qat.xyzw = _quaternion_product(
+            np.concatenate(([self.ball_qat.xyzw], rot))
+        )
+
+        self.step_time = t
+        self.elapsed_time += n * t
+        self.plate_theta_vel_x = 0.0
+        self.plate_theta_vel_y = 0.0
+        self.plate_vel_z = 0.0
+        self.ball_acc = Vector3([acc_x, acc_y, 0.0])
+        self.ball_vel = Vector3([vel_x + acc_x * t * n, vel_y + acc_y * t * n, vel_z])
+
+        # the camera estimates of the last two steps, for the estimated velocity
+        if n > 1:
+            self.ball.x, self.ball.y = x[n - 2], y[n - 2]
+            self._update_ball_z()
+            self._update_estimated_ball(self.ball)
+        self.ball.x, self.ball.y = x[n - 1], y[n - 1]
+        self._update_ball_z()
+        self._update_estimated_ball(self.ball)
+
+        self.iteration_count += n
+        return n
+
+    # returns a noise value in the range [-scalar .. scalar] with a gaussian
+    # distribution from this model's stream. this used to be a staticmethod,
+    # moab_model.random_noise(scalar) keeps that unseeded behaviour.
+    def random_noise(self, scalar: float) -> float:
+        return self.rng.noise(scalar)
 
     @staticmethod
     def accel_param(
@@ -312,21 +971,44 @@ class MoabModel:
 
     # convert X/Y theta components into a Z-Up RH plane normal
     def _plate_nor(self) -> Vector3:
-        x_rot = matrix44.create_from_axis_rotation(
-            axis=X_AXIS, theta=self.plate_theta_x
-        )
-        y_rot = matrix44.create_from_axis_rotation(
-            axis=Y_AXIS, theta=self.plate_theta_y
-        )
+        return Vector3(self._plate_nor_xyz())
+
+    def _plate_nor_xyz(self) -> Tuple[float, float, float]:
+        pose = self._plate_pose()
+        return (pose.nor_x, pose.nor_y, pose.nor_z)
 
-        # pitch then roll
-        nor = matrix44.apply_to_vector(mat=x_rot, vec=Z_AXIS)
-        nor = matrix44.apply_to_vector(mat=y_rot, vec=nor)
-        nor = vector.normalize(nor)
+    def _plate_pose(self) -> PlatePose:
+        """
+        Returns the rotation, normal and surface plane of the current plate pose.
+
+        The result is cached and only recomputed once the plate angles or
+        height change, which is rare once a controller has settled.
+        The plate only ever translates along Z so plate.x/y are not part of the key.
+        """
+        key = (self.plate_theta_x, self.plate_theta_y, self.plate.z)
+        if key != self._plate_pose_key or self._plate_pose_cache is None:
+            theta_x, theta_y, plate_z = key
+            sin_x, cos_x = math.sin(theta_x), math.cos(theta_x)
+            sin_y, cos_y = math.sin(theta_y), math.cos(theta_y)
+
+            # Z_AXIS rotated around X_AXIS by theta_x (pitch) then around
+            # Y_AXIS by theta_y (roll). Already unit length.
+            nor_x, nor_y, nor_z = sin_y * cos_x, -sin_x, cos_y * cos_x
+
+            surface_d = (
+                nor_x * self.plate.x
+                + nor_y * self.plate.y
+                + nor_z * (plate_z + PLATE_ORIGIN_TO_SURFACE_OFFSET)
+            )
 
-        return Vector3(nor)
+            self._plate_pose_key = key
+            self._plate_pose_cache = PlatePose(
+                sin_x, cos_x, sin_y, cos_y, nor_x, nor_y, nor_z, surface_d
+            )
+        return self._plate_pose_cache
 
-    def update_plate(self, plate_reset: bool = False):
+    def _plate_target(self) -> Tuple[float, float, float]:
+        """ the plate pose commanded by the controls, (theta_x, theta_y, z) """
         # Find the target xth,yth & zpos
         # convert xy[-1..1] to zx[-self.plate_theta_limit .. self.plate_theta_limit]
         # convert z[-1..1] to [PLATE_HEIGHT_MAX/2 - self.plate_z_limit .. PLATE_HEIGHT_MAX/2 + self.plate_z_limit]
@@ -338,6 +1020,10 @@ class MoabModel:
         # the Moab hardware can only command by whole degrees
         theta_y_target = math.radians(round(math.degrees(theta_y_target)))
         theta_x_target = math.radians(round(math.degrees(theta_x_target)))
+        return theta_x_target, theta_y_target, z_target
+
+    def update_plate(self, plate_reset: bool = False):
+        theta_x_target, theta_y_target, z_target = self._plate_target()
 
         # get the current xth,yth & zpos
         theta_x, theta_y = self.plate_theta_x, self.plate_theta_y
@@ -377,22 +1063,29 @@ class MoabModel:
             )
 
             # add noise to the plate positions
-            theta_x += MoabModel.random_noise(self.plate_noise)
-            theta_y += MoabModel.random_noise(self.plate_noise)
-
-        # clamp to range limits
-        theta_x = clamp(theta_x, -self.plate_theta_limit, self.plate_theta_limit)
-        theta_y = clamp(theta_y, -self.plate_theta_limit, self.plate_theta_limit)
-        z_pos = clamp(
-            z_pos,
-            PLATE_HEIGHT_MAX / 2.0 - self.plate_z_limit,
-            PLATE_HEIGHT_MAX / 2.0 + self.plate_z_limit,
-        )
+            theta_x += self.random_noise(self.plate_noise)
+            theta_y += self.random_noise(self.plate_noise)
 
         # Now convert back to plane parameters
-        self.plate_theta_x = theta_x
-        self.plate_theta_y = theta_y
-        self.plate.z = z_pos
+        (
+            self.plate_theta_x,
+            self.plate_theta_y,
+            self.plate.z,
+        ) = self._clamp_plate(theta_x, theta_y, z_pos)
+
+    def _clamp_plate(
+        self, theta_x: float, theta_y: float, z_pos: float
+    ) -> Tuple[float, float, float]:
+        """ a plate pose clamped to the range limits """
+        return (
+            clamp(theta_x, -self.plate_theta_limit, self.plate_theta_limit),
+            clamp(theta_y, -self.plate_theta_limit, self.plate_theta_limit),
+            clamp(
+                z_pos,
+                PLATE_HEIGHT_MAX / 2.0 - self.plate_z_limit,
+                PLATE_HEIGHT_MAX / 2.0 + self.plate_z_limit,
+            ),
+        )
 
     # ball intertia with radius and hollow radius
     # I = 2/5 * m * ((r^5 - h^5) / (r^3 - h^3))
@@ -410,7 +1103,7 @@ class MoabModel:
 
     def _camera_pos(self) -> Vector3:
         """ camera origin (lens center) in world space """
-        return Vector3([0.0, 0.0, -0.052])
+        return Vector3([0.0, 0.0, CAMERA_Z_POSITION])
 
     def _update_estimated_ball(self, ball: Vector3):
         """
@@ -418,28 +1111,17 @@ class MoabModel:
         origin and use the collision points with the tilted plate to estimate
         what a camera might perceive the ball position and size to be.
         """
-        # contact ray from camera to plate
-        camera = self._camera_pos()
-        displacement = camera - self.ball
-        displacement_radius = camera - (self.ball + Vector3([self.ball_radius, 0, 0]))
-
-        ball_ray = ray.create(camera, displacement)
-        ball_radius_ray = ray.create(camera, displacement_radius)
-
-        surface_plane = self._surface_plane()
-
-        contact = Vector3(ray_intersect_plane(ball_ray, surface_plane, False))
-        radius_contact = Vector3(
-            ray_intersect_plane(ball_radius_ray, surface_plane, False)
+        # contact rays from camera to plate
+        x, y, _ = self._camera_ray_contact(ball.x, ball.y, ball.z)
+        radius_x, _, _ = self._camera_ray_contact(
+            ball.x + self.ball_radius, ball.y, ball.z
         )
-
-        x, y = contact.x, contact.y
-        r = math.fabs(contact.x - radius_contact.x)
+        r = math.fabs(x - radius_x)
 
         # add the noise in
-        self.estimated_x = x + MoabModel.random_noise(self.ball_noise)
-        self.estimated_y = y + MoabModel.random_noise(self.ball_noise)
-        self.estimated_radius = r + MoabModel.random_noise(self.ball_noise)
+        self.estimated_x = x + self.random_noise(self.ball_noise)
+        self.estimated_y = y + self.random_noise(self.ball_noise)
+        self.estimated_radius = r + self.random_noise(self.ball_noise)
 
         # Use n-1 states to calculate an estimated velocity.
         self.estimated_vel_x = (
@@ -473,7 +1155,9 @@ class MoabModel:
         self.prev_estimated_y = self.estimated_y
 
         # update ball position in plate origin coordinates, and obstacle distance and direction
-        self.ball_on_plate = self.world_to_plate(self.ball.x, self.ball.y, self.ball.z)
+        self.ball_on_plate.xyz = self._world_to_plate_xyz(
+            self.ball.x, self.ball.y, self.ball.z
+        )
         self.obstacle_distance = self._get_obstacle_distance()
         self.obstacle_direction = MoabModel.heading_to_point(
             self.ball.x,
@@ -494,14 +1178,32 @@ class MoabModel:
         # Negative distance to obstacle means the ball and obstacle are  overlapping
         return distance_between_centers - self.ball_radius - self.obstacle_radius
 
+    def _camera_ray_contact(
+        self, x: float, y: float, z: float
+    ) -> Tuple[float, float, float]:
+        """
+        Intersect the line from the camera origin through the world point
+        (x, y, z) with the plate surface plane, see _surface_plane().
+
+        This is pyrr's ray_intersect_plane written out for a camera that
+        sits on the Z axis:
+            t = (pd - p0.n) / rd.n
+        """
+        pose = self._plate_pose()
+
+        # ray direction, camera - point
+        dir_x, dir_y, dir_z = -x, -y, CAMERA_Z_POSITION - z
+        rd_n = pose.nor_x * dir_x + pose.nor_y * dir_y + pose.nor_z * dir_z
+
+        t = (pose.surface_d - pose.nor_z * CAMERA_Z_POSITION) / rd_n
+        return (dir_x * t, dir_y * t, CAMERA_Z_POSITION + dir_z * t)
+
     def _surface_plane(self) -> Plane:
         """
         Return the surface plane of the plate
         """
-        plate_surface = np.array(
-            [self.plate.x, self.plate.y, self.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET]
-        )
-        return create_from_position(plate_surface, self._plate_nor())
+        pose = self._plate_pose()
+        return np.array([pose.nor_x, pose.nor_y, pose.nor_z, pose.surface_d])
 
     def _motion_for_time(
         self, u: Vector3, a: Vector3, t: float
@@ -523,9 +1225,10 @@ class MoabModel:
         return d, v
 
     def _update_ball_z(self):
+        pose = self._plate_pose()
         self.ball.z = (
-            self.ball.x * math.sin(-self.plate_theta_y)
-            + self.ball.y * math.sin(self.plate_theta_x)
+            self.ball.x * -pose.sin_y
+            + self.ball.y * pose.sin_x
             + self.ball_radius
             + self.plate.z
             + PLATE_ORIGIN_TO_SURFACE_OFFSET
@@ -588,37 +1291,42 @@ class MoabModel:
         return 0.0
 
     def plate_to_world(self, x: float, y: float, z: float) -> Vector3:
-        # rotate
-        x_rot = matrix44.create_from_axis_rotation([1.0, 0.0, 0.0], self.plate_theta_x)
-        y_rot = matrix44.create_from_axis_rotation([0.0, 1.0, 0.0], self.plate_theta_y)
-        vec = matrix44.apply_to_vector(mat=x_rot, vec=[x, y, z])
-        vec = matrix44.apply_to_vector(mat=y_rot, vec=vec)
+        return Vector3(self._plate_to_world_xyz(x, y, z))
+
+    def world_to_plate(self, x: float, y: float, z: float) -> Vector3:
+        return Vector3(self._world_to_plate_xyz(x, y, z))
+
+    def _plate_to_world_xyz(
+        self, x: float, y: float, z: float
+    ) -> Tuple[float, float, float]:
+        sin_x, cos_x, sin_y, cos_y = self._plate_pose()[:4]
+
+        # rotate around X, then around Y
+        y, z = cos_x * y - sin_x * z, sin_x * y + cos_x * z
+        x, z = cos_y * x + sin_y * z, -sin_y * x + cos_y * z
 
         # translate
-        move = matrix44.create_from_translation(
-            [self.plate.x, self.plate.y, self.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET]
+        return (
+            x + self.plate.x,
+            y + self.plate.y,
+            z + self.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET,
         )
-        vec = matrix44.apply_to_vector(mat=move, vec=vec)
 
-        return Vector3(vec)
+    def _world_to_plate_xyz(
+        self, x: float, y: float, z: float
+    ) -> Tuple[float, float, float]:
+        sin_x, cos_x, sin_y, cos_y = self._plate_pose()[:4]
 
-    def world_to_plate(self, x: float, y: float, z: float) -> Vector3:
-        move = matrix44.create_from_translation(
-            [
-                -self.plate.x,
-                -self.plate.y,
-                -(self.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET),
-            ]
-        )
-        vec = matrix44.apply_to_vector(mat=move, vec=[x, y, z])
+        # translate
+        x = x - self.plate.x
+        y = y - self.plate.y
+        z = z - (self.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET)
 
-        # rotate
-        x_rot = matrix44.create_from_axis_rotation([1.0, 0.0, 0.0], -self.plate_theta_x)
-        y_rot = matrix44.create_from_axis_rotation([0.0, 1.0, 0.0], -self.plate_theta_y)
-        vec = matrix44.apply_to_vector(mat=x_rot, vec=vec)
-        vec = matrix44.apply_to_vector(mat=y_rot, vec=vec)
+        # rotate back around X, then around Y
+        y, z = cos_x * y + sin_x * z, -sin_x * y + cos_x * z
+        x, z = cos_y * x - sin_y * z, sin_y * x + cos_y * z
 
-        return Vector3(vec)
+        return (x, y, z)
 
     def set_initial_ball(self, x: float, y: float, z: float):
         self.ball.xyz = [x, y, z]
@@ -628,6 +1336,71 @@ class MoabModel:
         self._update_estimated_ball(self.ball)
         pass
 
+    def _substep_ball(self, start_theta: Tuple[float, float]):
+        """
+        Integrates the ball over physics_substeps equal slices of the step,
+        with the plate tilting linearly from start_theta to its new angles,
+        instead of holding the new angles for the whole step. The plate servo
+        model and the camera estimates still run once per step.
+
+        This is _ball_plate_contact() unrolled into plain floats, as the pyrr
+        operators dominate the cost of a substep.
+        """
+        start_x, start_y = start_theta
+        end_x, end_y = self.plate_theta_x, self.plate_theta_y
+        substeps = self.physics_substeps
+        t = self.step_time / substeps
+
+        # acceleration per radian of tilt, see _ball_plate_contact()
+        gain = (
+            self.ball_mass
+            * self.gravity
+            / (self.ball_mass + self._ball_inertia() / (self.ball_radius ** 2))
+        )
+        radius = self.ball_radius
+
+        x, y = self.ball.x, self.ball.y
+        vel_x, vel_y, vel_z = self.ball_vel.tolist()
+        qx, qy, qz, qw = self.ball_qat.tolist()
+        acc_x = acc_y = 0.0
+
+        for substep in range(1, substeps + 1):
+            f = substep / substeps
+            acc_x = gain * (start_y + (end_y - start_y) * f)
+            acc_y = -gain * (start_x + (end_x - start_x) * f)
+
+            # d = ut + 1/2at^2, v = u + at
+            dx = vel_x * t + 0.5 * acc_x * t * t
+            dy = vel_y * t + 0.5 * acc_y * t * t
+            vel_x += acc_x * t
+            vel_y += acc_y * t
+            x += dx
+            y += dy
+
+            # roll the ball by the distance traveled, about the (dy, -dx) axis
+            rot_distance = math.hypot(dx, dy)
+            if rot_distance > 0:
+                half_angle = rot_distance / radius / 2.0
+                s = math.sin(half_angle) / rot_distance
+                rx, ry, rw = dy * s, -dx * s, math.cos(half_angle)
+
+                # quaternion cross product q x r with r.z = 0, see pyrr.quaternion.cross
+                qx, qy, qz, qw = (
+                    qx * rw - qz * ry + qw * rx,
+                    qy * rw + qz * rx + qw * ry,
+                    qx * ry - qy * rx + qz * rw,
+                    -qx * rx - qy * ry + qw * rw,
+                )
+                norm = math.sqrt(qx * qx + qy * qy + qz * qz + qw * qw)
+                qx, qy, qz, qw = qx / norm, qy / norm, qz / norm, qw / norm
+
+        self.ball.x = x
+        self.ball.y = y
+        self._update_ball_z()
+        self.ball_vel = Vector3([vel_x, vel_y, vel_z])
+        self.ball_acc = Vector3([acc_x, acc_y, 0.0])
+        self.ball_qat.xyzw = [qx, qy, qz, qw]
+
     def update_ball(self, ball_reset: bool = False):
         """
         Update the ball position with the physics model.
@@ -641,74 +1414,224 @@ class MoabModel:
         # Finally, lets make some approximations for observations
         self._update_estimated_ball(self.ball)
 
+    def configure(self, config: Config):
+        """
+        Apply an episode configuration, as sent to the simulator at the start
+        of an episode, to a freshly reset model. Missing keys keep the
+        current value.
+        """
+        # an explicit seed makes the noise and jitter of the episode reproducible,
+        # otherwise the model's stream carries on from the previous episode
+        seed = config.get("seed", None)
+        if seed is not None and seed >= 0:
+            self.seed(int(seed))
+
+        # initial control state. these are all [-1..1] unitless
+        self.roll = config.get("initial_roll", self.roll)
+        self.pitch = config.get("initial_pitch", self.pitch)
+
+        self.height_z = config.get("initial_height_z", self.height_z)
+
+        # constants, SI units.
+        self.time_delta = config.get("time_delta", self.time_delta)
+        self.jitter = config.get("jitter", self.jitter)
+        self.gravity = config.get("gravity", self.gravity)
+        self.physics_substeps = max(
+            1, int(config.get("physics_substeps", self.physics_substeps))
+        )
+        self.plate_theta_vel_limit = config.get(
+            "plate_theta_vel_limit", self.plate_theta_vel_limit
+        )
+        self.plate_theta_acc = config.get("plate_theta_acc", self.plate_theta_acc)
+        self.plate_theta_limit = config.get("plate_theta_limit", self.plate_theta_limit)
+        self.plate_z_limit = config.get("plate_z_limit", self.plate_z_limit)
+
+        self.ball_mass = config.get("ball_mass", self.ball_mass)
+        self.ball_radius = config.get("ball_radius", self.ball_radius)
+        self.ball_shell = config.get("ball_shell", self.ball_shell)
+
+        self.obstacle_radius = config.get("obstacle_radius", self.obstacle_radius)
+        self.obstacle_x = config.get("obstacle_x", self.obstacle_x)
+        self.obstacle_y = config.get("obstacle_y", self.obstacle_y)
+
+        # a target position the AI can try and move the ball to
+        self.target_x = config.get("target_x", self.target_x)
+        self.target_y = config.get("target_y", self.target_y)
+
+        # observation config
+        self.ball_noise = config.get("ball_noise", self.ball_noise)
+        self.plate_noise = config.get("plate_noise", self.plate_noise)
+
+        # now we can update the initial plate metrics from the constants and the controls
+        self.update_plate(plate_reset=True)
+
+        # initial ball state after updating plate
+        self.set_initial_ball(
+            config.get("initial_x", self.ball.x),
+            config.get("initial_y", self.ball.y),
+            config.get("initial_z", self.ball.z),
+        )
+
+        # velocity set as a vector
+        self.ball_vel.x = config.get("initial_vel_x", self.ball_vel.x)
+        self.ball_vel.y = config.get("initial_vel_y", self.ball_vel.y)
+        self.ball_vel.z = config.get("initial_vel_z", self.ball_vel.z)
+
+        # velocity set as a speed/direction towards target
+        initial_speed = config.get("initial_speed", None)
+        initial_direction = config.get("initial_direction", None)
+        if initial_speed is not None and initial_direction is not None:
+            self.set_velocity_for_speed_and_direction(initial_speed, initial_direction)
+
+    def set_velocity_for_speed_and_direction(self, speed: float, direction: float):
+        # get the heading
+        dx = self.target_x - self.ball.x
+        dy = self.target_y - self.ball.y
+
+        # direction is meaningless if we're already at the target
+        if (dx != 0) or (dy != 0):
+
+            # set the magnitude
+            vel = vector.set_length([dx, dy, 0.0], speed)
+
+            # rotate by direction around Z-axis at ball position
+            rot = matrix33.create_from_axis_rotation([0.0, 0.0, 1.0], direction)
+            vel = matrix33.apply_to_vector(rot, vel)
+
+            # unpack into ball velocity
+            self.ball_vel.x = vel[0]
+            self.ball_vel.y = vel[1]
+            self.ball_vel.z = vel[2]
+
+    def apply_action(self, action: Config):
+        """
+        Apply a simulator action to the controls, clamped to their legal
+        ranges. Missing keys keep the current value.
+        """
+        # use new syntax or fall back to old parameter names
+        self.roll = clamp(action.get("input_roll", self.roll), -1.0, 1.0)
+        self.pitch = clamp(action.get("input_pitch", self.pitch), -1.0, 1.0)
+        self.height_z = clamp(action.get("input_height_z", self.height_z), -1.0, 1.0)
+
     def state(self) -> Dict[str, float]:
+        return dict(zip(STATE_FIELDS, self._state_values()))
+
+    def static_state(self) -> Dict[str, float]:
+        """
+        The STATIC_STATE_FIELDS of state(), which are fixed for an episode.
+        """
+        values = self._state_values()
+        return {
+            name: values[index]
+            for name, index in zip(STATIC_STATE_FIELDS, _STATIC_STATE_INDEX)
+        }
+
+    def dynamic_state(self) -> Dict[str, float]:
+        """
+        The DYNAMIC_STATE_FIELDS of state(), which change from step to step.
+        """
+        values = self._state_values()
+        return {
+            name: values[index]
+            for name, index in zip(DYNAMIC_STATE_FIELDS, _DYNAMIC_STATE_INDEX)
+        }
+
+    def state_array(self) -> np.ndarray:
+        """
+        Returns the state as a new float64 array in STATE_FIELDS order.
+        """
+        buf = np.empty(len(STATE_FIELDS))
+        self.state_into(buf)
+        return buf
+
+    def state_into(self, buf: Buffer):
+        """
+        Writes the state in STATE_FIELDS order into a caller supplied float64
+        array or writable buffer (e.g. a row of a larger array or a memoryview)
+        without building the state dictionary.
+        """
+        if isinstance(buf, np.ndarray):
+            if buf.dtype != np.float64:
+                raise ValueError(
+                    "Expected a float64 state array, got {}".format(buf.dtype)
+                )
+        elif isinstance(buf, memoryview) and buf.format != "d":
+            raise ValueError(
+                "Expected a float64 ('d') memoryview, got '{}'".format(buf.format)
+            )
+        _STATE_STRUCT.pack_into(buf, 0, *self._state_values())
+
+    def _state_values(self) -> Tuple[float, ...]:
+        """
+        The state values in STATE_FIELDS order.
+        """
         # x_theta, y_theta = self._xy_theta_from_nor(self.plate_nor)
-        plate_nor = self._plate_nor()
+        plate_nor_x, plate_nor_y, plate_nor_z = self._plate_nor_xyz()
 
-        return dict(
+        return (
             # reflected input controls
-            roll=self.roll,
-            pitch=self.pitch,
-            height_z=self.height_z,
+            self.roll,
+            self.pitch,
+            self.height_z,
             # reflected constants
-            time_delta=self.time_delta,
-            jitter=self.jitter,
-            step_time=self.step_time,
-            elapsed_time=self.elapsed_time,
-            gravity=self.gravity,
-            plate_radius=self.plate_radius,
-            plate_theta_vel_limit=self.plate_theta_vel_limit,
-            plate_theta_acc=self.plate_theta_acc,
-            plate_theta_limit=self.plate_theta_limit,
-            plate_z_limit=self.plate_z_limit,
-            ball_mass=self.ball_mass,
-            ball_radius=self.ball_radius,
-            ball_shell=self.ball_shell,
-            obstacle_radius=self.obstacle_radius,
-            obstacle_x=self.obstacle_x,
-            obstacle_y=self.obstacle_y,
-            target_x=self.target_x,
-            target_y=self.target_y,
+            self.time_delta,
+            self.jitter,
+            self.step_time,
+            self.elapsed_time,
+            self.gravity,
+            self.plate_radius,
+            self.plate_theta_vel_limit,
+            self.plate_theta_acc,
+            self.plate_theta_limit,
+            self.plate_z_limit,
+            self.ball_mass,
+            self.ball_radius,
+            self.ball_shell,
+            self.obstacle_radius,
+            self.obstacle_x,
+            self.obstacle_y,
+            self.target_x,
+            self.target_y,
             # modelled plate metrics
-            plate_x=self.plate.x,
-            plate_y=self.plate.y,
-            plate_z=self.plate.z,
-            plate_nor_x=plate_nor.x,
-            plate_nor_y=plate_nor.y,
-            plate_nor_z=plate_nor.z,
-            plate_theta_x=self.plate_theta_x,
-            plate_theta_y=self.plate_theta_y,
-            plate_theta_vel_x=self.plate_theta_vel_x,
-            plate_theta_vel_y=self.plate_theta_vel_y,
-            plate_vel_z=self.plate_vel_z,
+            self.plate.x,
+            self.plate.y,
+            self.plate.z,
+            plate_nor_x,
+            plate_nor_y,
+            plate_nor_z,
+            self.plate_theta_x,
+            self.plate_theta_y,
+            self.plate_theta_vel_x,
+            self.plate_theta_vel_y,
+            self.plate_vel_z,
             # modelled ball metrics
-            ball_x=self.ball.x,
-            ball_y=self.ball.y,
-            ball_z=self.ball.z,
-            ball_vel_x=self.ball_vel.x,
-            ball_vel_y=self.ball_vel.y,
-            ball_vel_z=self.ball_vel.z,
-            ball_qat_x=self.ball_qat.x,
-            ball_qat_y=self.ball_qat.y,
-            ball_qat_z=self.ball_qat.z,
-            ball_qat_w=self.ball_qat.w,
-            ball_on_plate_x=self.ball_on_plate.x,
-            ball_on_plate_y=self.ball_on_plate.y,
-            obstacle_distance=self.obstacle_distance,
-            obstacle_direction=self.obstacle_direction,
+            self.ball.x,
+            self.ball.y,
+            self.ball.z,
+            self.ball_vel.x,
+            self.ball_vel.y,
+            self.ball_vel.z,
+            self.ball_qat.x,
+            self.ball_qat.y,
+            self.ball_qat.z,
+            self.ball_qat.w,
+            self.ball_on_plate.x,
+            self.ball_on_plate.y,
+            self.obstacle_distance,
+            self.obstacle_direction,
             # modelled camera observations
-            estimated_x=self.estimated_x,
-            estimated_y=self.estimated_y,
-            estimated_radius=self.estimated_radius,
-            estimated_vel_x=self.estimated_vel_x,
-            estimated_vel_y=self.estimated_vel_y,
+            self.estimated_x,
+            self.estimated_y,
+            self.estimated_radius,
+            self.estimated_vel_x,
+            self.estimated_vel_y,
             # modelled positions and velocities
-            estimated_speed=self.estimated_speed,
-            estimated_direction=self.estimated_direction,
-            estimated_distance=self.estimated_distance,
-            ball_noise=self.ball_noise,
-            plate_noise=self.plate_noise,
+            self.estimated_speed,
+            self.estimated_direction,
+            self.estimated_distance,
+            self.ball_noise,
+            self.plate_noise,
             # meta vars
-            ball_fell_off=1 if self.halted() else 0,
-            iteration_count=self.iteration_count,
+            1 if self.halted() else 0,
+            self.iteration_count,
         )
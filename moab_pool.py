@@ -0,0 +1,420 @@
+"""
+A pool of worker processes stepping slices of Moab models.
+
+Each worker owns a contiguous slice of the environments' MoabModel instances.
+Actions, observations and episode flags live in a ring of slots in one
+shared memory block, and each step is signalled with a pair of semaphores
+per worker, so nothing is pickled on the step path and the physics of each
+slice runs on its own core, outside of the parent's GIL. Only reset()
+configs travel over a pipe.
+
+With a ring of more than one slot a step can be submitted while the results
+of the previous one are still being read, see step_async() and step_wait().
+
+MoabWorkerPool with workers=0 runs the same slices in this process, which is
+what moab_vector_env.MoabVectorEnv uses by default.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python 3.7, where only workers=0 is available
+    SharedMemory = None  # type: ignore
+
+import numpy as np
+
+from moab_model import STATE_FIELDS, Config, MoabModel
+
+DEFAULT_RING_DEPTH = 2  # slots, so one step can be read while the next runs
+WORKER_POLL_INTERVAL = 1.0  # s, between checks that a silent worker is alive
+
+# MoabModel control attributes of the simulator action fields
+CONTROLS = {"input_pitch": "pitch", "input_roll": "roll", "input_height_z": "height_z"}
+
+# flags columns
+TERMINATED, TRUNCATED = 0, 1
+
+# slot commands
+_STEP, _RESET, _CLOSE = 0.0, 1.0, 2.0
+
+
+class _Ring:
+    """
+    The slots of a pool: per slot, the (N, A) actions, (N, F) observations,
+    (N, F) final observations of ended episodes, (N, 2) flags, and the
+    slot's command and failure flag. Private to this process, or laid over
+    a shared memory block.
+    """
+
+    def __init__(
+        self,
+        depth: int,
+        num_envs: int,
+        num_observations: int,
+        num_actions: int,
+        buffer: Optional[memoryview] = None,
+    ):
+        shapes = (
+            ("actions", (depth, num_envs, num_actions)),
+            ("observations", (depth, num_envs, num_observations)),
+            ("final_observations", (depth, num_envs, num_observations)),
+            ("flags", (depth, num_envs, 2)),
+            ("commands", (depth,)),
+            ("failed", (depth,)),
+        )
+        self.depth = depth
+        self.size = sum(int(np.prod(shape)) for _, shape in shapes) * 8
+        if buffer is None:
+            buffer = memoryview(bytearray(self.size))
+
+        offset = 0
+        arrays = {}  # type: Dict[str, np.ndarray]
+        for name, shape in shapes:
+            arrays[name] = np.ndarray(shape, np.float64, buffer, offset)
+            offset += int(np.prod(shape)) * 8
+
+        self.actions = arrays["actions"]
+        self.observations = arrays["observations"]
+        self.final_observations = arrays["final_observations"]
+        self.flags = arrays["flags"]
+        self.commands = arrays["commands"]
+        self.failed = arrays["failed"]
+
+
+class _EnvSlice:
+    """ the environments start..stop of a pool, stepped in one process """
+
+    def __init__(
+        self,
+        ring: _Ring,
+        start: int,
+        stop: int,
+        observation_fields: Sequence[str],
+        action_fields: Sequence[str],
+        iteration_limit: int,
+        engine: str,
+    ):
+        self.ring = ring
+        self.start, self.stop = start, stop
+        self.models = [MoabModel(engine=engine) for _ in range(start, stop)]
+        self.configs = [{} for _ in self.models]  # type: List[Config]
+        # per environment, the seeds of the episodes it autoresets
+        self.seed_sequences = [
+            None for _ in self.models
+        ]  # type: List[Optional[np.random.SeedSequence]]
+        self.controls = [CONTROLS[name] for name in action_fields]
+        self.iteration_limit = iteration_limit
+
+        # full states are written here, then the observed columns are copied out
+        self.states = np.empty((stop - start, len(STATE_FIELDS)))
+        self.columns = [STATE_FIELDS.index(name) for name in observation_fields]
+
+    def reset(self, slot: int, configs: Sequence[Config], seeds: Sequence[Any]):
+        for i, (model, config, seed) in enumerate(zip(self.models, configs, seeds)):
+            if seed is not None:
+                model.seed(seed)
+            self.configs[i] = config
+            self._reset_model(i)
+
+            # a seed in the config would replay the same noise every autoreset,
+            # so those episodes are seeded from children of the given seeds
+            entropy = [] if seed is None else [int(seed)]
+            config_seed = config.get("seed")
+            if config_seed is not None and config_seed >= 0:
+                entropy.append(int(config_seed))
+            self.seed_sequences[i] = (
+                np.random.SeedSequence(entropy) if entropy else None
+            )
+
+        self.ring.flags[slot, self.start : self.stop] = 0.0
+        self.ring.observations[slot, self.start : self.stop] = self.states[
+            :, self.columns
+        ]
+
+    def step(self, slot: int):
+        actions = np.clip(self.ring.actions[slot, self.start : self.stop], -1.0, 1.0)
+        flags = self.ring.flags[slot, self.start : self.stop]
+        finished = []  # type: List[int]
+        for i, (model, action) in enumerate(zip(self.models, actions.tolist())):
+            for control, value in zip(self.controls, action):
+                setattr(model, control, value)
+            model.step()
+            model.state_into(self.states[i])
+
+            terminated = model.halted()
+            truncated = model.iteration_count >= self.iteration_limit
+            flags[i] = (terminated, truncated)
+            if terminated or truncated:
+                finished.append(i)
+
+        # same step autoreset, keeping the last observation of the episode
+        if finished:
+            final = self.ring.final_observations[slot, self.start : self.stop]
+            final[finished] = self.states[finished][:, self.columns]
+            for i in finished:
+                self._autoreset_model(i)
+        self.ring.observations[slot, self.start : self.stop] = self.states[
+            :, self.columns
+        ]
+
+    def _reset_model(self, i: int):
+        model = self.models[i]
+        model.reset()
+        model.configure(self.configs[i])
+        model.state_into(self.states[i])
+
+    def _autoreset_model(self, i: int):
+        sequence = self.seed_sequences[i]
+        if sequence is None:
+            # unseeded, the stream carries on into the next episode
+            self._reset_model(i)
+            return
+
+        model = self.models[i]
+        model.reset()
+        model.seed(int(sequence.spawn(1)[0].generate_state(1)[0]))
+        model.configure(dict(self.configs[i], seed=-1))
+        model.state_into(self.states[i])
+
+
+def _worker(
+    connection: Connection,
+    request: Any,
+    done: Any,
+    shm_name: str,
+    ring_args: Tuple[int, int, int, int],
+    slice_args: Tuple[Any, ...],
+):
+    """ runs the commands posted to the ring on one _EnvSlice until closed """
+    shm = SharedMemory(shm_name)
+    try:
+        ring = _Ring(*ring_args, buffer=shm.buf)
+        envs = _EnvSlice(ring, *slice_args)
+        sequence = 0
+        while True:
+            request.acquire()
+            slot = sequence % ring.depth
+            sequence += 1
+
+            command = ring.commands[slot]
+            if command == _CLOSE:
+                break
+            try:
+                if command == _RESET:
+                    envs.reset(slot, *connection.recv())
+                else:
+                    envs.step(slot)
+            except Exception:
+                ring.failed[slot] = 1.0
+                connection.send(traceback.format_exc())
+            done.release()
+        del ring, envs
+    finally:
+        shm.close()
+
+
+class MoabWorkerPool:
+    """
+    num_envs MoabModel environments split across `workers` processes, or
+    stepped in this process when workers is 0.
+
+    The arrays returned by reset() and step_wait() are views of a ring slot.
+    They stay valid until `depth` more steps have been submitted.
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        observation_fields: Sequence[str],
+        action_fields: Sequence[str],
+        iteration_limit: int,
+        workers: int = 0,
+        engine: str = "python",
+        depth: int = DEFAULT_RING_DEPTH,
+    ):
+        self.num_envs = num_envs
+        self.closed = False
+        ring_args = (depth, num_envs, len(observation_fields), len(action_fields))
+        slice_args = (observation_fields, action_fields, iteration_limit, engine)
+
+        self._sequence = 0  # commands posted
+        self._pending = 0  # commands posted but not yet waited for
+        self._shm = None  # type: Optional[SharedMemory]
+        self._local = None  # type: Optional[_EnvSlice]
+        self._connections = []  # type: List[Connection]
+        self._requests = []  # type: List[Any]
+        self._done = []  # type: List[Any]
+        self._processes = []  # type: List[Any]
+
+        if workers <= 0:
+            self._ring = _Ring(*ring_args)
+            self._local = _EnvSlice(self._ring, 0, num_envs, *slice_args)
+            self._bounds = [(0, num_envs)]
+            return
+        if SharedMemory is None:
+            raise RuntimeError(
+                "Worker processes require Python 3.8 or later, use workers=0"
+            )
+
+        self._shm = SharedMemory(create=True, size=_Ring(*ring_args).size)
+        self._ring = _Ring(*ring_args, buffer=self._shm.buf)
+        bounds = np.linspace(0, num_envs, min(workers, num_envs) + 1).astype(int)
+        self._bounds = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        for start, stop in self._bounds:
+            parent, child = multiprocessing.Pipe()
+            request, done = multiprocessing.Semaphore(0), multiprocessing.Semaphore(0)
+            process = multiprocessing.Process(
+                target=_worker,
+                args=(
+                    child,
+                    request,
+                    done,
+                    self._shm.name,
+                    ring_args,
+                    (start, stop) + slice_args,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._requests.append(request)
+            self._done.append(done)
+            self._processes.append(process)
+
+    def reset(
+        self, configs: Sequence[Config], seeds: Sequence[Optional[int]]
+    ) -> np.ndarray:
+        """ resets every environment, returns the first observations """
+        if self._pending:
+            raise RuntimeError("Cannot reset with steps in flight")
+        if len(configs) != self.num_envs or len(seeds) != self.num_envs:
+            raise ValueError(
+                "Expected {} configs and seeds, got {} and {}".format(
+                    self.num_envs, len(configs), len(seeds)
+                )
+            )
+
+        if self._local is not None:
+            slot = self._post(_RESET)
+            try:
+                self._local.reset(slot, configs, seeds)
+            except BaseException:
+                self._cancel()
+                raise
+        else:
+            # pickled before posting, so a config that can't be sent posts nothing
+            messages = [
+                ForkingPickler.dumps((configs[start:stop], seeds[start:stop]))
+                for start, stop in self._bounds
+            ]
+            slot = self._post(_RESET)
+            for connection, message in zip(self._connections, messages):
+                connection.send_bytes(message)
+            self._release()
+        self._wait()
+        return self._ring.observations[slot]
+
+    def step_async(self, actions: np.ndarray):
+        """ submits a step with the (num_envs, A) actions """
+        if self._pending == self._ring.depth:
+            raise RuntimeError(
+                "All {} ring slots are in flight, wait for a step first".format(
+                    self._ring.depth
+                )
+            )
+        actions = np.asarray(actions, dtype=np.float64)
+        shape = self._ring.actions.shape[1:]
+        if actions.shape != shape:
+            # no broadcasting, a (num_envs, 1) array would set every control
+            raise ValueError(
+                "Expected actions of shape {}, got {}".format(shape, actions.shape)
+            )
+
+        slot = self._post(_STEP)
+        self._ring.actions[slot] = actions
+        if self._local is not None:
+            try:
+                self._local.step(slot)
+            except BaseException:
+                self._cancel()
+                raise
+        else:
+            self._release()
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Waits for the oldest submitted step, and returns its observations,
+        final observations and flags.
+        """
+        if not self._pending:
+            raise RuntimeError("No step in flight")
+        slot = self._wait()
+        ring = self._ring
+        return ring.observations[slot], ring.final_observations[slot], ring.flags[slot]
+
+    def _post(self, command: float) -> int:
+        slot = self._sequence % self._ring.depth
+        self._ring.commands[slot] = command
+        self._ring.failed[slot] = 0.0
+        self._sequence += 1
+        self._pending += 1
+        return slot
+
+    def _cancel(self):
+        """ takes back the last command posted, which the local slice failed """
+        self._sequence -= 1
+        self._pending -= 1
+
+    def _release(self):
+        for request in self._requests:
+            request.release()
+
+    def _wait(self) -> int:
+        slot = (self._sequence - self._pending) % self._ring.depth
+        self._pending -= 1
+        for done, process in zip(self._done, self._processes):
+            while not done.acquire(timeout=WORKER_POLL_INTERVAL):
+                if not process.is_alive():
+                    raise RuntimeError(
+                        "Moab pool worker exited with code {}".format(process.exitcode)
+                    )
+
+        if self._ring.failed[slot]:
+            errors = [c.recv() for c in self._connections if c.poll()]
+            raise RuntimeError("Moab pool worker failed:\n" + "\n".join(errors))
+        return slot
+
+    def close(self):
+        """ stops the worker processes and releases the shared memory """
+        if self.closed:
+            return
+        self.closed = True
+
+        if self._processes:
+            self._post(_CLOSE)
+            self._release()
+            for process in self._processes:
+                process.join()
+            for connection in self._connections:
+                connection.close()
+
+        if self._shm is not None:
+            del self._ring
+            self._shm.close()
+            self._shm.unlink()
+
+    def __enter__(self) -> "MoabWorkerPool":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
@@ -0,0 +1,292 @@
+"""
+Opt-in timing of the phases of MoabModel.step().
+
+PhaseProfiler replaces the phase methods of one model instance with wrappers
+that add their perf_counter_ns() time and call count to per-phase totals.
+Models that aren't profiled run the class methods untouched, so profiling
+costs nothing until it is enabled, see MoabModel.enable_profiling().
+
+Times are inclusive: the time of step() includes that of the phases it runs.
+
+With an allocation sample interval N, every Nth call of a phase is also
+measured with tracemalloc: the peak memory it allocated above the level it
+started at, and the memory it still held on return. tracemalloc is started
+if it isn't already tracing, which slows every allocation of the process
+while it is on.
+
+LatencyHistogram counts call latencies HDR-style, in buckets whose width
+grows with the latency so that every value is kept to within a fixed
+relative precision, for the tail percentiles of long running simulators.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Mapping, Sequence
+
+# the MoabModel methods timed by default
+PROFILED_PHASES = (
+    "step",
+    "advance",
+    "_compiled_step",
+    "update_plate",
+    "_ball_plate_contact",
+    "_substep_ball",
+    "_update_estimated_ball",
+    "state",
+    "dynamic_state",
+    "state_into",
+)
+
+
+class PhaseStats:
+    """ the totals of one phase """
+
+    __slots__ = ("calls", "total_ns", "samples", "peak_bytes", "retained_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.samples = 0
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        stats = {
+            "calls": float(self.calls),
+            "total_ns": float(self.total_ns),
+            "mean_ns": self.total_ns / self.calls if self.calls else 0.0,
+        }
+        if self.samples:
+            stats["alloc_samples"] = float(self.samples)
+            stats["peak_bytes"] = self.peak_bytes / self.samples
+            stats["retained_bytes"] = self.retained_bytes / self.samples
+        return stats
+
+
+class _Sample:
+    """ a tracemalloc measurement in progress """
+
+    __slots__ = ("start", "seen_peak")
+
+    def __init__(self, start: int):
+        self.start = start
+        # the highest peak of the samples nested in this one
+        self.seen_peak = 0
+
+
+class PhaseProfiler:
+    """
+    Times the phases of target, an object with those methods, until
+    detach() restores them.
+    """
+
+    def __init__(
+        self,
+        target: Any,
+        phases: Sequence[str] = PROFILED_PHASES,
+        alloc_sample_interval: int = 0,
+    ):
+        self.target = target
+        self.alloc_sample_interval = alloc_sample_interval
+        self.phases = {}  # type: Dict[str, PhaseStats]
+        self._samples = []  # type: List[_Sample]
+
+        if alloc_sample_interval > 0 and not hasattr(tracemalloc, "reset_peak"):
+            raise ValueError("Allocation sampling requires Python 3.9 or later")
+
+        self._started_tracing = False
+        if alloc_sample_interval > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        for name in phases:
+            stats = self.phases[name] = PhaseStats()
+            setattr(target, name, self._wrap(getattr(target, name), stats))
+
+    def detach(self):
+        """ restores the class methods of the target """
+        for name in self.phases:
+            if name in vars(self.target):
+                delattr(self.target, name)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def reset(self):
+        for name in self.phases:
+            self.phases[name].__init__()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """ the totals of the phases that have run, see PhaseStats.as_dict() """
+        return {
+            name: stats.as_dict() for name, stats in self.phases.items() if stats.calls
+        }
+
+    def _wrap(
+        self, method: Callable[..., Any], stats: PhaseStats
+    ) -> Callable[..., Any]:
+        counter = time.perf_counter_ns
+        interval = self.alloc_sample_interval
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            if interval > 0 and stats.calls % interval == 0:
+                return self._sampled(method, stats, args, kwargs)
+            start = counter()
+            result = method(*args, **kwargs)
+            stats.total_ns += counter() - start
+            stats.calls += 1
+            return result
+
+        return timed
+
+    def _sampled(
+        self,
+        method: Callable[..., Any],
+        stats: PhaseStats,
+        args: Sequence[Any],
+        kwargs: Dict[str, Any],
+    ) -> Any:
+        current, peak = tracemalloc.get_traced_memory()
+        if self._samples:
+            # resetting the peak below loses the enclosing sample's peak so far
+            outer = self._samples[-1]
+            outer.seen_peak = max(outer.seen_peak, peak)
+        sample = _Sample(current)
+        self._samples.append(sample)
+        tracemalloc.reset_peak()
+
+        start = time.perf_counter_ns()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self._samples.pop()
+
+        end, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, sample.seen_peak)
+        if self._samples:
+            outer = self._samples[-1]
+            outer.seen_peak = max(outer.seen_peak, peak)
+
+        stats.total_ns += elapsed
+        stats.calls += 1
+        stats.samples += 1
+        stats.peak_bytes += peak - sample.start
+        stats.retained_bytes += end - sample.start
+        return result
+
+
+def format_stats(stats: Dict[str, Dict[str, float]]) -> str:
+    """ a table of profile stats, slowest phase first """
+    lines = ["phase                        calls    mean us   total ms   peak B"]
+    for name, phase in sorted(stats.items(), key=lambda item: -item[1]["total_ns"]):
+        lines.append(
+            "{:26s} {:8.0f} {:10.2f} {:10.1f} {:8s}".format(
+                name,
+                phase["calls"],
+                phase["mean_ns"] / 1e3,
+                phase["total_ns"] / 1e6,
+                "{:.0f}".format(phase["peak_bytes"]) if "peak_bytes" in phase else "-",
+            )
+        )
+    return "\n".join(lines)
+
+
+# percentiles reported by LatencyHistogram.summary()
+LATENCY_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in ns, each kept to within 2 ** (1 - precision_bits)
+    of its value, up to max_ns. Longer latencies are counted as max_ns, but
+    the exact maximum is kept.
+    """
+
+    __slots__ = ("precision_bits", "max_ns", "counts", "count", "total_ns", "max")
+
+    def __init__(self, precision_bits: int = 7, max_ns: int = 2 ** 40):
+        self.precision_bits = precision_bits
+        self.max_ns = max_ns
+        self.counts = [0] * (self._index(max_ns) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        # values below 2 ** precision_bits have a bucket each, and each
+        # doubling above that has 2 ** (precision_bits - 1) buckets
+        shift = value.bit_length() - self.precision_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.precision_bits - 1)) + (value >> shift)
+
+    def _highest_value(self, index: int) -> int:
+        """ the highest value counted in the bucket at index """
+        shift = (index >> (self.precision_bits - 1)) - 1
+        if shift <= 0:
+            return index
+        return ((index - (shift << (self.precision_bits - 1)) + 1) << shift) - 1
+
+    def record(self, value_ns: int):
+        self.count += 1
+        self.total_ns += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+        self.counts[self._index(min(max(value_ns, 0), self.max_ns))] += 1
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total_ns = 0
+        self.max = 0
+
+    def percentile(self, percent: float) -> int:
+        """ the highest value of the bucket that holds this percentile, in ns """
+        if not self.count:
+            return 0
+        rank = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and index < len(self.counts) - 1:
+                return min(self._highest_value(index), self.max)
+        # the last bucket holds the latencies from max_ns up
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        stats = {
+            "count": float(self.count),
+            "mean_ns": self.total_ns / self.count if self.count else 0.0,
+            "max_ns": float(self.max),
+        }
+        for percent in LATENCY_PERCENTILES:
+            stats["p{:g}_ns".format(percent)] = float(self.percentile(percent))
+        return stats
+
+
+def format_latency(histograms: Mapping[str, LatencyHistogram]) -> str:
+    """ a table of the latency percentiles of the histograms that have counts """
+    lines = [
+        "call                  count    mean us    p50 us    p90 us    p99 us  p99.9 us    max us"
+    ]
+    for name, histogram in histograms.items():
+        if not histogram.count:
+            continue
+        stats = histogram.summary()
+        lines.append(
+            "{:16s} {:10.0f} {:10.1f} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {:9.1f}".format(
+                name,
+                stats["count"],
+                stats["mean_ns"] / 1e3,
+                stats["p50_ns"] / 1e3,
+                stats["p90_ns"] / 1e3,
+                stats["p99_ns"] / 1e3,
+                stats["p99.9_ns"] / 1e3,
+                stats["max_ns"] / 1e3,
+            )
+        )
+    return "\n".join(lines)
@@ -0,0 +1,355 @@
+"""
+Local episode recording for the Moab simulator.
+
+TrajectoryRecorder copies the state and controls of every iteration into
+preallocated arrays, and hands each finished episode to a background thread
+that writes it out as one file per episode: Parquet when pyarrow is
+installed, compressed .npz otherwise. The simulator's step loop only pays for
+a row copy per iteration.
+
+For datasets too large to load, the recorder can instead append episodes to a
+TrajectoryStore: one memory-mapped file of fixed-width rows plus an episode
+index, which replay and training code can slice without parsing or copying.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import hashlib
+import importlib.util
+import json
+import os
+import queue
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from moab_model import STATE_FIELDS, Config, MoabModel
+
+# pyarrow is slow to import, so it is only imported to write or read parquet
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# control columns recorded after the state columns of each row
+CONTROL_FIELDS = ("input_pitch", "input_roll", "input_height_z")
+RECORD_FIELDS = STATE_FIELDS + CONTROL_FIELDS
+
+DEFAULT_EPISODE_CAPACITY = 1024  # rows preallocated per episode, grows as needed
+DEFAULT_QUEUE_SIZE = 8  # finished episodes waiting to be written
+
+FORMATS = ("parquet", "npz", "store")
+
+# TrajectoryStore files
+STORE_ROWS_FILE = "rows.f64"
+STORE_INDEX_FILE = "index.jsonl"
+
+
+class RecordedEpisode(NamedTuple):
+    """
+    An episode read back by load_episode().
+
+    columns: RECORD_FIELDS name -> one value per iteration. Row 0 is the state
+             after episode start, each later row the state after a step along
+             with the controls of that step. Row 0 has NaN controls.
+    """
+
+    index: int
+    config: Config
+    reason: str
+    columns: Dict[str, np.ndarray]
+
+
+class EpisodeEntry(NamedTuple):
+    """ where an episode lives in a TrajectoryStore, and how it ended """
+
+    episode: int
+    start: int  # first row
+    stop: int  # one past the last row
+    config_hash: str
+    reason: str
+
+
+def config_hash(config: Config) -> str:
+    """ a short stable hash of an episode config, for grouping episodes """
+    text = json.dumps(config, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class TrajectoryStore:
+    """
+    An append-only store of recorded episodes in `directory`.
+
+    Rows of RECORD_FIELDS, laid out as in RecordedEpisode, are appended to a
+    raw float64 file that is read back through a memory map, so episode() and
+    rows() return views into the page cache rather than copies. An index of
+    EpisodeEntry lines maps each episode to its row range. Rows are written
+    before their index entry, so an interrupted append is ignored on reopen.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._rows_path = os.path.join(directory, STORE_ROWS_FILE)
+        self._index_path = os.path.join(directory, STORE_INDEX_FILE)
+
+        self._entries = []  # type: List[EpisodeEntry]
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as file:
+                for line in file:
+                    self._entries.append(EpisodeEntry(**json.loads(line)))
+
+        self._mapped = np.empty((0, len(RECORD_FIELDS)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def entries(self) -> List[EpisodeEntry]:
+        return self._entries
+
+    @property
+    def row_count(self) -> int:
+        return self._entries[-1].stop if self._entries else 0
+
+    def append(self, rows: np.ndarray, config: Config, reason: str) -> int:
+        """ appends an episode's rows, returns its episode id """
+        rows = np.ascontiguousarray(rows, dtype=np.float64)
+        if rows.ndim != 2 or rows.shape[1] != len(RECORD_FIELDS):
+            raise ValueError(
+                "Expected rows of {} fields, got shape {}".format(
+                    len(RECORD_FIELDS), rows.shape
+                )
+            )
+
+        # write over anything left behind by an interrupted append
+        start = self.row_count
+        with open(
+            self._rows_path, "r+b" if os.path.exists(self._rows_path) else "wb"
+        ) as file:
+            file.seek(start * rows.itemsize * len(RECORD_FIELDS))
+            file.write(rows.tobytes())
+            file.truncate()
+
+        entry = EpisodeEntry(
+            len(self._entries), start, start + len(rows), config_hash(config), reason
+        )
+        with open(self._index_path, "a") as file:
+            file.write(json.dumps(entry._asdict()) + "\n")
+        self._entries.append(entry)
+        return entry.episode
+
+    def rows(self) -> np.ndarray:
+        """ a read-only (row_count, len(RECORD_FIELDS)) view of every row """
+        if len(self._mapped) < self.row_count:
+            self._mapped = np.memmap(
+                self._rows_path,
+                dtype=np.float64,
+                mode="r",
+                shape=(self.row_count, len(RECORD_FIELDS)),
+            )
+        return self._mapped[: self.row_count]
+
+    def episode(self, episode: int) -> np.ndarray:
+        """ a read-only view of one episode's rows """
+        entry = self._entries[episode]
+        return self.rows()[entry.start : entry.stop]
+
+    def column(self, name: str) -> np.ndarray:
+        """ a read-only strided view of one RECORD_FIELDS column of every row """
+        return self.rows()[:, RECORD_FIELDS.index(name)]
+
+
+class TrajectoryRecorder:
+    """
+    Records episodes of a MoabModel into `directory`, as
+    episode_<index>.parquet or episode_<index>.npz files, or appended to a
+    TrajectoryStore in the directory for the "store" format.
+
+        recorder.start(config, model)   # after the model is configured
+        recorder.record(model)          # after each step
+        recorder.finish(reason)         # queues the episode to be written
+        recorder.close()                # waits for pending writes
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        format: Optional[str] = None,
+        capacity: int = DEFAULT_EPISODE_CAPACITY,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        if format is None:
+            format = "parquet" if HAVE_PYARROW else "npz"
+        if format not in FORMATS:
+            raise ValueError("Unknown recording format {}".format(format))
+        if format == "parquet" and not HAVE_PYARROW:
+            raise ValueError("Recording to parquet requires pyarrow")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.capacity = capacity
+
+        # new episodes continue the numbering of an existing recording, e.g.
+        # of a simulator restarted into the same directory
+        self._store = None  # type: Optional[TrajectoryStore]
+        if format == "store":
+            self._store = TrajectoryStore(directory)
+            self.episode_count = len(self._store)
+        else:
+            self.episode_count = next_episode_index(directory)
+
+        self._rows = np.empty((0, len(RECORD_FIELDS)))
+        self._size = 0
+        self._config = {}  # type: Config
+        self._recording = False
+
+        # the writer drains the queue until it reads None
+        self._queue = queue.Queue(queue_size)  # type: queue.Queue[Any]
+        self._error = None  # type: Optional[BaseException]
+        self._writer = threading.Thread(
+            target=self._write_episodes, name="TrajectoryRecorder", daemon=True
+        )
+        self._writer.start()
+
+    def start(self, config: Config, model: MoabModel):
+        """ begins an episode, recording the model's initial state """
+        if self._recording:
+            self.finish("")
+
+        self._rows = np.empty((self.capacity, len(RECORD_FIELDS)))
+        self._size = 0
+        self._config = dict(config)
+        self._recording = True
+        self.record(model, initial=True)
+
+    def record(self, model: MoabModel, initial: bool = False):
+        """ appends the model's state and current controls """
+        if self._size == len(self._rows):
+            self._rows = np.concatenate((self._rows, np.empty_like(self._rows)))
+
+        row = self._rows[self._size]
+        model.state_into(row)
+        if initial:
+            row[len(STATE_FIELDS) :] = np.nan
+        else:
+            row[len(STATE_FIELDS) :] = (model.pitch, model.roll, model.height_z)
+        self._size += 1
+
+    def finish(self, reason: str):
+        """
+        Ends the episode and queues it to be written. Blocks only if the
+        writer has fallen DEFAULT_QUEUE_SIZE episodes behind.
+        """
+        self._check_writer()
+        if not self._recording:
+            return
+
+        self._recording = False
+        self._queue.put(
+            (self.episode_count, self._config, reason, self._rows[: self._size])
+        )
+        self.episode_count += 1
+
+    def close(self):
+        """ finishes any episode in progress and waits for all writes """
+        if self._writer.is_alive():
+            self.finish("")
+            self._queue.put(None)
+            self._writer.join()
+        self._check_writer()
+
+    def __enter__(self) -> "TrajectoryRecorder":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError("Failed to write a recorded episode") from self._error
+
+    def _write_episodes(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    self._write_episode(*item)
+                except BaseException as e:
+                    self._error = e
+
+    def _write_episode(self, index: int, config: Config, reason: str, rows: np.ndarray):
+        if self._store is not None:
+            self._store.append(rows, config, reason)
+            return
+
+        path = episode_path(self.directory, index, self.format)
+        metadata = {"index": index, "config": config, "reason": reason}
+
+        # stored column by column
+        columns = [np.ascontiguousarray(column) for column in rows.T]
+        if self.format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(column) for column in columns],
+                names=list(RECORD_FIELDS),
+                metadata={"moab": json.dumps(metadata)},
+            )
+            pyarrow.parquet.write_table(table, path)
+        else:
+            arrays = dict(zip(RECORD_FIELDS, columns))
+            arrays["__metadata__"] = np.array(json.dumps(metadata))
+            np.savez_compressed(path, **arrays)
+
+
+def episode_path(directory: str, index: int, format: str) -> str:
+    return os.path.join(directory, "episode_{:06d}.{}".format(index, format))
+
+
+def next_episode_index(directory: str) -> int:
+    """ the index after the highest of the episode files in a directory """
+    highest = -1
+    for name in os.listdir(directory):
+        stem, _, extension = name.partition(".")
+        if stem.startswith("episode_") and extension in FORMATS:
+            index = stem[len("episode_") :]
+            if index.isdigit():
+                highest = max(highest, int(index))
+    return highest + 1
+
+
+def load_episode(path: str) -> RecordedEpisode:
+    """ reads an episode file written by TrajectoryRecorder """
+    if path.endswith(".parquet"):
+        if not HAVE_PYARROW:
+            raise ValueError("Reading parquet recordings requires pyarrow")
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(path)
+        metadata = json.loads(table.schema.metadata[b"moab"])
+        columns = {
+            name: table.column(name).to_numpy() for name in table.column_names
+        }  # type: Dict[str, np.ndarray]
+    else:
+        with np.load(path) as arrays:
+            metadata = json.loads(str(arrays["__metadata__"]))
+            columns = {name: arrays[name] for name in RECORD_FIELDS}
+
+    return RecordedEpisode(
+        metadata["index"], metadata["config"], metadata["reason"], columns
+    )
+
+
+def load_episodes(directory: str) -> List[RecordedEpisode]:
+    """ reads every recorded episode in a directory, in episode order """
+    names = sorted(
+        name
+        for name in os.listdir(directory)
+        if name.startswith("episode_")
+        and name.endswith(tuple("." + format for format in FORMATS))
+    )
+    return [load_episode(os.path.join(directory, name)) for name in names]
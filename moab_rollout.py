@@ -0,0 +1,196 @@
+"""
+Local multi-episode rollouts of the Moab model.
+
+Runs a list of episode configurations, such as the `episodeConfigurations`
+of assess_config.json, against a policy across a pool of worker processes,
+without connecting to the platform. Each episode runs start to finish in one
+worker and returns a compact Trajectory of state and action arrays.
+
+    python3 moab_rollout.py assess_config.json --workers 8
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from moab_model import STATE_FIELDS, Config, MoabModel
+
+# action fields, in the column order of Trajectory.actions
+ACTION_FIELDS = ("input_pitch", "input_roll", "input_height_z")
+
+# the iteration limit used by the tutorial brains and assessments
+DEFAULT_EPISODE_ITERATION_LIMIT = 250
+
+# a policy maps a state dictionary to an action dictionary, with the same
+# keys the platform would send. it must be picklable to run in a pool, so a
+# module level function or an instance of a module level class.
+Policy = Callable[[Dict[str, float]], Config]
+
+
+class Trajectory(NamedTuple):
+    """
+    The result of one episode.
+
+    states:  (T+1, len(STATE_FIELDS)) float64, the state after episode start
+             and after each of the T steps.
+    actions: (T, len(ACTION_FIELDS)) float64, the clamped controls of each step.
+    halted:  True if the episode ended on a halt rather than the limit.
+    """
+
+    index: int
+    config: Config
+    states: np.ndarray
+    actions: np.ndarray
+    halted: bool
+
+    def state(self, field: str) -> np.ndarray:
+        """ the column of states for one STATE_FIELDS name """
+        return self.states[:, STATE_FIELDS.index(field)]
+
+    @property
+    def iterations(self) -> int:
+        return len(self.actions)
+
+
+def zero_policy(state: Dict[str, float]) -> Config:
+    """ holds the plate flat and centered """
+    return {"input_pitch": 0.0, "input_roll": 0.0, "input_height_z": 0.0}
+
+
+def load_episode_configs(path: str) -> List[Config]:
+    """ reads the episodeConfigurations of an assessment config file """
+    with open(path, "r") as file:
+        return json.load(file)["episodeConfigurations"]
+
+
+def run_episode(
+    config: Config,
+    policy: Policy,
+    iteration_limit: int = DEFAULT_EPISODE_ITERATION_LIMIT,
+    index: int = 0,
+) -> Trajectory:
+    """
+    Runs one episode the same way the simulator does: reset and configure,
+    then alternate policy actions and steps until halted or the limit.
+    """
+    model = MoabModel()
+    model.configure(config)
+
+    states = np.empty((iteration_limit + 1, len(STATE_FIELDS)))
+    actions = np.empty((iteration_limit, len(ACTION_FIELDS)))
+    model.state_into(states[0])
+
+    steps = 0
+    halted = model.halted()
+    while not halted and steps < iteration_limit:
+        model.apply_action(policy(model.state()))
+        actions[steps] = (model.pitch, model.roll, model.height_z)
+        model.step()
+        steps += 1
+
+        model.state_into(states[steps])
+        halted = model.halted()
+
+    return Trajectory(index, config, states[: steps + 1], actions[:steps], halted)
+
+
+def _run_chunk(
+    chunk: Sequence[Tuple[int, Config]], policy: Policy, iteration_limit: int
+) -> List[Trajectory]:
+    return [
+        run_episode(config, policy, iteration_limit, index) for index, config in chunk
+    ]
+
+
+def _episode_seed(config: Config, default: int) -> int:
+    """ the config's seed, unless it is unset or negative """
+    seed = config.get("seed")
+    if seed is None or seed < 0:
+        return default
+    return int(seed)
+
+
+def rollout(
+    configs: Sequence[Config],
+    policy: Policy = zero_policy,
+    workers: Optional[int] = None,
+    iteration_limit: int = DEFAULT_EPISODE_ITERATION_LIMIT,
+    seed: Optional[int] = None,
+) -> List[Trajectory]:
+    """
+    Runs one episode per config and returns their trajectories in config order.
+
+    workers: number of worker processes, os.cpu_count() if None. With 1 the
+             episodes run in this process and the policy need not be picklable.
+    seed:    when set, episode i has its noise seeded from a stream derived
+             from this seed, so results don't depend on the number of workers.
+             A "seed" of 0 or more in an episode's config takes precedence,
+             a negative one, the interface default of -1, means unseeded.
+    """
+    episodes = list(enumerate(configs))
+    if seed is not None:
+        seeds = np.random.SeedSequence(seed).generate_state(len(episodes))
+        episodes = [
+            (index, dict(config, seed=_episode_seed(config, int(episode_seed))))
+            for (index, config), episode_seed in zip(episodes, seeds)
+        ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(episodes) <= 1:
+        return _run_chunk(episodes, policy, iteration_limit)
+
+    # a few chunks per worker keeps the pool busy through uneven episode
+    # lengths, while amortizing the cost of shipping work to the processes
+    chunk_size = max(1, math.ceil(len(episodes) / (workers * 4)))
+    chunks = [episodes[i : i + chunk_size] for i in range(0, len(episodes), chunk_size)]
+
+    trajectories = []  # type: List[Trajectory]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for result in pool.map(
+            _run_chunk,
+            chunks,
+            [policy] * len(chunks),
+            [iteration_limit] * len(chunks),
+        ):
+            trajectories.extend(result)
+    return trajectories
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("config", help="assessment config with episodeConfigurations")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each config")
+    parser.add_argument(
+        "--iterations", type=int, default=DEFAULT_EPISODE_ITERATION_LIMIT
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    configs = load_episode_configs(args.config) * args.repeat
+    start = time.perf_counter()
+    trajectories = rollout(
+        configs, workers=args.workers, iteration_limit=args.iterations, seed=args.seed
+    )
+    elapsed = time.perf_counter() - start
+
+    steps = sum(t.iterations for t in trajectories)
+    halts = sum(t.halted for t in trajectories)
+    print(
+        "{} episodes, {} halted, {} steps in {:.2f}s ({:.0f} steps/s)".format(
+            len(trajectories), halts, steps, elapsed, steps / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
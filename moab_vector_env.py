@@ -0,0 +1,212 @@
+"""
+Vectorized Moab environments for local training.
+
+MoabVectorEnv steps many MoabModel instances with the batched reset()/step()
+interface of a Gymnasium vector environment, without going through the
+platform. Observations are stacked NumPy rows of state() fields, actions are
+stacked rows of the simulator's action fields, and environments that halt or
+reach the iteration limit are reset within the same step.
+
+The environments run in this process, or split across the worker processes
+of a moab_pool.MoabWorkerPool, which exchange actions and observations
+through shared memory rather than serializing them each step.
+
+    env = MoabVectorEnv(64, workers=4)
+    observations, infos = env.reset(config, seed=1)
+    observations, rewards, terminated, truncated, infos = env.step(actions)
+    env.close()
+
+Gymnasium itself is optional; when installed the spaces are available as
+`observation_space` and `action_space`.
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from moab_model import STATE_FIELDS, Config
+from moab_pool import DEFAULT_RING_DEPTH, TERMINATED, TRUNCATED, MoabWorkerPool
+from moab_rollout import ACTION_FIELDS, DEFAULT_EPISODE_ITERATION_LIMIT
+
+# maps a batch of observations to a batch of rewards
+RewardFunction = Callable[[np.ndarray], np.ndarray]
+
+# step() info keys for the environments that were reset within the step,
+# as in Gymnasium's same-step autoreset
+FINAL_OBSERVATION = "final_obs"
+FINAL_MASK = "_final_obs"
+
+
+class MoabVectorEnv:
+    """
+    num_envs Moab environments stepped as a batch.
+
+    observation_fields: the state() fields of each observation row.
+    action_fields:      the action fields of each action row, clamped to
+                        [-1, 1]. Controls left out keep their configured value.
+    iteration_limit:    episodes are truncated after this many steps.
+    workers:            0 runs the environments in this process, otherwise
+                        they are split across this many worker processes.
+    engine:             the MoabModel engine, see MoabModel.
+    reward:             maps the (num_envs, F) observations after a step to
+                        (num_envs,) rewards. Rewards are zero if not set.
+    depth:              steps that can be in flight at once, see step_async().
+    """
+
+    metadata = {"autoreset_mode": "SameStep"}  # type: Dict[str, Any]
+
+    def __init__(
+        self,
+        num_envs: int,
+        observation_fields: Sequence[str] = STATE_FIELDS,
+        action_fields: Sequence[str] = ACTION_FIELDS,
+        iteration_limit: int = DEFAULT_EPISODE_ITERATION_LIMIT,
+        workers: int = 0,
+        engine: str = "python",
+        reward: Optional[RewardFunction] = None,
+        depth: int = DEFAULT_RING_DEPTH,
+    ):
+        for name in observation_fields:
+            if name not in STATE_FIELDS:
+                raise ValueError("Unknown observation field {}".format(name))
+        for name in action_fields:
+            if name not in ACTION_FIELDS:
+                raise ValueError("Unknown action field {}".format(name))
+
+        self.num_envs = num_envs
+        self.observation_fields = tuple(observation_fields)
+        self.action_fields = tuple(action_fields)
+        self.reward = reward
+        self._pool = MoabWorkerPool(
+            num_envs,
+            self.observation_fields,
+            self.action_fields,
+            iteration_limit,
+            workers,
+            engine,
+            depth,
+        )
+
+    @property
+    def closed(self) -> bool:
+        return self._pool.closed
+
+    @property
+    def single_observation_space(self) -> Any:
+        import gymnasium
+
+        shape = (len(self.observation_fields),)
+        return gymnasium.spaces.Box(-np.inf, np.inf, shape, np.float64)
+
+    @property
+    def single_action_space(self) -> Any:
+        import gymnasium
+
+        return gymnasium.spaces.Box(-1.0, 1.0, (len(self.action_fields),), np.float64)
+
+    @property
+    def observation_space(self) -> Any:
+        import gymnasium
+
+        shape = (self.num_envs, len(self.observation_fields))
+        return gymnasium.spaces.Box(-np.inf, np.inf, shape, np.float64)
+
+    @property
+    def action_space(self) -> Any:
+        import gymnasium
+
+        shape = (self.num_envs, len(self.action_fields))
+        return gymnasium.spaces.Box(-1.0, 1.0, shape, np.float64)
+
+    def reset(
+        self,
+        configs: Union[None, Config, Sequence[Config]] = None,
+        seed: Optional[int] = None,
+    ) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """
+        Resets every environment and returns the first observations.
+
+        configs: one episode config for all environments, or one each. Each
+                 environment keeps its config for the episodes it autoresets.
+        seed:    when set, environment i has its noise seeded from a stream
+                 derived from this seed, as in moab_rollout.rollout(). A
+                 "seed" of 0 or more in an environment's config takes
+                 precedence for the first episode. The episodes autoreset
+                 after it are seeded from children of these seeds, so they
+                 don't replay the same noise.
+        """
+        if configs is None:
+            configs = [{}] * self.num_envs
+        elif isinstance(configs, dict):
+            configs = [configs] * self.num_envs
+        configs = list(configs)  # type: ignore
+        if len(configs) != self.num_envs:
+            raise ValueError(
+                "Expected {} configs, got {}".format(self.num_envs, len(configs))
+            )
+
+        seeds = [None] * self.num_envs  # type: List[Optional[int]]
+        if seed is not None:
+            seeds = np.random.SeedSequence(seed).generate_state(self.num_envs).tolist()
+
+        return self._pool.reset(configs, seeds).copy(), {}
+
+    def step(
+        self, actions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+        """
+        Steps every environment with its row of the (num_envs, A) actions.
+
+        Returns the observations, rewards, terminated (halted) and truncated
+        (iteration limit) flags, and infos. An environment whose episode ended
+        is reset within the step and returns its new episode's first
+        observation, with the final observation of the ended episode in
+        infos[FINAL_OBSERVATION] where infos[FINAL_MASK] is set. Rewards are
+        computed from the final observations of those environments.
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions: np.ndarray):
+        """
+        Submits a step without waiting for it. With workers, up to `depth`
+        steps can be in flight, each collected in order by step_wait().
+        """
+        self._pool.step_async(actions)
+
+    def step_wait(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+        """ waits for the oldest submitted step, and returns it as step() does """
+        observations, final, flags = self._pool.step_wait()
+        observations = observations.copy()
+        terminated = flags[:, TERMINATED] != 0.0
+        truncated = flags[:, TRUNCATED] != 0.0
+        finished = terminated | truncated
+
+        infos = {}  # type: Dict[str, Any]
+        final_observations = observations
+        if finished.any():
+            final_observations = np.where(finished[:, np.newaxis], final, observations)
+            infos[FINAL_OBSERVATION] = final_observations
+            infos[FINAL_MASK] = finished
+
+        # rewarded on the observation the step produced, before any autoreset
+        if self.reward is not None:
+            rewards = np.asarray(self.reward(final_observations), dtype=np.float64)
+        else:
+            rewards = np.zeros(self.num_envs)
+        return observations, rewards, terminated, truncated, infos
+
+    def close(self):
+        """ stops any worker processes and releases their shared memory """
+        self._pool.close()
+
+    def __enter__(self) -> "MoabVectorEnv":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
@@ -0,0 +1,119 @@
+"""
+Unit tests for offline Moab assessments
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import csv
+import math
+import os
+import tempfile
+from typing import Dict
+
+import numpy as np
+import pytest
+
+from moab_assess import (
+    TABLE_COLUMNS,
+    OnnxPolicy,
+    assessment_table,
+    load_policy,
+    summarize,
+    table_columns,
+    write_table,
+)
+from moab_model import STATE_FIELDS, Config
+from moab_rollout import ACTION_FIELDS, load_episode_configs, rollout, zero_policy
+
+ASSESS_CONFIG = os.path.join(os.path.dirname(__file__), "assess_config.json")
+
+
+def test_table_layout():
+    configs = load_episode_configs(ASSESS_CONFIG)
+    trajectories = rollout(configs, zero_policy, workers=1, iteration_limit=20)
+    rows = assessment_table(trajectories)
+    assert len(rows) == sum(len(t.states) for t in trajectories)
+
+    columns = table_columns(trajectories)
+    assert columns[: len(TABLE_COLUMNS)] == list(TABLE_COLUMNS)
+    assert set(columns) == set().union(*rows)
+
+    # iterations count from 1, and only the last row of an episode is terminal
+    first = [row for row in rows if row["EpisodeId"] == 0]
+    assert [row["IterationIndex"] for row in first] == list(range(1, len(first) + 1))
+    assert [row["Terminal"] for row in first] == [False] * (len(first) - 1) + [True]
+    assert math.isnan(first[-1]["input_pitch"])
+    assert first[0]["ball_radius"] == configs[0]["ball_radius"]
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "flattened_telescope.csv")
+        write_table(trajectories, path)
+        with open(path, newline="") as file:
+            lines = list(csv.reader(file))
+    assert lines[0] == [""] + columns
+    assert len(lines) == len(rows) + 1
+
+
+def test_summary():
+    still = rollout([{}] * 2, zero_policy, workers=1, iteration_limit=10)
+    summary = summarize(still, iteration_limit=10)
+    assert summary["percentage_full_episodes"] == 100.0
+    assert summary["avg_final_distance_to_center"] == 0.0
+    assert summary["mse_vel_total"] == 0.0
+
+    fast = rollout([{}, {"initial_vel_x": 1.0}], zero_policy, workers=1)
+    assert summarize(fast)["percentage_full_episodes"] == 50.0
+
+
+def test_load_policy():
+    assert load_policy("moab_rollout:zero_policy") is zero_policy
+    with pytest.raises(ValueError):
+        load_policy("moab_rollout")
+
+
+def test_onnx_policy():
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper
+
+    # actions = state @ gains, a linear controller on ball position
+    gains = np.array([[0.0, 5.0], [-5.0, 0.0]], dtype=np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["state", "gains"], ["actions"])],
+        "linear",
+        [helper.make_tensor_value_info("state", TensorProto.FLOAT, ["N", 2])],
+        [helper.make_tensor_value_info("actions", TensorProto.FLOAT, ["N", 2])],
+        [helper.make_tensor("gains", TensorProto.FLOAT, [2, 2], gains.flatten())],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+
+    def linear(state: Dict[str, float]) -> Config:
+        return {
+            "input_pitch": -5.0 * state["ball_y"],
+            "input_roll": 5.0 * state["ball_x"],
+        }
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "linear.onnx")
+        onnx.save(model, path)
+        policy = OnnxPolicy(path, state_fields=("ball_x", "ball_y"))
+
+        configs = [{"initial_x": 0.03, "initial_y": -0.02}]
+        expected = rollout(configs, linear, workers=1, iteration_limit=30)
+        pooled = rollout(configs * 2, policy, workers=2, iteration_limit=30)
+
+    # float32 inference, so close rather than equal to the python policy
+    for trajectory in pooled:
+        assert np.allclose(trajectory.states, expected[0].states, atol=1e-6)
+        assert trajectory.actions.shape == expected[0].actions.shape
+    assert pooled[0].actions.shape[1] == len(ACTION_FIELDS)
+    assert pooled[0].states.shape[1] == len(STATE_FIELDS)
+
+
+if __name__ == "__main__":
+    test_table_layout()
+    test_summary()
+    test_load_policy()
+    test_onnx_policy()
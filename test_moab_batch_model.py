@@ -0,0 +1,175 @@
+"""
+Unit tests for the vectorized Moab physics model
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import math
+from typing import Dict, List
+
+import numpy as np
+
+from moab_batch_model import MoabBatchModel
+from moab_model import MoabModel
+
+# a handful of environments that exercise different tilts, heights and balls
+CONFIGS = [
+    dict(pitch=0.0, roll=0.0, height_z=0.0, x=0.0, y=0.0),
+    dict(pitch=0.1, roll=-0.2, height_z=0.5, x=0.01, y=-0.02),
+    dict(pitch=-0.35, roll=0.25, height_z=-0.5, x=-0.03, y=0.01, ball_radius=0.018),
+    dict(pitch=0.6, roll=0.6, height_z=1.0, x=0.05, y=0.05, ball_shell=0.0003),
+]
+STEPS = 60
+TOLERANCE = 1e-9
+
+
+def make_models(configs: List[Dict[str, float]]):
+    models = []  # type: List[MoabModel]
+    batch = MoabBatchModel(len(configs), seed=0)
+
+    for i, config in enumerate(configs):
+        model = MoabModel()
+        model.ball_radius = config.get("ball_radius", model.ball_radius)
+        model.ball_shell = config.get("ball_shell", model.ball_shell)
+        model.pitch = config["pitch"]
+        model.roll = config["roll"]
+        model.height_z = config["height_z"]
+        model.update_plate(True)
+        model.set_initial_ball(config["x"], config["y"], model.ball.z)
+        models.append(model)
+
+        batch.ball_radius[i] = model.ball_radius
+        batch.ball_shell[i] = model.ball_shell
+        batch.pitch[i] = model.pitch
+        batch.roll[i] = model.roll
+        batch.height_z[i] = model.height_z
+
+    batch.update_plate(True)
+    batch.set_initial_ball(
+        np.array([c["x"] for c in configs]),
+        np.array([c["y"] for c in configs]),
+        batch.ball[:, 2],
+    )
+    return models, batch
+
+
+# headings of -pi and pi are the same direction, compare these modulo 2pi
+HEADINGS = ("estimated_direction", "obstacle_direction")
+
+
+def assert_state_matches(models: List[MoabModel], batch: MoabBatchModel):
+    batch_state = batch.state()
+    for i, model in enumerate(models):
+        for key, value in model.state().items():
+            batch_value = float(batch_state[key][i])
+            if key in HEADINGS:
+                value = math.remainder(value - batch_value, 2.0 * math.pi)
+                batch_value = 0.0
+            assert math.isclose(
+                value, batch_value, rel_tol=TOLERANCE, abs_tol=TOLERANCE
+            ), "env {} key {}: model {} != batch {}".format(
+                i, key, value, batch_state[key][i]
+            )
+
+
+def test_batch_reset_matches_model():
+    models, batch = make_models(CONFIGS)
+    assert_state_matches(models, batch)
+
+
+def test_batch_step_matches_model():
+    models, batch = make_models(CONFIGS)
+    for _ in range(STEPS):
+        for model in models:
+            model.step()
+        batch.step()
+        assert_state_matches(models, batch)
+
+
+def test_batch_actions():
+    models, batch = make_models(CONFIGS)
+    rng = np.random.default_rng(1)
+    for _ in range(STEPS):
+        actions = rng.uniform(-1.2, 1.2, size=(len(models), 3))
+        for model, action in zip(models, actions):
+            model.pitch = min(1.0, max(-1.0, float(action[0])))
+            model.roll = min(1.0, max(-1.0, float(action[1])))
+            model.height_z = min(1.0, max(-1.0, float(action[2])))
+            model.step()
+        halted = batch.step(actions)
+        assert_state_matches(models, batch)
+        assert list(halted) == [model.halted() for model in models]
+
+
+def test_batch_state_array():
+    models, batch = make_models(CONFIGS)
+    for _ in range(10):
+        for model in models:
+            model.step()
+        batch.step()
+
+    rows = batch.state_array()
+    for i, model in enumerate(models):
+        assert np.allclose(rows[i], model.state_array(), rtol=0, atol=TOLERANCE)
+
+
+def test_batch_state_is_a_snapshot():
+    _, batch = make_models(CONFIGS)
+    batch.roll[:] = 0.5
+    batch.step()
+    state = batch.state()
+    held = {name: values.copy() for name, values in state.items()}
+    assert state["roll"] is not batch.roll
+
+    batch.roll[:] = -0.5
+    for _ in range(5):
+        batch.step()
+    for name, values in state.items():
+        assert np.array_equal(values, held[name]), name
+    assert not np.array_equal(state["ball_x"], batch.state()["ball_x"])
+
+
+def test_batch_masked_reset():
+    models, batch = make_models(CONFIGS)
+    for _ in range(10):
+        batch.step()
+    before = batch.ball.copy()
+
+    mask = np.zeros(batch.num_envs, dtype=bool)
+    mask[1] = True
+    batch.reset(mask)
+
+    # only the masked env returns to the default state
+    assert np.array_equal(batch.ball[~mask], before[~mask])
+    assert batch.iteration_count[1] == 0
+    assert batch.iteration_count[0] == 10
+    default_state = MoabModel().state()
+    batch_state = batch.state()
+    for key, value in default_state.items():
+        assert math.isclose(value, float(batch_state[key][1]), abs_tol=TOLERANCE)
+
+
+def test_batch_noise_is_seeded():
+    a = MoabBatchModel(8, seed=42)
+    b = MoabBatchModel(8, seed=42)
+    for model in (a, b):
+        model.plate_noise[:] = 0.01
+        model.ball_noise[:] = 0.001
+        model.jitter[:] = 0.005
+    for _ in range(20):
+        a.step()
+        b.step()
+    assert np.array_equal(a.ball, b.ball)
+    assert np.array_equal(a.estimated_x, b.estimated_x)
+    assert not np.allclose(a.step_time, a.time_delta)
+
+
+if __name__ == "__main__":
+    test_batch_reset_matches_model()
+    test_batch_step_matches_model()
+    test_batch_actions()
+    test_batch_state_array()
+    test_batch_state_is_a_snapshot()
+    test_batch_masked_reset()
+    test_batch_noise_is_seeded()
@@ -0,0 +1,118 @@
+"""
+Unit tests for the Moab benchmarks
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from moab_bench import (
+    ADVANCE_STEPS,
+    Case,
+    SkipCase,
+    Timed,
+    compare,
+    default_cases,
+    main,
+    run_cases,
+    select_cases,
+    summarize,
+    time_calls,
+)
+
+
+def test_summarize():
+    times = np.arange(1, 101, dtype=np.int64) * 1000
+    stats = summarize(times, items=4)
+
+    assert stats["calls"] == 100
+    assert stats["median_ns"] == 50500
+    assert 95000 < stats["p95_ns"] < stats["p99_ns"] < 100000
+    assert stats["min_ns"] == 1000
+    # 400 steps in 5.05 ms
+    assert abs(stats["items_per_second"] - 400 / 5.05e-3) < 1e-6
+
+
+def test_time_calls_resets_between_episodes():
+    counts = {"calls": 0, "resets": 0}
+
+    def call():
+        counts["calls"] += 1
+
+    def reset():
+        counts["resets"] += 1
+
+    times = time_calls((call, reset), calls=25, warmup=5, episode_length=10)
+    assert len(times) == 25 and (times >= 0).all()
+    assert counts == {"calls": 30, "resets": 3}
+
+
+def test_compare():
+    baseline = {"cases": {"a": {"median_ns": 100.0}, "b": {"median_ns": 100.0}}}
+    results = {
+        "cases": {
+            "a": {"median_ns": 120.0},
+            "b": {"median_ns": 150.0},
+            "c": {"median_ns": 1000.0},
+        }
+    }
+    regressions = compare(results, baseline, tolerance=0.25)
+    assert len(regressions) == 1 and regressions[0].startswith("b:")
+
+
+def test_run_cases_skips():
+    def unavailable() -> Timed:
+        raise SkipCase("not here")
+
+    cases = [c for c in default_cases() if c.name == "model_state"]
+    results = run_cases(cases + [Case("unavailable", unavailable)], 20, 5)
+
+    assert list(results["cases"]) == ["model_state"]
+    assert results["skipped"] == {"unavailable": "not here"}
+    json.dumps(results)
+
+
+def test_select_cases():
+    names = [
+        case.name for case in select_cases(default_cases(), ["model_st*", "*_numba"])
+    ]
+    assert names[:2] == ["model_step", "model_step_noise"]
+    assert "compact_step_numba" in names and "model_step_substeps_4" in names
+    assert "model_advance" not in names
+
+
+def test_advance_case():
+    # a fresh settled model for each timed advance()
+    cases = select_cases(default_cases(), ["model_advance"])
+    stats = run_cases(cases, 5, 1)["cases"]["model_advance"]
+    assert stats["items"] == ADVANCE_STEPS
+
+
+def test_main_baseline():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "baseline.json")
+        args = ["model_state", "--calls", "50", "--warmup", "5"]
+        assert main(args + ["--output", path]) == 0
+
+        # a baseline far faster than anything can run
+        with open(path) as file:
+            baseline = json.load(file)
+        baseline["cases"]["model_state"]["median_ns"] = 1.0
+        with open(path, "w") as file:
+            json.dump(baseline, file)
+        assert main(args + ["--baseline", path]) == 1
+
+
+if __name__ == "__main__":
+    test_summarize()
+    test_time_calls_resets_between_episodes()
+    test_compare()
+    test_run_cases_skips()
+    test_select_cases()
+    test_advance_case()
+    test_main_baseline()
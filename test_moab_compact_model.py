@@ -0,0 +1,106 @@
+"""
+Unit tests for the memory compact Moab physics model
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import tracemalloc
+from typing import List
+
+import numpy as np
+
+from moab_compact_model import STATE_LAYOUT, STATE_SIZE, CompactMoabModel
+from moab_model import MoabModel
+
+STEPS = 100
+
+
+def drive(model: MoabModel, steps: int):
+    """ runs the model through a fixed sequence of controls """
+    for i in range(steps):
+        model.pitch = 0.3 if (i // 20) % 2 else -0.2
+        model.roll = 0.15
+        model.height_z = 0.5
+        model.step()
+
+
+def test_compact_matches_model():
+    model = MoabModel()
+    compact = CompactMoabModel()
+    assert compact.state() == model.state()
+
+    for _ in range(STEPS):
+        drive(model, 1)
+        drive(compact, 1)
+        assert compact.state() == model.state()
+
+
+def test_compact_views():
+    compact = CompactMoabModel()
+    compact.ball.x = 0.01
+    compact.ball_vel = [0.1, 0.2, 0.0]
+    compact.iteration_count += 3
+
+    buffer = compact.buffer
+    assert buffer.shape == (STATE_SIZE,)
+    assert buffer[STATE_LAYOUT["ball"]][0] == 0.01
+    assert list(buffer[STATE_LAYOUT["ball_vel"]]) == [0.1, 0.2, 0.0]
+    assert compact.iteration_count == 3
+    assert isinstance(compact.iteration_count, int)
+
+    # nothing spills into the instance dictionary, which MoabModel still has
+    drive(compact, 10)
+    assert not vars(compact)
+
+
+def test_compact_copy():
+    compact = CompactMoabModel(seed=5)
+    compact.plate_noise = 0.01
+    compact.jitter = 0.005
+    drive(compact, 30)
+
+    clone = compact.copy()
+    assert np.array_equal(clone.buffer, compact.buffer)
+    assert clone.buffer is not compact.buffer
+
+    # the copies evolve independently, and identically
+    drive(compact, 30)
+    assert not np.array_equal(clone.buffer, compact.buffer)
+    drive(clone, 30)
+    assert np.array_equal(clone.buffer, compact.buffer)
+
+
+def test_compact_snapshot():
+    compact = CompactMoabModel(seed=2)
+    compact.ball_noise = 0.001
+    drive(compact, 10)
+
+    # snapshots move between the two model types
+    model = MoabModel()
+    model.restore(compact.snapshot())
+    assert model.state() == compact.state()
+    drive(model, 30)
+    drive(compact, 30)
+    assert model.snapshot() == compact.snapshot()
+
+
+def test_compact_memory():
+    def traced_size(cls: type) -> int:
+        tracemalloc.start()
+        models = [cls() for _ in range(200)]  # type: List[MoabModel]
+        for model in models:
+            model.step()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    assert traced_size(CompactMoabModel) * 2 < traced_size(MoabModel)
+
+
+if __name__ == "__main__":
+    test_compact_matches_model()
+    test_compact_views()
+    test_compact_copy()
+    test_compact_snapshot()
+    test_compact_memory()
@@ -0,0 +1,128 @@
+"""
+Unit tests for the multiplexed Moab session driver
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict, reportUnknownMemberType=false
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, List
+
+from microsoft_bonsai_api.simulator.client import BonsaiClientConfig
+from moab_driver import SessionDriver, make_drivers, run_sessions
+from moab_mock_server import MockPlatform
+from moab_sim import MoabSim
+
+SESSIONS = 4
+STEPS = 5
+LATENCY = 0.05  # s, per platform call
+
+
+class FakeSessions:
+    """ a scripted stand-in for BonsaiClient.session """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.events = [
+            SimpleNamespace(
+                type="EpisodeStart",
+                episode_start=SimpleNamespace(config={"initial_x": 0.01}),
+            )
+        ]
+        self.events += [
+            SimpleNamespace(
+                type="EpisodeStep",
+                episode_step=SimpleNamespace(action={"input_roll": 0.1}),
+            )
+            for _ in range(STEPS)
+        ]
+        self.events += [
+            SimpleNamespace(
+                type="EpisodeFinish", episode_finish=SimpleNamespace(reason="Finished")
+            ),
+            SimpleNamespace(type="Idle", idle=SimpleNamespace(callback_time=0.01)),
+            SimpleNamespace(type="Unregister"),
+        ]
+        self.states = []  # type: List[Any]
+        self.deleted = False
+
+    def create(self, workspace_name: str, body: Any) -> Any:
+        return SimpleNamespace(session_id=self.name)
+
+    def advance(self, workspace_name: str, session_id: str, body: Any) -> Any:
+        time.sleep(LATENCY)
+        self.states.append(body)
+        event = self.events[len(self.states) - 1]
+        event.sequence_id = len(self.states) + 1
+        return event
+
+    def delete(self, workspace_name: str, session_id: str):
+        self.deleted = True
+
+
+def test_sessions_overlap():
+    config = BonsaiClientConfig(workspace="moab", access_key="utah")
+    sessions = [FakeSessions("session-{}".format(i)) for i in range(SESSIONS)]
+    with ThreadPoolExecutor(SESSIONS) as executor:
+        drivers = [
+            SessionDriver(MoabSim(config), SimpleNamespace(session=s), "moab", executor)
+            for s in sessions
+        ]
+        start = time.time()
+        asyncio.run(run_sessions(drivers))
+        elapsed = time.time() - start
+
+    events = len(sessions[0].events)
+    for driver, session in zip(drivers, sessions):
+        assert driver.event_count == events
+        assert driver.sim.model.iteration_count == STEPS
+        assert [s.sequence_id for s in session.states] == list(range(1, events + 1))
+        assert session.states[-1].state == driver.sim.get_state()
+
+        # unregistered by the platform, so not deleted again
+        assert not session.deleted
+
+    # the platform calls of the sessions overlap
+    assert elapsed < SESSIONS * events * LATENCY / 2
+
+
+def test_session_unregisters_on_error():
+    config = BonsaiClientConfig(workspace="moab", access_key="utah")
+    session = FakeSessions("failing")
+    session.events[1] = SimpleNamespace(type="EpisodeStep", episode_step=None)
+
+    with ThreadPoolExecutor(1) as executor:
+        driver = SessionDriver(
+            MoabSim(config), SimpleNamespace(session=session), "moab", executor
+        )
+        asyncio.run(run_sessions([driver]))
+    assert session.deleted
+    assert driver.event_count == 2
+
+
+def test_sessions_on_mock_platform():
+    with MockPlatform(episodes=2, iteration_limit=STEPS) as server:
+        server.serve_in_background()
+        config = BonsaiClientConfig(workspace="moab", access_key="utah")
+        config.server = server.url
+        with ThreadPoolExecutor(SESSIONS) as executor:
+            drivers = make_drivers(config, SESSIONS, executor)
+            asyncio.run(run_sessions(drivers))
+        server.shutdown()
+
+    # registered, two episodes, then unregistered by the platform
+    assert len(server.finished) == SESSIONS
+    events = 2 * (STEPS + 2) + 1
+    for driver in drivers:
+        assert driver.event_count == events
+        assert driver.sim.model.iteration_count == STEPS
+    assert server.stats()["iterations"] == SESSIONS * (events - 1)
+
+
+if __name__ == "__main__":
+    test_sessions_overlap()
+    test_session_unregisters_on_error()
+    test_sessions_on_mock_platform()
@@ -0,0 +1,91 @@
+"""
+Unit tests for the cached simulator interface
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import json
+import os
+import shutil
+import tempfile
+
+from moab_interface import (
+    TEMPLATE_PATH,
+    load_interface,
+    render_interface,
+    template_params,
+    write_rendered,
+)
+from moab_model import MoabModel
+
+
+def reset_model() -> MoabModel:
+    model = MoabModel()
+    model.reset()
+    return model
+
+
+def test_interface_matches_template():
+    model = reset_model()
+    with open(TEMPLATE_PATH) as file:
+        expected = render_interface(file.read(), template_params(model))
+    interface = load_interface(model)
+    assert interface == expected
+    assert interface["name"] == "moab-py-v5"
+
+    # the caller's copy
+    interface["name"] = "changed"
+    assert load_interface(model) == expected
+
+
+def test_interface_follows_template_and_model():
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "interface.json")
+        rendered = os.path.join(tmp, "interface.rendered.json")
+        shutil.copyfile(TEMPLATE_PATH, template)
+
+        model = reset_model()
+        interface = load_interface(model, template, rendered)
+
+        # an edited template is rendered again
+        with open(template) as file:
+            template_str = file.read().replace('"moab-py-v5"', '"Edited"', 1)
+        with open(template, "w") as file:
+            file.write(template_str)
+        os.utime(template, ns=(0, 0))
+        assert load_interface(model, template, rendered)["name"] == "Edited"
+
+        # as is one for other model values
+        model.ball_radius = 0.03
+        other = load_interface(model, template, rendered)
+        assert other["description"] != interface["description"]
+
+
+def test_rendered_interface():
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "interface.json")
+        rendered = os.path.join(tmp, "interface.rendered.json")
+        shutil.copyfile(TEMPLATE_PATH, template)
+
+        model = reset_model()
+        write_rendered(model, template, rendered)
+        with open(rendered) as file:
+            artifact = json.load(file)
+        assert artifact["interface"] == load_interface(model, TEMPLATE_PATH)
+
+        # the rendered file is used while it matches, without rendering again
+        artifact["interface"]["name"] = "Prerendered"
+        with open(rendered, "w") as file:
+            json.dump(artifact, file)
+        assert load_interface(model, template, rendered)["name"] == "Prerendered"
+
+        # and ignored for other model values
+        model.ball_radius = 0.03
+        assert load_interface(model, template, rendered)["name"] == "moab-py-v5"
+
+
+if __name__ == "__main__":
+    test_interface_matches_template()
+    test_interface_follows_template_and_model()
+    test_rendered_interface()
@@ -0,0 +1,115 @@
+"""
+Parity tests for the compiled Moab step kernel
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import math
+from typing import Any, Dict, List
+
+import numpy as np
+
+import moab_kernel
+from moab_compact_model import CompactMoabModel
+from moab_model import MoabModel
+
+STEPS = 120
+PARITY_TOLERANCE = 1e-12
+
+CONFIGS = [
+    {"initial_x": 0.03, "initial_vel_y": 0.05},
+    {"obstacle_radius": 0.01, "target_x": 0.02, "target_y": -0.01},
+    {"initial_height_z": 0.5, "time_delta": 0.02},
+    {"physics_substeps": 4, "initial_y": -0.02},
+    {"seed": 7, "ball_noise": 0.002, "plate_noise": 0.01, "jitter": 0.003},
+]  # type: List[Dict[str, Any]]
+
+
+def drive(model: MoabModel, i: int):
+    """ applies the controls of step i, a sweep across the plate angles """
+    model.roll = 0.4 * math.sin(i * 0.3)
+    model.pitch = 0.4 * math.cos(i * 0.2)
+    model.height_z = 0.5 * math.sin(i * 0.1)
+
+
+def assert_parity(model: MoabModel, reference: MoabModel):
+    assert np.allclose(
+        model.state_array(), reference.state_array(), rtol=0, atol=PARITY_TOLERANCE
+    )
+    assert np.allclose(
+        model.ball_qat.tolist(), reference.ball_qat.tolist(), atol=PARITY_TOLERANCE
+    )
+    assert model.iteration_count == reference.iteration_count
+    assert isinstance(model.iteration_count, int)
+
+
+def test_step_state_parity():
+    # runs interpreted without numba, so the kernel math is checked either way
+    for config in CONFIGS:
+        reference = CompactMoabModel()
+        reference.configure(config)
+        state = reference.buffer.copy()
+        noise = moab_kernel.new_noise()
+
+        for i in range(STEPS):
+            drive(reference, i)
+            state[:] = reference.buffer
+
+            # the noise the reference step is about to draw
+            rng_state = reference.rng.getstate()
+            noise[:] = [
+                reference.random_noise(scale)
+                for scale in (
+                    reference.jitter,
+                    reference.plate_noise,
+                    reference.plate_noise,
+                    reference.ball_noise,
+                    reference.ball_noise,
+                    reference.ball_noise,
+                )
+            ]
+            reference.rng.setstate(rng_state)
+
+            moab_kernel.step_state(state, noise)
+            reference.step()
+            if reference.halted():
+                break
+        assert np.allclose(state, reference.buffer, rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_engine_parity():
+    for kind in (MoabModel, CompactMoabModel):
+        for config in CONFIGS:
+            model = kind(engine="numba")
+            reference = kind()
+            model.configure(config)
+            reference.configure(config)
+
+            for i in range(STEPS):
+                drive(model, i)
+                drive(reference, i)
+                model.step()
+                reference.step()
+                assert_parity(model, reference)
+                if reference.halted():
+                    break
+
+
+def test_engine_selection():
+    assert MoabModel().engine == "python"
+    expected = "numba" if moab_kernel.COMPILED else "python"
+    assert MoabModel(engine="numba").engine == expected
+    assert CompactMoabModel(engine="numba").copy().engine == expected
+
+    try:
+        MoabModel(engine="fortran")
+        assert False, "expected a ValueError"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_step_state_parity()
+    test_engine_parity()
+    test_engine_selection()
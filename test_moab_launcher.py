@@ -0,0 +1,76 @@
+"""
+Unit tests for the Moab simulator launcher
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from moab_launcher import Launcher, available_cpus
+
+
+class CrashingWorker:
+    """ records each start, and crashes until it has been started `crashes` times """
+
+    def __init__(self, directory: str, crashes: int):
+        self.directory = directory
+        self.crashes = crashes
+
+    def starts(self, index: int) -> List[List[str]]:
+        path = os.path.join(self.directory, "worker_{}".format(index))
+        if not os.path.exists(path):
+            return []
+        with open(path) as file:
+            return [line.split() for line in file.read().splitlines()]
+
+    def __call__(self, index: int):
+        cpus = ",".join(str(cpu) for cpu in sorted(os.sched_getaffinity(0)))
+        with open(os.path.join(self.directory, "worker_{}".format(index)), "a") as file:
+            file.write("{} {}\n".format(time.monotonic(), cpus))
+        if len(self.starts(index)) <= self.crashes:
+            sys.exit(1)
+
+
+def test_launcher_restarts_crashed_workers():
+    cpus = available_cpus()
+    with tempfile.TemporaryDirectory() as tmp:
+        worker = CrashingWorker(tmp, crashes=1)
+        launcher = Launcher(worker, count=3, restart_delay=0.01)
+        launcher.run()
+
+        assert launcher.restarts == 3
+        for index in range(3):
+            starts = worker.starts(index)
+            assert len(starts) == 2
+
+            # pinned to its own core, wrapping around the available ones
+            assert [cpu for _, cpu in starts] == [str(cpus[index % len(cpus)])] * 2
+
+
+def test_launcher_backs_off():
+    with tempfile.TemporaryDirectory() as tmp:
+        worker = CrashingWorker(tmp, crashes=3)
+        launcher = Launcher(worker, count=1, pin=False, restart_delay=0.05)
+        launcher.run()
+
+        times = [float(t) for t, _ in worker.starts(0)]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        assert len(gaps) == 3
+        for gap, delay in zip(gaps, (0.05, 0.1, 0.2)):
+            assert gap >= delay
+
+
+def test_launcher_defaults_to_available_cpus():
+    launcher = Launcher(lambda index: None)
+    assert [slot.cpu for slot in launcher.slots] == available_cpus()
+
+
+if __name__ == "__main__":
+    test_launcher_restarts_crashed_workers()
+    test_launcher_backs_off()
+    test_launcher_defaults_to_available_cpus()
@@ -0,0 +1,127 @@
+"""
+Unit tests for the local simulator session server
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import json
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+from moab_mock_server import MockPlatform
+from moab_model import MoabModel
+
+EPISODES = 3
+ITERATIONS = 20
+
+
+def call(url: str, method: str, body: Optional[Dict[str, Any]] = None) -> Any:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method)
+    request.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(request) as response:
+        payload = response.read()
+        return response.status, json.loads(payload) if payload else None
+
+
+def run_session(server: MockPlatform) -> List[Dict[str, Any]]:
+    """ a minimal simulator loop over the session protocol """
+    sessions = "{}/v2/workspaces/moab/simulatorSessions".format(server.url)
+    status, registered = call(sessions, "POST", {"name": "Moab", "timeout": 60})
+    assert status == 201
+    session = "{}/{}".format(sessions, registered["sessionId"])
+
+    model = MoabModel()
+    events = []  # type: List[Dict[str, Any]]
+    sequence_id = 1
+    while True:
+        body = {
+            "sequenceId": sequence_id,
+            "state": model.state(),
+            "halted": model.halted(),
+        }
+        _, event = call(session + "/advance", "POST", body)
+        events.append(event)
+        sequence_id = event["sequenceId"]
+        if event["type"] == "EpisodeStart":
+            model.reset()
+            model.configure(event["episodeStart"]["config"])
+        elif event["type"] == "EpisodeStep":
+            model.apply_action(event["episodeStep"]["action"])
+            model.step()
+        elif event["type"] == "Unregister":
+            break
+
+    status, _ = call(session, "DELETE")
+    assert status == 204
+    return events
+
+
+def tilt_policy(state: Dict[str, float]) -> Dict[str, float]:
+    return {"input_roll": 1.0}
+
+
+def test_session_events():
+    configs = [{"initial_x": 0.01}, {"initial_x": -0.01}]
+    with MockPlatform(
+        configs=configs, episodes=EPISODES, iteration_limit=ITERATIONS
+    ) as server:
+        server.serve_in_background()
+        events = run_session(server)
+        server.shutdown()
+
+    types = [e["type"] for e in events]
+    episode = ["EpisodeStart"] + ["EpisodeStep"] * ITERATIONS + ["EpisodeFinish"]
+    assert types == episode * EPISODES + ["Unregister"]
+    assert [e["sequenceId"] for e in events] == list(range(2, len(events) + 2))
+
+    starts = [e["episodeStart"]["config"] for e in events if "episodeStart" in e]
+    assert starts == [configs[0], configs[1], configs[0]]
+    finishes = [e["episodeFinish"]["reason"] for e in events if "episodeFinish" in e]
+    assert finishes == ["EpisodeComplete"] * EPISODES
+
+    stats = server.stats()
+    assert stats["iterations"] == len(events) - 1
+    assert 0.0 < stats["round_trip_p50"] <= stats["round_trip_p99"]
+    assert stats["sim_p50"] <= stats["round_trip_p50"]
+    assert stats["iterations_per_second"] > 0.0
+    assert not server.sessions and len(server.finished) == 1
+
+
+def test_session_policy_and_latency():
+    with MockPlatform(
+        policy=tilt_policy, episodes=1, iteration_limit=1000, latency=0.002
+    ) as server:
+        server.serve_in_background()
+        events = run_session(server)
+        server.shutdown()
+
+    steps = [e["episodeStep"]["action"] for e in events if "episodeStep" in e]
+    assert steps and all(a == {"input_roll": 1.0} for a in steps)
+
+    # tipped over, the ball rolls off before the iteration limit
+    assert len(steps) < 1000
+    assert events[-2]["episodeFinish"]["reason"] == "Terminal"
+    assert server.stats()["round_trip_p50"] >= 0.002
+
+
+def test_unknown_session():
+    with MockPlatform() as server:
+        server.serve_in_background()
+        url = "{}/v2/workspaces/moab/simulatorSessions/missing/advance".format(
+            server.url
+        )
+        try:
+            call(url, "POST", {"sequenceId": 1, "state": {}, "halted": False})
+            assert False, "advanced a missing session"
+        except urllib.error.HTTPError as error:
+            assert error.code == 404
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_session_events()
+    test_session_policy_and_latency()
+    test_unknown_session()
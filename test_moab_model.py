@@ -6,10 +6,27 @@ __copyright__ = "Copyright 2020, Microsoft Corp."
 # pyright: strict
 
 import math
-
-from pyrr import Vector3, vector
-
-from moab_model import MoabModel
+import random
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pytest
+from pyrr import Vector3, matrix44, ray, vector
+from pyrr.geometric_tests import ray_intersect_plane
+from pyrr.plane import create_from_position
+
+from moab_model import (
+    PLATE_ORIGIN_TO_SURFACE_OFFSET,
+    STATE_FIELDS,
+    X_AXIS,
+    Y_AXIS,
+    Z_AXIS,
+    MoabModel,
+    StateView,
+    merge_state,
+    random_noise,
+)
 
 model = MoabModel()
 
@@ -167,6 +184,479 @@ def test_plate_to_world_to_plate():
     assert delta < TOLERANCE
 
 
+"""
+Closed form transform tests.
+
+These compare the closed form plate transforms against the equivalent
+pyrr matrix construction over a sweep of plate poses.
+"""
+PARITY_TOLERANCE = 1e-12
+PARITY_ANGLES = [-0.38, -0.2, -0.01, 0.0, 0.05, 0.3, 0.38]
+PARITY_HEIGHTS = [0.0, 0.02, 0.04]
+
+
+def plate_poses():
+    for theta_x in PARITY_ANGLES:
+        for theta_y in PARITY_ANGLES:
+            for z in PARITY_HEIGHTS:
+                model.reset()
+                model.plate_theta_x = theta_x
+                model.plate_theta_y = theta_y
+                model.plate.z = z
+                yield model
+
+
+def pyrr_plate_nor(model: MoabModel) -> np.ndarray:
+    x_rot = matrix44.create_from_axis_rotation(axis=X_AXIS, theta=model.plate_theta_x)
+    y_rot = matrix44.create_from_axis_rotation(axis=Y_AXIS, theta=model.plate_theta_y)
+    nor = matrix44.apply_to_vector(mat=x_rot, vec=Z_AXIS)
+    nor = matrix44.apply_to_vector(mat=y_rot, vec=nor)
+    return vector.normalize(nor)
+
+
+def pyrr_plate_to_world(model: MoabModel, x: float, y: float, z: float) -> np.ndarray:
+    x_rot = matrix44.create_from_axis_rotation([1.0, 0.0, 0.0], model.plate_theta_x)
+    y_rot = matrix44.create_from_axis_rotation([0.0, 1.0, 0.0], model.plate_theta_y)
+    vec = matrix44.apply_to_vector(mat=x_rot, vec=[x, y, z])
+    vec = matrix44.apply_to_vector(mat=y_rot, vec=vec)
+    move = matrix44.create_from_translation(
+        [model.plate.x, model.plate.y, model.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET]
+    )
+    return matrix44.apply_to_vector(mat=move, vec=vec)
+
+
+def pyrr_world_to_plate(model: MoabModel, x: float, y: float, z: float) -> np.ndarray:
+    move = matrix44.create_from_translation(
+        [
+            -model.plate.x,
+            -model.plate.y,
+            -(model.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET),
+        ]
+    )
+    vec = matrix44.apply_to_vector(mat=move, vec=[x, y, z])
+    x_rot = matrix44.create_from_axis_rotation([1.0, 0.0, 0.0], -model.plate_theta_x)
+    y_rot = matrix44.create_from_axis_rotation([0.0, 1.0, 0.0], -model.plate_theta_y)
+    vec = matrix44.apply_to_vector(mat=x_rot, vec=vec)
+    return matrix44.apply_to_vector(mat=y_rot, vec=vec)
+
+
+def pyrr_camera_ray_contact(
+    model: MoabModel, x: float, y: float, z: float
+) -> np.ndarray:
+    camera = model._camera_pos()  # type: ignore
+    cast_ray = ray.create(camera, camera - Vector3([x, y, z]))
+    plate_surface = np.array(
+        [model.plate.x, model.plate.y, model.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET]
+    )
+    surface_plane = create_from_position(plate_surface, pyrr_plate_nor(model))
+    return ray_intersect_plane(cast_ray, surface_plane, False)
+
+
+def assert_parity(result: Tuple[float, float, float], expected: np.ndarray):
+    delta = vector.length(np.array(result) - expected)
+    assert delta < PARITY_TOLERANCE, "{} != {}".format(result, expected)
+
+
+def test_plate_nor_parity():
+    for pose in plate_poses():
+        assert_parity(pose._plate_nor_xyz(), pyrr_plate_nor(pose))  # type: ignore
+
+
+def test_plate_transform_parity():
+    for pose in plate_poses():
+        for point in (test_vector, Vector3([-0.05, 0.08, 0.01])):
+            assert_parity(
+                pose.plate_to_world(point.x, point.y, point.z),
+                pyrr_plate_to_world(pose, point.x, point.y, point.z),
+            )
+            assert_parity(
+                pose.world_to_plate(point.x, point.y, point.z),
+                pyrr_world_to_plate(pose, point.x, point.y, point.z),
+            )
+
+
+def test_surface_plane_parity():
+    for pose in plate_poses():
+        plate_surface = np.array(
+            [pose.plate.x, pose.plate.y, pose.plate.z + PLATE_ORIGIN_TO_SURFACE_OFFSET]
+        )
+        expected = create_from_position(plate_surface, pyrr_plate_nor(pose))
+        surface_plane = pose._surface_plane()  # type: ignore
+        assert np.allclose(surface_plane, expected, rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_camera_ray_contact_parity():
+    for pose in plate_poses():
+        for point in (test_vector, Vector3([-0.05, 0.08, 0.01])):
+            assert_parity(
+                pose._camera_ray_contact(point.x, point.y, point.z),  # type: ignore
+                pyrr_camera_ray_contact(pose, point.x, point.y, point.z),
+            )
+
+
+def test_plate_pose_cache():
+    model.reset()
+    model_init(model)
+    model.roll = TILT
+    run_for_duration(1.0)
+
+    # a settled plate reuses the cached pose
+    pose = model._plate_pose()  # type: ignore
+    model.step()
+    assert model._plate_pose() is pose  # type: ignore
+
+    # moving the plate invalidates it
+    model.pitch = TILT
+    model.step()
+    moved = model._plate_pose()  # type: ignore
+    assert moved is not pose
+    assert_parity((moved.nor_x, moved.nor_y, moved.nor_z), pyrr_plate_nor(model))
+
+    # as does writing the plate height directly
+    model.plate.z += 0.001
+    assert model._plate_pose() is not moved  # type: ignore
+
+
+"""
+State export tests.
+
+These test that the array exports follow the state() dictionary.
+"""
+
+
+def test_state_fields():
+    model.reset()
+    assert tuple(model.state().keys()) == STATE_FIELDS
+
+
+def test_state_into():
+    model.reset()
+    model_init(model)
+    model.roll = TILT
+    run_for_duration(0.5)
+    state = model.state()
+
+    # a row of a larger preallocated array
+    rows = np.zeros((3, len(STATE_FIELDS)))
+    model.state_into(rows[1])
+    assert list(rows[1]) == [float(v) for v in state.values()]
+    assert not rows[0].any() and not rows[2].any()
+
+    # a memoryview
+    buf = np.zeros(len(STATE_FIELDS))
+    model.state_into(memoryview(buf))
+    assert np.array_equal(buf, model.state_array())
+
+    # the lazily built dictionary view round trips
+    view = StateView(buf)
+    assert view["ball_x"] == state["ball_x"]
+    assert view.to_dict() == state
+    assert dict(view) == state
+    assert isinstance(view.to_dict()["iteration_count"], int)
+
+
+def test_state_tiers():
+    model.reset()
+    model_init(model)
+    model.roll = TILT
+    static = model.static_state()
+    run_for_duration(0.5)
+    dynamic = model.dynamic_state()
+
+    # the tiers partition the state
+    assert not set(static) & set(dynamic)
+    assert merge_state(static, dynamic) == model.state()
+    assert tuple(merge_state(static, dynamic)) == STATE_FIELDS
+
+
+def test_state_into_rejects_other_dtypes():
+    try:
+        model.state_into(np.zeros(len(STATE_FIELDS), dtype=np.float32))
+    except ValueError:
+        return
+    assert False, "Expected a ValueError for a float32 state array"
+
+
+def noisy_run(seed: int, steps: int = 50) -> np.ndarray:
+    noisy = MoabModel(seed)
+    noisy.jitter = 0.005
+    noisy.plate_noise = 0.01
+    noisy.ball_noise = 0.001
+    noisy.update_plate(True)
+    noisy.set_initial_ball(0.01, -0.01, noisy.ball.z)
+    for _ in range(steps):
+        noisy.step()
+    return noisy.state_array()
+
+
+def test_noise_is_seeded():
+    # the same seed replays the same noise, other seeds don't
+    assert np.array_equal(noisy_run(1), noisy_run(1))
+    assert not np.array_equal(noisy_run(1), noisy_run(2))
+
+    # reseeding restarts the stream
+    noisy = MoabModel(3)
+    first = [noisy.random_noise(1.0) for _ in range(5)]
+    noisy.seed(3)
+    assert [noisy.random_noise(1.0) for _ in range(5)] == first
+    assert all(-1.0 <= value <= 1.0 for value in first)
+
+
+def test_zero_noise_draws_nothing():
+    quiet = MoabModel(4)
+    for _ in range(10):
+        quiet.step()
+    assert quiet.step_time == quiet.time_delta
+    assert quiet.random_noise(1.0) == MoabModel(4).random_noise(1.0)
+
+
+def test_module_random_noise():
+    # the former static MoabModel.random_noise, on the global random stream
+    random.seed(2)
+    first = [random_noise(0.5) for _ in range(100)]
+    random.seed(2)
+    assert [random_noise(0.5) for _ in range(100)] == first
+    assert all(-0.5 <= value <= 0.5 for value in first)
+    assert random_noise(0.0) == 0.0
+
+
+def test_snapshot_replays():
+    noisy = MoabModel(6)
+    noisy.configure(
+        {"initial_x": 0.02, "plate_noise": 0.01, "ball_noise": 0.001, "jitter": 0.005}
+    )
+    for _ in range(5):
+        noisy.step()
+    snapshot = noisy.snapshot()
+
+    def branch(source: MoabModel, pitch: float) -> np.ndarray:
+        states = []
+        for _ in range(20):
+            source.apply_action({"input_pitch": pitch})
+            source.step()
+            states.append(source.state_array())
+        return np.array(states)
+
+    reference = branch(noisy, 0.2)
+
+    # a restored model, fresh or reused after another branch, replays exactly
+    fork = MoabModel()
+    fork.restore(snapshot)
+    assert np.array_equal(branch(fork, 0.2), reference)
+    assert not np.array_equal(branch(fork, -0.2), reference)
+    fork.restore(snapshot)
+    assert np.array_equal(branch(fork, 0.2), reference)
+    assert fork.snapshot() == noisy.snapshot()
+
+
+def test_snapshot_before_noise():
+    # no noise drawn yet, the stream position is the generator itself
+    fresh = MoabModel(8)
+    snapshot = fresh.snapshot()
+    first = [fresh.random_noise(1.0) for _ in range(3)]
+
+    fork = MoabModel()
+    fork.restore(snapshot)
+    assert [fork.random_noise(1.0) for _ in range(3)] == first
+    assert fork.state() == fresh.state()
+
+
+def test_substep_parity():
+    # the unrolled substep loop matches _ball_plate_contact on interpolated angles
+    config = {"initial_x": 0.02, "initial_vel_y": 0.1}
+    fast = MoabModel()
+    fast.configure(dict(config, physics_substeps=8))
+    slow = MoabModel()
+    slow.configure(config)
+
+    for i in range(20):
+        action = {"input_pitch": 0.2 - 0.02 * i, "input_roll": -0.1}
+        fast.apply_action(action)
+        fast.step()
+
+        slow.apply_action(action)
+        slow.step_time = slow.time_delta
+        slow.elapsed_time += slow.step_time
+        start_x, start_y = slow.plate_theta_x, slow.plate_theta_y
+        slow.update_plate(False)
+        end_x, end_y = slow.plate_theta_x, slow.plate_theta_y
+        for substep in range(1, 9):
+            slow.plate_theta_x = start_x + (end_x - start_x) * substep / 8
+            slow.plate_theta_y = start_y + (end_y - start_y) * substep / 8
+            slow._ball_plate_contact(slow.step_time / 8)
+        slow._update_estimated_ball(slow.ball)
+        slow.iteration_count += 1
+
+        assert np.allclose(
+            fast.state_array(), slow.state_array(), rtol=0, atol=PARITY_TOLERANCE
+        )
+        assert np.allclose(
+            fast.ball_qat.tolist(),
+            slow.ball_qat.tolist(),
+            rtol=0,
+            atol=PARITY_TOLERANCE,
+        )
+
+
+def test_substeps_converge():
+    def ball_path(substeps: int) -> np.ndarray:
+        substepped = MoabModel()
+        substepped.configure({"physics_substeps": substeps})
+        path = []
+        for i in range(40):
+            substepped.roll = 0.2 * math.sin(i * 0.5)
+            substepped.pitch = 0.2 * math.sin(i * 0.4 + 1.0)
+            substepped.step()
+            path.append(substepped.ball.xy)
+        return np.array(path)
+
+    reference = ball_path(256)
+    errors = [np.abs(ball_path(k) - reference).max() for k in (1, 2, 4, 8)]
+    for coarse, fine in zip(errors, errors[1:]):
+        assert fine < coarse * 0.6
+
+
+ADVANCE_TOLERANCE = 1e-9
+ADVANCE_ACTION = {"input_pitch": -0.05, "input_roll": 0.1, "input_height_z": 0.0}
+
+
+def settled_models(config: Dict[str, Any]) -> Tuple[MoabModel, MoabModel]:
+    models = []
+    for _ in range(2):
+        model = MoabModel()
+        model.configure(config)
+        model.apply_action(ADVANCE_ACTION)
+        for _ in range(10):
+            model.step()
+        models.append(model)
+    return models[0], models[1]
+
+
+def step_until_halted(model: MoabModel, n: int) -> int:
+    for steps in range(1, n + 1):
+        model.step()
+        if model.halted():
+            return steps
+    return n
+
+
+def test_advance_settled():
+    jumped, stepped = settled_models({"initial_x": -0.05, "initial_vel_y": 0.02})
+    assert jumped.advance(8, ADVANCE_ACTION) == step_until_halted(stepped, 8) == 8
+
+    assert np.allclose(
+        jumped.state_array(), stepped.state_array(), rtol=0, atol=ADVANCE_TOLERANCE
+    )
+    assert np.allclose(
+        jumped.ball_qat.tolist(), stepped.ball_qat.tolist(), atol=ADVANCE_TOLERANCE
+    )
+    assert jumped.iteration_count == stepped.iteration_count
+    assert math.isclose(jumped.elapsed_time, stepped.elapsed_time)
+
+
+def test_advance_halts():
+    jumped, stepped = settled_models(
+        {"initial_x": -0.03, "initial_vel_x": 0.02, "initial_vel_y": -0.01}
+    )
+    steps = jumped.advance(100, ADVANCE_ACTION)
+    assert steps == step_until_halted(stepped, 100) < 100
+    assert jumped.halted()
+    assert np.allclose(
+        jumped.state_array(), stepped.state_array(), rtol=0, atol=ADVANCE_TOLERANCE
+    )
+
+
+def test_advance_with_noise():
+    # noise takes the step by step path, which replays exactly
+    jumped, stepped = settled_models({"seed": 3, "ball_noise": 0.001})
+    steps = jumped.advance(20, ADVANCE_ACTION)
+    assert steps == step_until_halted(stepped, 20)
+    assert np.array_equal(jumped.state_array(), stepped.state_array())
+
+
+def test_advance_clamped_target():
+    # whole degree targets can round past the limit, the plate settles on it
+    config = {"plate_theta_limit": math.radians(10.6), "initial_x": -0.02}
+    jumped, stepped = settled_models(config)
+    action = {"input_pitch": 1.0}
+    for model in (jumped, stepped):
+        model.configure({"ball_noise": 0, "plate_noise": 0, "jitter": 0})
+        model.apply_action(action)
+        for _ in range(5):
+            model.step()
+
+    # takes the closed form path
+    calls = []  # type: List[int]
+
+    def advance_settled(n: int) -> int:
+        calls.append(n)
+        return MoabModel._advance_settled(jumped, n)  # type: ignore
+
+    jumped._advance_settled = advance_settled  # type: ignore
+    steps = jumped.advance(100, action)
+    assert calls == [100]
+    assert steps == step_until_halted(stepped, 100) < 100
+    assert np.allclose(
+        jumped.state_array(), stepped.state_array(), rtol=0, atol=ADVANCE_TOLERANCE
+    )
+
+
+def test_advance_negative():
+    model = MoabModel()
+    assert model.advance(0) == 0
+    try:
+        model.advance(-1)
+        assert False, "expected a ValueError"
+    except ValueError:
+        pass
+
+
+def test_profile_stats():
+    config = {"initial_vel_x": 0.02, "seed": 5}
+    profiled, plain = MoabModel(), MoabModel()
+    for model in (profiled, plain):
+        model.configure(config)
+    assert profiled.profile_stats() == {}
+
+    profiled.enable_profiling()
+    for model in (profiled, plain):
+        for _ in range(20):
+            model.step()
+        model.state()
+    assert profiled.state() == plain.state()
+
+    stats = profiled.profile_stats()
+    for phase in ("step", "update_plate", "_ball_plate_contact"):
+        assert stats[phase]["calls"] == 20
+    assert stats["state"]["calls"] == 2
+    assert stats["step"]["total_ns"] >= stats["_ball_plate_contact"]["total_ns"]
+    assert "_substep_ball" not in stats
+
+    profiled.disable_profiling()
+    assert profiled.profile_stats() == {}
+    assert "step" not in vars(profiled)
+
+
+@pytest.mark.skipif(
+    not hasattr(tracemalloc, "reset_peak"),
+    reason="allocation sampling requires Python 3.9",
+)
+def test_profile_allocations():
+    model = MoabModel()
+    model.enable_profiling(alloc_sample_interval=2)
+    for _ in range(4):
+        model.step()
+        model.state()
+    stats = model.profile_stats()
+    model.disable_profiling()
+
+    assert stats["step"]["alloc_samples"] == 2
+    assert stats["state"]["peak_bytes"] > 0
+
+    # a nested sample doesn't hide the peak of the step around it
+    assert stats["step"]["peak_bytes"] >= stats["_ball_plate_contact"]["peak_bytes"]
+
+
 if __name__ == "__main__":
     test_heading()
 
@@ -180,3 +670,33 @@ if __name__ == "__main__":
 
     test_world_to_plate_to_world()
     test_plate_to_world_to_plate()
+
+    test_plate_nor_parity()
+    test_plate_transform_parity()
+    test_surface_plane_parity()
+    test_camera_ray_contact_parity()
+    test_plate_pose_cache()
+
+    test_state_fields()
+    test_state_into()
+    test_state_tiers()
+    test_state_into_rejects_other_dtypes()
+
+    test_noise_is_seeded()
+    test_zero_noise_draws_nothing()
+
+    test_module_random_noise()
+    test_snapshot_replays()
+    test_snapshot_before_noise()
+
+    test_substep_parity()
+    test_substeps_converge()
+
+    test_advance_settled()
+    test_advance_halts()
+    test_advance_with_noise()
+    test_advance_clamped_target()
+    test_advance_negative()
+
+    test_profile_stats()
+    test_profile_allocations()
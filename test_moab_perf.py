@@ -5,121 +5,192 @@ __copyright__ = "Copyright 2020, Microsoft Corp."
 
 # pyright: strict
 
-import time
+import math
 import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
 
-from bonsai_common import Schema
-from microsoft_bonsai_api.simulator.client import BonsaiClientConfig
+import pytest
+
+from moab_bench import default_cases, format_results, run_cases, select_cases
 from moab_model import MoabModel
-from moab_sim import MoabSim
+from moab_profile import format_stats
 
 
-def run_model_for_count(count: int):
-    """ Runs the model without actions for a duration """
-    # sync the plate position with commanded position
-    model = MoabModel()
-    model.reset()
-    model.update_plate(True)
+"""
+Speed tests.
 
-    model.plate_noise = 0
-    model.ball_noise = 0
-    model.jitter = 0
+Runs the moab_bench cases and prints the percentiles of their call times.
+Timings depend on the machine and its load, so these only check that the
+cases run and their stats are consistent. Compare the speed against a
+baseline saved on the same machine with moab_bench.py instead:
 
-    # run for count
-    iterations = 0
-    while iterations < count:
-        model.step()
-        iterations += 1
+    python3 moab_bench.py --output baseline.json
+    python3 moab_bench.py --baseline baseline.json
+"""
 
+# constants for speed tests
+MAX_ITER = 250
 
-def run_sim_for_count(config: Schema, action: Schema, count: int) -> MoabSim:
-    """
-    This uses a passed in config to init the sim and then runs
-    it for a fixed duration with no actions.
+BENCH_CALLS = 1000
+BENCH_WARMUP = 100
 
-    We do not connect to the platform and drive the loop ourselves.
-    """
-    service_config = BonsaiClientConfig(workspace="moab", access_key="utah")
-    sim = MoabSim(service_config)
 
-    # run with no actions for N seconds.
-    sim.episode_start(config)
+def run_bench(*patterns: str):
+    """ runs the cases whose names match one of the fnmatch patterns """
+    cases = select_cases(default_cases(), patterns)
+    results = run_cases(cases, BENCH_CALLS, BENCH_WARMUP)
+    print(format_results(results))
+    if not results["cases"]:
+        pytest.skip("; ".join(sorted(set(results["skipped"].values()))))
 
-    # disable noise
-    sim.model.plate_noise = 0
-    sim.model.ball_noise = 0
-    sim.model.jitter = 0
+    assert set(results["cases"]) | set(results["skipped"]) == {c.name for c in cases}
+    for name, stats in results["cases"].items():
+        assert all(math.isfinite(value) for value in stats.values()), name
+        assert stats["calls"] == BENCH_CALLS
+        assert 0 < stats["median_ns"] <= stats["p95_ns"] <= stats["p99_ns"], name
 
-    iterations = 0
-    while iterations < count:
-        sim.episode_step(action)
-        iterations += 1
 
-    # return the results
-    return sim
+def test_model_perf():
+    run_bench("model_step", "model_step_noise", "model_state")
 
 
-"""
-Speed tests.
+def test_batch_perf():
+    run_bench("batch_*")
 
-Run the simulation for N runs, M times each.
-Average FPS count and assert if it drops below threshold.
 
-This tests for:
-- regressions in simulator performance
-"""
+def test_sim_perf():
+    run_bench("sim_*")
 
-# constants for speed tests
-MAX_RUNS = 10
-MAX_ITER = 250
 
-# use FPS fail limit from env if it is available
-ENV_FPS_FAIL_LIMIT = os.environ.get("MOAB_PERF_TEST_THRESHOLD")
-FPS_FAIL_LIMIT = int(ENV_FPS_FAIL_LIMIT) if ENV_FPS_FAIL_LIMIT else 500
+"""
+Substep accuracy/throughput trade-off.
 
+Runs the same open loop episode with increasing physics_substeps and
+compares the ball path against a high resolution reference, to pick the
+cheapest substep count that is still faithful.
+"""
 
-def test_model_perf():
-    avg_fps = 0
-    for _ in range(0, MAX_RUNS):
+SUBSTEP_COUNTS = (1, 2, 4, 8, 16, 32)
+SUBSTEP_REFERENCE = 1024
+SUBSTEP_ITER = 40  # the open loop controls keep the ball on the plate this long
 
-        start = time.time()
-        run_model_for_count(MAX_ITER)
-        end = time.time()
 
-        fps = MAX_ITER / (end - start)
-        avg_fps = avg_fps + fps
-    avg_fps /= MAX_RUNS
+def run_substeps(substeps: int) -> List[Tuple[float, float]]:
+    """ returns the ball path """
+    model = MoabModel()
+    model.configure({"physics_substeps": substeps})
 
-    print("model average avg fps: ", avg_fps)
-    assert (
-        avg_fps > FPS_FAIL_LIMIT
-    ), "Iteration speed for Model dropped below {} fps.".format(FPS_FAIL_LIMIT)
+    path = []  # type: List[Tuple[float, float]]
+    for i in range(SUBSTEP_ITER):
+        model.roll = 0.2 * math.sin(i * 0.5)
+        model.pitch = 0.2 * math.sin(i * 0.4 + 1.0)
+        model.step()
+        path.append((model.ball.x, model.ball.y))
+    return path
 
 
-def test_sim_perf():
-    avg_fps = 0
-    for _ in range(0, MAX_RUNS):
-        start = time.time()
-        run_sim_for_count(
-            {},
-            {
-                "input_pitch": 0.0,
-                "input_roll": 0.0,
-            },
-            MAX_ITER,
+def test_substep_tradeoff():
+    reference = run_substeps(SUBSTEP_REFERENCE)
+
+    print("substeps   max error (m)")
+    errors = []  # type: List[float]
+    for substeps in SUBSTEP_COUNTS:
+        path = run_substeps(substeps)
+        error = max(
+            math.hypot(x - ref_x, y - ref_y)
+            for (x, y), (ref_x, ref_y) in zip(path, reference)
         )
-        end = time.time()
+        errors.append(error)
+        print("{:8d}   {:13.3e}".format(substeps, error))
+
+    # error shrinks with every doubling of the substeps
+    assert errors == sorted(errors, reverse=True)
+
+    # and what the substeps cost
+    run_bench("model_step", "model_step_substeps_*")
+
+
+def test_advance_perf():
+    # test_moab_model checks that both reach the same state
+    run_bench("model_step", "model_advance")
+
+
+def test_engine_perf():
+    # test_moab_kernel checks that the engines agree. the warmup calls
+    # include compiling, or loading the cached kernel
+    run_bench("model_step", "*_numba")
+
+
+def test_step_profile():
+    # where the time of a step goes, for when the cases above regress
+    model = MoabModel()
+    model.configure({"initial_vel_x": 0.02})
+    model.enable_profiling()
+    for i in range(MAX_ITER):
+        model.roll = 0.1 * math.sin(i * 0.1)
+        model.step()
+        model.state()
+
+    stats = model.profile_stats()
+    print(format_stats(stats))
+    assert stats["step"]["calls"] == MAX_ITER
+
+
+"""
+Startup time.
+
+Imports moab_sim in a fresh interpreter under `python -X importtime`, so
+that imports which should wait until first use don't creep back into the
+startup of every simulator process. The times are printed only.
+"""
+
+# imported on first use, never at startup
+DEFERRED_IMPORTS = ("jinja2", "pyarrow", "numba")
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """ the cumulative import time (us) of every module that importing module imports """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}  # type: Dict[str, int]
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_startup_imports():
+    pytest.importorskip("bonsai_common")
+    times = import_times("moab_sim")
+    assert "moab_sim" in times
+
+    print("slowest imports (ms)")
+    top_level = [name for name in times if "." not in name]
+    for name in sorted(top_level, key=times.__getitem__, reverse=True)[:8]:
+        print("{:40s} {:8.1f}".format(name, times[name] / 1000))
 
-        fps = MAX_ITER / (end - start)
-        avg_fps = avg_fps + fps
-    avg_fps /= MAX_RUNS
+    print("moab_sim startup: {:.1f} ms".format(times["moab_sim"] / 1000))
 
-    print("simulator average avg fps: ", avg_fps)
-    assert (
-        avg_fps > FPS_FAIL_LIMIT
-    ), "Iteration speed for Simulator dropped below {} fps.".format(FPS_FAIL_LIMIT)
+    imported = [name for name in DEFERRED_IMPORTS if name in times]
+    assert not imported, "{} imported at startup".format(", ".join(imported))
 
 
 if __name__ == "__main__":
     test_model_perf()
+    test_batch_perf()
     test_sim_perf()
+    test_substep_tradeoff()
+    test_advance_perf()
+    test_engine_perf()
+    test_step_profile()
+    test_startup_imports()
@@ -0,0 +1,137 @@
+"""
+Unit tests for the Moab worker pool
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+from typing import List
+
+import numpy as np
+import pytest
+
+import moab_pool
+from moab_model import STATE_FIELDS
+from moab_pool import MoabWorkerPool
+from moab_rollout import ACTION_FIELDS
+
+NUM_ENVS = 5
+STEPS = 30
+
+# worker processes need shared memory, from Python 3.8
+HAVE_WORKERS = moab_pool.SharedMemory is not None
+WORKER_COUNTS = (0, 2) if HAVE_WORKERS else (0,)
+needs_workers = pytest.mark.skipif(
+    not HAVE_WORKERS, reason="worker processes require Python 3.8"
+)
+
+
+def actions_for(i: int) -> np.ndarray:
+    phase = np.arange(NUM_ENVS)[:, np.newaxis] + np.array([0.0, 1.5, 3.0])
+    return 0.3 * np.sin(0.2 * i + phase)
+
+
+def make_pool(workers: int) -> MoabWorkerPool:
+    return MoabWorkerPool(NUM_ENVS, STATE_FIELDS, ACTION_FIELDS, 100, workers)
+
+
+def test_pool_pipelined():
+    # two steps in flight give the same results as stepping in lockstep, as
+    # long as the second step's actions don't depend on the first's results
+    results = []  # type: List[List[np.ndarray]]
+    runs = ((0, 1), (2, 1), (2, 2)) if HAVE_WORKERS else ((0, 1),)
+    for workers, in_flight in runs:
+        with make_pool(workers) as pool:
+            observations = [pool.reset([{}] * NUM_ENVS, list(range(NUM_ENVS))).copy()]
+            for i in range(0, STEPS, in_flight):
+                for j in range(in_flight):
+                    pool.step_async(actions_for(i + j))
+                for _ in range(in_flight):
+                    observations.append(pool.step_wait()[0].copy())
+            results.append(observations)
+
+    for result in results[1:]:
+        assert np.array_equal(np.array(result), np.array(results[0]))
+
+
+@needs_workers
+def test_pool_ring_full():
+    with make_pool(2) as pool:
+        pool.reset([{}] * NUM_ENVS, [None] * NUM_ENVS)
+        pool.step_async(actions_for(0))
+        pool.step_async(actions_for(1))
+        try:
+            pool.step_async(actions_for(2))
+            assert False, "expected a RuntimeError"
+        except RuntimeError:
+            pass
+        pool.step_wait()
+        pool.step_wait()
+
+
+@needs_workers
+def test_pool_worker_error():
+    with make_pool(2) as pool:
+        try:
+            pool.reset([{"physics_substeps": "many"}] * NUM_ENVS, [None] * NUM_ENVS)
+            assert False, "expected a RuntimeError"
+        except RuntimeError as e:
+            assert "ValueError" in str(e)
+
+        # the workers carry on
+        pool.reset([{}] * NUM_ENVS, [None] * NUM_ENVS)
+        pool.step_async(actions_for(0))
+        assert pool.step_wait()[0].shape == (NUM_ENVS, len(STATE_FIELDS))
+
+
+def test_pool_recovers_from_bad_calls():
+    for workers in WORKER_COUNTS:
+        with make_pool(workers) as pool:
+            if workers == 0:
+                # the local slice raises the config's error itself
+                try:
+                    pool.reset(
+                        [{"physics_substeps": "many"}] * NUM_ENVS, [None] * NUM_ENVS
+                    )
+                    assert False, "expected a ValueError"
+                except ValueError:
+                    pass
+            pool.reset([{}] * NUM_ENVS, [None] * NUM_ENVS)
+
+            # (NUM_ENVS, 1) would broadcast to every control
+            for shape in ((NUM_ENVS, 1), (3, 3), (NUM_ENVS,)):
+                try:
+                    pool.step_async(np.zeros(shape))
+                    assert False, "expected a ValueError"
+                except ValueError:
+                    pass
+
+            # nothing was left in flight
+            for i in range(3):
+                pool.step_async(actions_for(i))
+                assert pool.step_wait()[0].shape == (NUM_ENVS, len(STATE_FIELDS))
+            pool.reset([{}] * NUM_ENVS, [None] * NUM_ENVS)
+
+
+def test_pool_without_shared_memory():
+    # as on Python 3.7, where the in-process pool still works
+    shared_memory = moab_pool.SharedMemory
+    moab_pool.SharedMemory = None
+    try:
+        try:
+            make_pool(2)
+            assert False, "expected a RuntimeError"
+        except RuntimeError as e:
+            assert "Python 3.8" in str(e)
+        with make_pool(0) as pool:
+            pool.reset([{}] * NUM_ENVS, [None] * NUM_ENVS)
+    finally:
+        moab_pool.SharedMemory = shared_memory
+
+
+if __name__ == "__main__":
+    test_pool_pipelined()
+    test_pool_ring_full()
+    test_pool_worker_error()
+    test_pool_recovers_from_bad_calls()
+    test_pool_without_shared_memory()
@@ -0,0 +1,49 @@
+"""
+Unit tests for the Moab profiling helpers
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import numpy as np
+
+from moab_profile import LatencyHistogram, format_latency
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(precision_bits=7)
+    values = np.random.default_rng(1).lognormal(12.0, 1.0, 10000).astype(int)
+    for value in values:
+        histogram.record(int(value))
+
+    # each percentile within the 1/64 precision of the exact one
+    ranked = np.sort(values)
+    for percent in (50.0, 90.0, 99.0, 99.9):
+        exact = ranked[int(len(values) * percent / 100.0 + 0.5) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= exact / 64
+
+    stats = histogram.summary()
+    assert stats["count"] == len(values)
+    assert stats["max_ns"] == values.max()
+    assert histogram.percentile(100.0) == values.max()
+
+    # beyond max_ns is counted in the last bucket, with the exact maximum kept
+    histogram.reset()
+    histogram.record(2 ** 50)
+    assert histogram.counts[-1] == 1 and histogram.percentile(50.0) == 2 ** 50
+
+
+def test_format_latency():
+    recorded, empty = LatencyHistogram(), LatencyHistogram()
+    for value in (1000, 2000, 3000):
+        recorded.record(value)
+    lines = format_latency({"episode_step": recorded, "wait": empty}).splitlines()
+
+    # a header, and a row for the histogram with counts only
+    assert len(lines) == 2
+    assert lines[1].split()[:2] == ["episode_step", "3"]
+
+
+if __name__ == "__main__":
+    test_latency_histogram()
+    test_format_latency()
@@ -0,0 +1,167 @@
+"""
+Unit tests for the Moab episode recorder
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import math
+import os
+import tempfile
+from typing import List
+
+import numpy as np
+import pytest
+
+from moab_model import STATE_FIELDS, MoabModel
+from moab_recorder import (
+    CONTROL_FIELDS,
+    HAVE_PYARROW,
+    RECORD_FIELDS,
+    STORE_ROWS_FILE,
+    TrajectoryRecorder,
+    TrajectoryStore,
+    config_hash,
+    load_episodes,
+)
+
+
+def record_episodes(recorder: TrajectoryRecorder, steps: List[int]) -> List[np.ndarray]:
+    """ records one episode per entry of steps, returns the expected states """
+    expected = []  # type: List[np.ndarray]
+    for index, count in enumerate(steps):
+        config = {"initial_x": 0.001 * index, "initial_pitch": 0.1}
+        model = MoabModel()
+        model.configure(config)
+        recorder.start(config, model)
+
+        states = [model.state_array()]
+        for i in range(count):
+            model.apply_action({"input_roll": 0.01 * i})
+            model.step()
+            recorder.record(model)
+            states.append(model.state_array())
+        recorder.finish("reason {}".format(index))
+        expected.append(np.array(states))
+    return expected
+
+
+def check_recording(format: str):
+    with tempfile.TemporaryDirectory() as folder:
+        # a small capacity makes the longer episode grow its buffer
+        with TrajectoryRecorder(folder, format, capacity=8) as recorder:
+            expected = record_episodes(recorder, [5, 20, 0])
+        episodes = load_episodes(folder)
+
+    assert [episode.index for episode in episodes] == [0, 1, 2]
+    for index, (episode, states) in enumerate(zip(episodes, expected)):
+        assert episode.reason == "reason {}".format(index)
+        assert episode.config["initial_x"] == 0.001 * index
+
+        recorded = np.stack([episode.columns[name] for name in STATE_FIELDS], axis=1)
+        assert np.array_equal(recorded, states)
+
+        roll = episode.columns["input_roll"]
+        assert math.isnan(roll[0])
+        assert list(roll[1:]) == [0.01 * i for i in range(len(roll) - 1)]
+        assert set(CONTROL_FIELDS) <= set(episode.columns)
+
+
+def test_record_npz():
+    check_recording("npz")
+
+
+def test_record_parquet():
+    if not HAVE_PYARROW:
+        pytest.skip("pyarrow is not installed")
+    check_recording("parquet")
+
+
+def test_unfinished_episode_is_flushed():
+    with tempfile.TemporaryDirectory() as folder:
+        recorder = TrajectoryRecorder(folder, "npz")
+        model = MoabModel()
+        recorder.start({}, model)
+        recorder.start({}, model)
+        recorder.close()
+        episodes = load_episodes(folder)
+
+    assert [episode.reason for episode in episodes] == ["", ""]
+
+
+def test_reopened_recording_continues():
+    with tempfile.TemporaryDirectory() as folder:
+        with TrajectoryRecorder(folder, "npz") as recorder:
+            record_episodes(recorder, [2, 3])
+
+        # a restarted simulator recording into the same directory
+        with TrajectoryRecorder(folder, "npz") as recorder:
+            assert recorder.episode_count == 2
+            record_episodes(recorder, [4])
+        episodes = load_episodes(folder)
+
+    assert [episode.index for episode in episodes] == [0, 1, 2]
+    assert [episode.reason for episode in episodes] == [
+        "reason 0",
+        "reason 1",
+        "reason 0",
+    ]
+    assert [len(episode.columns["ball_x"]) for episode in episodes] == [3, 4, 5]
+
+
+def test_record_store():
+    with tempfile.TemporaryDirectory() as folder:
+        with TrajectoryRecorder(folder, "store", capacity=8) as recorder:
+            expected = record_episodes(recorder, [5, 20])
+
+        # a second session appends to the same store
+        with TrajectoryRecorder(folder, "store") as recorder:
+            assert recorder.episode_count == 2
+            expected += record_episodes(recorder, [3])
+
+        store = TrajectoryStore(folder)
+        assert len(store) == 3
+        assert store.row_count == sum(len(states) for states in expected)
+        for entry, states in zip(store.entries, expected):
+            episode = store.episode(entry.episode)
+            assert isinstance(episode, np.memmap)
+            assert np.array_equal(episode[:, : len(STATE_FIELDS)], states)
+        assert [entry.reason for entry in store.entries] == [
+            "reason 0",
+            "reason 1",
+            "reason 0",
+        ]
+        assert store.entries[0].config_hash == store.entries[2].config_hash
+        assert store.entries[0].config_hash == config_hash(
+            {"initial_pitch": 0.1, "initial_x": 0.0}
+        )
+
+        ball_x = store.column("ball_x")
+        assert len(ball_x) == store.row_count
+        assert np.shares_memory(ball_x, store.rows())
+
+
+def test_store_ignores_interrupted_append():
+    rows = np.arange(4 * len(RECORD_FIELDS), dtype=np.float64)
+    rows = rows.reshape(4, len(RECORD_FIELDS))
+    with tempfile.TemporaryDirectory() as folder:
+        store = TrajectoryStore(folder)
+        store.append(rows, {}, "done")
+
+        # rows without an index entry, as left by a crash mid append
+        with open(os.path.join(folder, STORE_ROWS_FILE), "ab") as file:
+            file.write(rows[:2].tobytes()[:-3])
+
+        store = TrajectoryStore(folder)
+        assert store.row_count == 4
+        store.append(rows[::-1], {}, "done")
+        assert np.array_equal(TrajectoryStore(folder).episode(1), rows[::-1])
+
+
+if __name__ == "__main__":
+    test_record_npz()
+    test_record_parquet()
+    test_unfinished_episode_is_flushed()
+    test_reopened_recording_continues()
+    test_record_store()
+    test_store_ignores_interrupted_append()
@@ -0,0 +1,94 @@
+"""
+Unit tests for the local Moab rollout runner
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+import os
+from typing import Dict
+
+import numpy as np
+
+from moab_model import Config, MoabModel
+from moab_rollout import (
+    ACTION_FIELDS,
+    load_episode_configs,
+    rollout,
+    run_episode,
+    zero_policy,
+)
+
+ASSESS_CONFIG = os.path.join(os.path.dirname(__file__), "assess_config.json")
+
+
+def tilt_policy(state: Dict[str, float]) -> Config:
+    """ tilts the plate towards the ball, a pool picklable policy """
+    return {
+        "input_pitch": -10.0 * state["estimated_y"],
+        "input_roll": 10.0 * state["estimated_x"],
+    }
+
+
+def test_episode_matches_model():
+    config = {"initial_x": 0.02, "initial_vel_y": 0.05}
+    trajectory = run_episode(config, tilt_policy, iteration_limit=40)
+
+    model = MoabModel()
+    model.configure(config)
+    assert np.array_equal(trajectory.states[0], model.state_array())
+    for i in range(trajectory.iterations):
+        model.apply_action(tilt_policy(model.state()))
+        model.step()
+        assert np.array_equal(trajectory.states[i + 1], model.state_array())
+    assert trajectory.actions.shape == (trajectory.iterations, len(ACTION_FIELDS))
+
+
+def test_episode_ends():
+    # a flat plate and a still ball runs to the limit
+    trajectory = run_episode({}, zero_policy, iteration_limit=25)
+    assert not trajectory.halted
+    assert trajectory.iterations == 25
+    assert trajectory.states.shape[0] == 26
+
+    # a fast ball rolls off the plate early
+    trajectory = run_episode({"initial_vel_x": 1.0}, zero_policy)
+    assert trajectory.halted
+    assert trajectory.iterations < 25
+    assert trajectory.state("ball_fell_off")[-1] == 1
+
+
+def test_rollout_is_seeded():
+    configs = load_episode_configs(ASSESS_CONFIG) * 3
+    configs = [dict(config, ball_noise=0.001, plate_noise=0.01) for config in configs]
+
+    local = rollout(configs, tilt_policy, workers=1, seed=7, iteration_limit=50)
+    pooled = rollout(configs, tilt_policy, workers=2, seed=7, iteration_limit=50)
+    assert [t.index for t in pooled] == list(range(len(configs)))
+    for a, b in zip(local, pooled):
+        assert np.array_equal(a.states, b.states)
+
+    # each repeat of a config gets its own noise
+    assert not np.array_equal(local[0].states, local[2].states)
+
+
+def test_rollout_ignores_unset_config_seed():
+    # -1 is the interface default, which leaves the rollout's seed in charge
+    configs = [{"seed": -1, "ball_noise": 0.001, "plate_noise": 0.01}] * 2
+    first = rollout(configs, tilt_policy, workers=1, seed=7, iteration_limit=50)
+    second = rollout(configs, tilt_policy, workers=1, seed=7, iteration_limit=50)
+    for a, b in zip(first, second):
+        assert np.array_equal(a.states, b.states)
+    assert not np.array_equal(first[0].states, first[1].states)
+
+    # and a seed of 0 or more still takes precedence
+    fixed = [dict(config, seed=3) for config in configs]
+    first = rollout(fixed, tilt_policy, workers=1, seed=7, iteration_limit=50)
+    assert np.array_equal(first[0].states, first[1].states)
+
+
+if __name__ == "__main__":
+    test_episode_matches_model()
+    test_episode_ends()
+    test_rollout_is_seeded()
+    test_rollout_ignores_unset_config_seed()
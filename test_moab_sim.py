@@ -9,11 +9,13 @@ __copyright__ = "Copyright 2020, Microsoft Corp."
 # pyright: strict, reportIncompatibleMethodOverride=false
 
 import math
+import tempfile
 from typing import Any, Dict, Iterator, TypeVar, cast
 
 from microsoft_bonsai_api.simulator.client import BonsaiClientConfig
 from bonsai_common import Schema
-from moab_model import DEFAULT_PLATE_RADIUS
+from moab_model import DEFAULT_PLATE_RADIUS, STATIC_STATE_FIELDS, merge_state
+from moab_recorder import TrajectoryRecorder, load_episodes
 from moab_sim import MoabSim
 
 _KT = TypeVar("_KT")
@@ -149,6 +151,65 @@ def test_angle2():
     assert direction < 0.0, "Direction should be negative"
 
 
+def test_split_state():
+    """ static fields are sent once per episode when split_state is on """
+    service_config = BonsaiClientConfig(workspace="moab", access_key="utah")
+    sim = MoabSim(service_config, split_state=True)
+
+    for _ in range(2):
+        sim.episode_start({"target_x": 0.01})
+        first = sim.get_state()
+        assert first == sim.model.state()
+
+        sim.episode_step({"input_roll": 0.1})
+        step = sim.get_state()
+        assert not set(STATIC_STATE_FIELDS) & set(step)
+        assert merge_state(first, step) == sim.model.state()
+
+
+def test_recorder():
+    """ episodes are recorded locally when a recorder is given """
+    service_config = BonsaiClientConfig(workspace="moab", access_key="utah")
+    with tempfile.TemporaryDirectory() as folder:
+        with TrajectoryRecorder(folder, "npz") as recorder:
+            sim = MoabSim(service_config, recorder=recorder)
+            sim.episode_start({"initial_x": 0.01})
+            for _ in range(3):
+                sim.episode_step({"input_roll": 0.1})
+            sim.episode_finish("done")
+        episodes = load_episodes(folder)
+
+    assert len(episodes) == 1
+    assert episodes[0].reason == "done"
+    assert episodes[0].config == {"initial_x": 0.01}
+    assert len(episodes[0].columns["ball_x"]) == 4
+    assert episodes[0].columns["ball_x"][-1] == sim.model.ball.x
+
+
+def test_latency():
+    """ the latency of every callback is counted for the session """
+    service_config = BonsaiClientConfig(workspace="moab", access_key="utah")
+    sim = MoabSim(service_config)
+    for _ in range(2):
+        sim.episode_start({"initial_x": 0.01})
+        for _ in range(5):
+            sim.get_state()
+            sim.episode_step({"input_roll": 0.1})
+            sim.mark_wait(10 ** 9)
+        sim.episode_finish("done")
+
+    counts = {name: histogram.count for name, histogram in sim.latency.items()}
+    assert counts == {
+        "episode_start": 2,
+        "episode_step": 10,
+        "get_state": 10,
+        "wait": 10,
+    }
+
+    # the wait excludes the callbacks of the loop iteration
+    assert 0 < sim.latency["wait"].max < 10 ** 9
+
+
 class KeyProbe(Dict[_KT, _VT]):
     """
     A "dictionary" that checks to see which keys
@@ -262,3 +323,6 @@ if __name__ == "__main__":
     test_away()
     test_angle()
     test_angle2()
+    test_split_state()
+    test_recorder()
+    test_latency()
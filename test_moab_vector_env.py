@@ -0,0 +1,192 @@
+"""
+Unit tests for the vectorized Moab environments
+"""
+__copyright__ = "Copyright 2021, Microsoft Corp."
+
+# pyright: strict
+
+from typing import Any, Dict
+
+import numpy as np
+import pytest
+
+import moab_pool
+from moab_model import STATE_FIELDS, MoabModel
+from moab_vector_env import FINAL_MASK, FINAL_OBSERVATION, MoabVectorEnv
+
+NUM_ENVS = 6
+
+# worker processes need shared memory, from Python 3.8
+HAVE_WORKERS = moab_pool.SharedMemory is not None
+WORKER_COUNTS = (0, 2) if HAVE_WORKERS else (0,)
+NOISY_CONFIG = {"ball_noise": 0.001, "plate_noise": 0.01, "jitter": 0.002}
+
+
+def sweep_actions(i: int, num_envs: int = NUM_ENVS) -> np.ndarray:
+    """ different controls per environment and step, enough to halt some """
+    phase = np.arange(num_envs)[:, np.newaxis] + np.array([0.0, 1.5, 3.0])
+    return 0.5 * np.sin(0.2 * i + phase)
+
+
+def test_vector_env_matches_model():
+    configs = [{"initial_x": 0.01 * i} for i in range(NUM_ENVS)]
+    with MoabVectorEnv(NUM_ENVS) as env:
+        observations, _ = env.reset(configs)
+        models = []
+        for config in configs:
+            model = MoabModel()
+            model.configure(config)
+            models.append(model)
+        assert np.array_equal(observations, [m.state_array() for m in models])
+
+        for i in range(20):
+            actions = 0.2 * sweep_actions(i)
+            observations, _, terminated, _, _ = env.step(actions)
+            for model, action in zip(models, actions):
+                model.apply_action(
+                    dict(zip(("input_pitch", "input_roll", "input_height_z"), action))
+                )
+                model.step()
+            assert not terminated.any()
+            assert np.array_equal(observations, [m.state_array() for m in models])
+
+
+def test_vector_env_autoreset():
+    fields = ("ball_x", "ball_y")
+    with MoabVectorEnv(
+        2, observation_fields=fields, action_fields=("input_roll",), iteration_limit=20
+    ) as env:
+        initial, _ = env.reset({"initial_x": 0.08})
+
+        # tipped hard right the first ball rolls off, the second stays put
+        steps = 0
+        terminated = np.zeros(2, dtype=bool)
+        while not terminated.any():
+            observations, _, terminated, truncated, infos = env.step(
+                np.array([[1.0], [0.0]])
+            )
+            steps += 1
+        assert terminated.tolist() == [True, False]
+        assert not truncated.any()
+        assert infos[FINAL_MASK].tolist() == [True, False]
+        assert infos[FINAL_OBSERVATION][0, 0] > 0.08
+        assert np.array_equal(observations[0], initial[0])
+
+        # and the second is truncated at the iteration limit
+        for _ in range(20 - steps):
+            observations, _, terminated, truncated, infos = env.step(
+                np.array([[0.0], [0.0]])
+            )
+        assert truncated.tolist() == [False, True]
+        assert not terminated.any()
+        assert infos[FINAL_MASK].tolist() == [False, True]
+        assert np.array_equal(observations[1], initial[1])
+
+
+def test_vector_env_reward():
+    def distance(observations: np.ndarray) -> np.ndarray:
+        return -np.hypot(observations[:, 0], observations[:, 1])
+
+    with MoabVectorEnv(
+        NUM_ENVS, observation_fields=("ball_x", "ball_y"), reward=distance
+    ) as env:
+        env.reset({"initial_x": 0.02})
+        observations, rewards, _, _, _ = env.step(np.zeros((NUM_ENVS, 3)))
+        assert np.allclose(rewards, distance(observations))
+
+
+@pytest.mark.skipif(not HAVE_WORKERS, reason="worker processes require Python 3.8")
+def test_vector_env_workers():
+    # the same seeded episodes, in this process and split across workers
+    results = []
+    halts = 0
+    for workers in (0, 2):
+        with MoabVectorEnv(NUM_ENVS, workers=workers) as env:
+            steps = [env.reset(NOISY_CONFIG, seed=3)[0]]
+            for i in range(60):
+                observations, _, terminated, _, _ = env.step(sweep_actions(i))
+                steps.extend((observations, terminated))
+                halts += int(terminated.sum())
+            results.append(steps)
+
+    # including some autoresets
+    assert halts > 0
+    for single, split in zip(*results):
+        assert np.array_equal(single, split)
+
+
+def first_episodes(env: MoabVectorEnv, config: Dict[str, Any], count: int):
+    """ the ball_x of environment 0 through its first `count` episodes """
+    episodes = [[env.reset(config)[0][0, 0]]]
+    while len(episodes) <= count:
+        observations, _, terminated, truncated, infos = env.step(
+            np.full((env.num_envs, 1), 0.5)
+        )
+        if terminated[0] or truncated[0]:
+            episodes[-1].append(infos[FINAL_OBSERVATION][0, 0])
+            episodes.append([])
+        episodes[-1].append(observations[0, 0])
+    return [np.array(episode) for episode in episodes[:count]]
+
+
+def test_vector_env_autoreset_seeded_config():
+    # a seed in the config seeds the first episode, not every autoreset
+    config = dict(NOISY_CONFIG, seed=11)
+    results = []
+    # twice in this process, and split across workers when available
+    for workers in (0,) + WORKER_COUNTS:
+        with MoabVectorEnv(
+            2,
+            observation_fields=("ball_x",),
+            action_fields=("input_roll",),
+            iteration_limit=30,
+            workers=workers,
+        ) as env:
+            results.append(first_episodes(env, config, 3))
+
+    first, second, third = results[0]
+    assert not np.array_equal(first, second)
+    assert not np.array_equal(second, third)
+
+    # and the autoreset seeds are reproducible
+    for result in results[1:]:
+        for expected, episode in zip(results[0], result):
+            assert np.array_equal(expected, episode)
+
+
+def test_vector_env_recovers_from_errors():
+    for workers in WORKER_COUNTS:
+        with MoabVectorEnv(NUM_ENVS, workers=workers) as env:
+            with pytest.raises((ValueError, RuntimeError)):
+                env.reset({"physics_substeps": "many"})
+            env.reset({})
+
+            with pytest.raises(ValueError):
+                env.step(np.zeros((3, 3)))
+            with pytest.raises(ValueError):
+                env.step(np.zeros((NUM_ENVS, 1)))
+
+            for i in range(3):
+                observations, _, _, _, _ = env.step(sweep_actions(i))
+                assert observations.shape == (NUM_ENVS, len(STATE_FIELDS))
+            env.reset({})
+
+
+def test_vector_env_spaces():
+    pytest.importorskip("gymnasium")
+    with MoabVectorEnv(NUM_ENVS, action_fields=("input_pitch", "input_roll")) as env:
+        assert env.single_observation_space.shape == (len(STATE_FIELDS),)
+        assert env.action_space.shape == (NUM_ENVS, 2)
+        observations, _ = env.reset()
+        assert env.observation_space.contains(observations)
+        assert env.action_space.contains(env.action_space.sample())
+
+
+if __name__ == "__main__":
+    test_vector_env_matches_model()
+    test_vector_env_autoreset()
+    test_vector_env_reward()
+    test_vector_env_workers()
+    test_vector_env_autoreset_seeded_config()
+    test_vector_env_recovers_from_errors()
+    test_vector_env_spaces()